@@ -1,5 +1,6 @@
 import json
-from api import get_accounts, get_transactions, get_balance
+from api import get_accounts, get_transactions, get_balance, get_direct_debits
+from records import Balance, Transaction
 
 
 def save_accounts(access_token):
@@ -76,19 +77,31 @@ def get_account_id_by_name(name):
     print(f"Account '{name}' not found")
     return None
 
-def fetching_all_transactions(access_token):
+def _convert_transactions(results, acc_id):
+    """Transaction records for one account's results, skipping (and logging) any that can't be parsed."""
+    transactions = []
+    for result in results:
+        try:
+            transactions.append(Transaction.from_api(result, acc_id))
+        except (TypeError, KeyError, ValueError) as e:
+            print(f"Skipping malformed transaction for account {acc_id}: {e!r}")
+    return transactions
+
+def fetching_all_transactions(access_token, account_ids=None):
     """
     Fetch all transactions for all accounts.
 
     Args:
         access_token (str): Valid TrueLayer access token for API authentication
+        account_ids (list): Accounts to fetch (default: those in accounts.json)
 
     Returns:
-        dict: Dictionary mapping account IDs to their transaction lists.
-              Format: {account_id: [transaction1, transaction2, ...]}
+        dict: Dictionary mapping account IDs to their transactions as records.
+              Format: {account_id: [Transaction, Transaction, ...]}
               Returns None if no accounts found or all fetches failed.
     """
-    account_ids = get_account_ids()
+    if account_ids is None:
+        account_ids = get_account_ids()
     if not account_ids:
         print("No accounts found")
         return None
@@ -99,30 +112,68 @@ def fetching_all_transactions(access_token):
         try:
             response = get_transactions(access_token, acc_id)
             if response and "results" in response:
-                all_transactions[acc_id] = response["results"]
+                # Converted per account, so only one account's raw JSON is alive at a time
+                all_transactions[acc_id] = _convert_transactions(response["results"], acc_id)
             else:
                 print(f"No transactions for account {acc_id}")
-        except (TypeError, KeyError) as e:
+        except (TypeError, KeyError, ValueError) as e:
             print(f"Error fetching transactions for account {acc_id}: {e}")
             continue
 
     return all_transactions if all_transactions else None
 
 
-def get_all_accounts_balance(access_token):
+def fetching_all_direct_debits(access_token, account_ids=None):
+    """
+    Fetch direct debit mandates for all accounts.
+
+    Args:
+        access_token (str): Valid TrueLayer access token
+        account_ids (list): Accounts to fetch (default: those in accounts.json)
+
+    Returns:
+        dict: Dictionary mapping account IDs to their direct debit lists.
+              Format: {account_id: [direct_debit1, ...]}
+              Returns None if no accounts found.
+              Accounts whose provider doesn't support direct debits are left out.
+    """
+    if account_ids is None:
+        account_ids = get_account_ids()
+    if not account_ids:
+        print("No accounts found")
+        return None
+
+    direct_debits = {}
+    for acc_id in account_ids:
+        try:
+            response = get_direct_debits(access_token, acc_id)
+            if response and "results" in response:
+                direct_debits[acc_id] = response["results"]
+            else:
+                print(f"No direct debits for account {acc_id}")
+        except (TypeError, KeyError) as e:
+            print(f"Error fetching direct debits for account {acc_id}: {e}")
+            continue
+
+    return direct_debits
+
+
+def get_all_accounts_balance(access_token, account_ids=None):
     """
     Fetch current balance information for all accounts.
 
     Args:
         access_token (str): Valid TrueLayer access token
+        account_ids (list): Accounts to fetch (default: those in accounts.json)
 
     Returns:
-        dict: Dictionary mapping account IDs to their balance info.
-              Format: {account_id: {'currency': 'GBP', 'current': 22.0, 'available': 222.0, ...}}
+        dict: Dictionary mapping account IDs to their balance records.
+              Format: {account_id: Balance}
               Returns None if no accounts found.
               Returns empty dict if all balance fetches failed.
     """
-    account_ids = get_account_ids()
+    if account_ids is None:
+        account_ids = get_account_ids()
     if not account_ids:
         print("No accounts found")
         return None
@@ -133,7 +184,7 @@ def get_all_accounts_balance(access_token):
         try:
             response = get_balance(access_token, acc_id)
             if response["results"]:
-                balances[acc_id] = response["results"][0]
+                balances[acc_id] = Balance.from_api(response["results"][0], acc_id)
             else:
                 print(f"No balance info found for id: {acc_id}")
         except (TypeError, KeyError) as e:
@@ -143,12 +194,13 @@ def get_all_accounts_balance(access_token):
     return balances
 
 
-def get_current_balances(access_token):
+def get_current_balances(access_token, account_ids=None):
     """
     Fetch available balance for all accounts.
 
     Args:
         access_token (str): Valid TrueLayer access token
+        account_ids (list): Accounts to fetch (default: those in accounts.json)
 
     Returns:
         dict: Dictionary mapping account IDs to available balance amounts.
@@ -156,7 +208,8 @@ def get_current_balances(access_token):
               Returns None if no accounts found.
               Returns empty dict if all balance fetches failed.
     """
-    account_ids = get_account_ids()
+    if account_ids is None:
+        account_ids = get_account_ids()
     if not account_ids:
         print("No accounts found")
         return None
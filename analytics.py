@@ -0,0 +1,318 @@
+import threading
+from datetime import date, datetime, timedelta
+
+from anomalies import ANOMALY_THRESHOLD
+from change_events import change_horizon
+from db import pinned_reads, read_connection
+from db_queries import iter_query_chunks
+from lazy_imports import np, pd
+from storage import get_backend
+from timeseries import balance_series, CHART_POINTS
+
+DAYS_MAP = {
+    "Last 7 days": 7,
+    "Last 30 days": 30,
+    "Last 3 months": 90,
+    "Last 6 months": 180,
+    "All time": None
+}
+
+
+def _encode(values):
+    """
+    Dictionary-encode a column.
+
+    Returns:
+        tuple: (codes as int32 array, labels list). Nulls get their own code
+               so they group like SQL GROUP BY does.
+    """
+    categorical = pd.Categorical(values)
+    labels = list(categorical.categories) + [None]
+    codes = categorical.codes.astype(np.int32)
+    codes[codes == -1] = len(labels) - 1
+    return codes, labels
+
+
+class TransactionFrame:
+    """
+    Immutable columnar snapshot of the transactions table.
+
+    Rows are sorted by transaction_date so any time_frame is a contiguous
+    slice found with searchsorted; month, category and account are
+    dictionary-encoded so aggregates are single np.bincount passes.
+    """
+
+    def __init__(self, df):
+        df = df.sort_values("transaction_date", kind="stable").reset_index(drop=True)
+        df["account_id"] = df["account_id"].astype("category")
+        self.df = df
+        self.dates = df["transaction_date"].to_numpy(dtype="datetime64[ns]")
+        self.amounts = df["amount"].to_numpy(dtype=np.float64)
+        self.month_codes, self.month_labels = _encode(df["transaction_date"].dt.strftime("%Y-%m"))
+        self.category_codes, self.category_labels = _encode(df["category"])
+
+    def start_index(self, cutoff):
+        """Index of the first row on or after cutoff (a date or None)."""
+        if cutoff is None:
+            return 0
+        return int(np.searchsorted(self.dates, np.datetime64(cutoff, "ns"), side="left"))
+
+
+class AnalyticsEngine:
+    """
+    In-memory analytics over transactions and balance_history.
+
+    Loads both tables once, then refreshes incrementally: change_log (see
+    change_events) is the watermark, and only rows on or after the earliest
+    date touched by new changes are re-read. Every days_map aggregate from
+    db_queries is answered from the frame with vectorised numpy passes and
+    memoised until the next refresh that changes data.
+
+    Methods return DataFrames with the same columns as their db_queries
+    counterparts, so they can be swapped in directly.
+    """
+
+    def __init__(self):
+        self.watermark = None
+        self._transactions = None
+        self._balances = None
+        self._memo = {}
+        self._lock = threading.Lock()
+
+    #---------- LOADING ----------#
+
+    def refresh(self):
+        """
+        Pull in any changes since the last refresh.
+
+        Returns:
+            bool: True if data changed
+        """
+        # One read target for the watermark and the rows it covers
+        with self._lock, pinned_reads():
+            # Read the watermark before the data: anything committed in between
+            # is simply re-read on the next refresh
+            with read_connection() as conn:
+                cursor = conn.cursor()
+                watermark = change_horizon(cursor)
+                if self.watermark is None:
+                    changes = None
+                else:
+                    order = get_backend().CHANGE_ORDER
+                    cursor.execute(f"""
+                        SELECT table_name, MIN(COALESCE(date_from, '0001-01-01'))
+                        FROM finance_sandbox.change_log
+                        WHERE {order} >= %s AND {order} < %s
+                        GROUP BY table_name
+                    """, (self.watermark, watermark))
+                    changes = {table: str(since)[:10] for table, since in cursor.fetchall()}
+                    if not changes:
+                        self.watermark = watermark
+                        return False
+                cursor.close()
+
+            if changes is None:
+                transactions = self._load_transactions()
+                balances = self._load_balances()
+            else:
+                transactions = self._transactions.df
+                balances = self._balances
+                if "transactions" in changes:
+                    since = self._since(changes["transactions"])
+                    fresh = self._load_transactions(since)
+                    keep = transactions[transactions["transaction_date"] < pd.Timestamp(since)] if since else None
+                    transactions = pd.concat([keep, fresh], ignore_index=True)
+                if "balance_history" in changes:
+                    since = self._since(changes["balance_history"])
+                    fresh = self._load_balances(since)
+                    keep = balances[balances["snapshot_date"] < pd.Timestamp(since)] if since else None
+                    balances = pd.concat([keep, fresh], ignore_index=True)
+
+            self._transactions = TransactionFrame(transactions)
+            self._balances = balances.sort_values("snapshot_date", kind="stable").reset_index(drop=True)
+            self._memo = {}
+            self.watermark = watermark
+            return True
+
+    @staticmethod
+    def _since(date_from):
+        # Changes without a date range (the COALESCE sentinel) force a full reload
+        return None if date_from == "0001-01-01" else date_from
+
+    @staticmethod
+    def _stream(query, columns, since_column, since):
+        # Chunks are converted to columnar frames as they arrive, so the full
+        # result never sits in memory as a list of row tuples
+        params = ()
+        if since:
+            query += f" WHERE {since_column} >= %s"
+            params = (since,)
+        chunks = list(iter_query_chunks(query, params, columns=columns, replica=True))
+        return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=columns)
+
+    def _load_transactions(self, since=None):
+        columns = ["transaction_id", "account_id", "amount", "description", "merchant_name", "category",
+                   "anomaly_score", "transaction_date"]
+        df = self._stream(f"SELECT {', '.join(columns)} FROM finance_sandbox.transactions",
+                          columns, "transaction_date", since)
+        df["amount"] = df["amount"].astype(np.float64)
+        df["anomaly_score"] = df["anomaly_score"].astype(np.float64)
+        df["transaction_date"] = pd.to_datetime(df["transaction_date"])
+        return df
+
+    def _load_balances(self, since=None):
+        columns = ["account_id", "current_balance", "available_balance", "overdraft_limit", "snapshot_date"]
+        df = self._stream(f"SELECT {', '.join(columns)} FROM finance_sandbox.balance_history",
+                          columns, "snapshot_date", since)
+        for column in ["current_balance", "available_balance", "overdraft_limit"]:
+            df[column] = df[column].astype(np.float64)
+        df["snapshot_date"] = pd.to_datetime(df["snapshot_date"])
+        df["account_id"] = df["account_id"].astype("category")
+        return df
+
+    def _snapshot(self):
+        if self._transactions is None:
+            self.refresh()
+        return self._transactions
+
+    def _memoised(self, key, compute):
+        # Keyed by cutoff date, not label, so "Last 7 days" rolls over at midnight
+        # (balance series, padded to today, also key on today's date).
+        # refresh() swaps in a new dict; grabbing it first means a result computed
+        # during a refresh can never land in the new memo.
+        memo = self._memo
+        if key not in memo:
+            memo[key] = compute()
+        return memo[key]
+
+    @staticmethod
+    def _cutoff(time_frame):
+        days = DAYS_MAP[time_frame]
+        if not days:
+            return None
+        return (datetime.now() - timedelta(days=days)).date()
+
+    #---------- AGGREGATES ----------#
+
+    def spending_by_months(self, time_frame="All time"):
+        """Spending per month (columns: month, spending)."""
+        def compute():
+            frame = self._snapshot()
+            start = frame.start_index(self._cutoff(time_frame))
+            amounts = frame.amounts[start:]
+            spend = amounts < 0
+            codes = frame.month_codes[start:][spend]
+            size = len(frame.month_labels)
+            totals = np.bincount(codes, weights=amounts[spend], minlength=size)
+            present = np.bincount(codes, minlength=size) > 0
+            return pd.DataFrame({
+                "month": np.array(frame.month_labels, dtype=object)[present],
+                "spending": np.abs(totals[present]),
+            })
+        return self._memoised(("spending_by_months", self._cutoff(time_frame)), compute)
+
+    def spending_by_category(self, time_frame="All time"):
+        """Spending per category, largest first (columns: category, spending)."""
+        def compute():
+            frame = self._snapshot()
+            start = frame.start_index(self._cutoff(time_frame))
+            amounts = frame.amounts[start:]
+            spend = amounts < 0
+            codes = frame.category_codes[start:][spend]
+            size = len(frame.category_labels)
+            totals = np.bincount(codes, weights=amounts[spend], minlength=size)
+            present = np.flatnonzero(np.bincount(codes, minlength=size) > 0)
+            spending = np.round(np.abs(totals[present]), 2)
+            order = np.argsort(-spending, kind="stable")
+            return pd.DataFrame({
+                "category": np.array(frame.category_labels, dtype=object)[present][order],
+                "spending": spending[order],
+            })
+        return self._memoised(("spending_by_category", self._cutoff(time_frame)), compute)
+
+    def total_spending(self, time_frame="All time"):
+        """Net sum of all amounts in the period (column: total_spending)."""
+        def compute():
+            frame = self._snapshot()
+            amounts = frame.amounts[frame.start_index(self._cutoff(time_frame)):]
+            total = float(amounts.sum()) if len(amounts) else None
+            return pd.DataFrame({"total_spending": [total]})
+        return self._memoised(("total_spending", self._cutoff(time_frame)), compute)
+
+    def largest_transactions(self, time_frame="All time", limit=10):
+        """Largest outgoing payments, biggest first (columns: transaction_date, description, category, amount)."""
+        def compute():
+            frame = self._snapshot()
+            start = frame.start_index(self._cutoff(time_frame))
+            spend = np.flatnonzero(frame.amounts[start:] < 0) + start
+            count = min(limit, len(spend))
+            if count == 0:
+                return pd.DataFrame(columns=["transaction_date", "description", "category", "amount"])
+            amounts = frame.amounts[spend]
+            top = np.argpartition(amounts, count - 1)[:count]
+            top = spend[top[np.argsort(amounts[top], kind="stable")]]
+            return frame.df.loc[top, ["transaction_date", "description", "category", "amount"]].reset_index(drop=True)
+        return self._memoised(("largest_transactions", self._cutoff(time_frame), limit), compute)
+
+    def unusual_transactions(self, time_frame="All time", limit=10):
+        """Rows scored as anomalous at ingest, most unusual first (same columns as get_unusual_transactions)."""
+        def compute():
+            frame = self._snapshot()
+            rows = frame.df.iloc[frame.start_index(self._cutoff(time_frame)):]
+            rows = rows[rows["anomaly_score"] >= ANOMALY_THRESHOLD]
+            rows = rows.sort_values("anomaly_score", ascending=False, kind="stable").head(limit)
+            return rows[["transaction_date", "description", "merchant_name", "category", "amount",
+                         "anomaly_score"]].reset_index(drop=True)
+        return self._memoised(("unusual_transactions", self._cutoff(time_frame), limit), compute)
+
+    def spending_since(self, cutoff):
+        """Absolute spending (negative amounts) on or after cutoff date."""
+        frame = self._snapshot()
+        amounts = frame.amounts[frame.start_index(cutoff):]
+        return float(np.abs(amounts[amounts < 0].sum()))
+
+    def spending_this_week(self):
+        return self.spending_since(date.today() - timedelta(days=6))
+
+    def spending_this_month(self):
+        return self.spending_since(date.today().replace(day=1))
+
+    def last_transactions(self, limit=10):
+        """Most recent transactions (columns: description, transaction_date, amount)."""
+        frame = self._snapshot()
+        rows = frame.df.iloc[::-1].head(limit)
+        return rows[["description", "transaction_date", "amount"]].reset_index(drop=True)
+
+    def _balance_window(self, time_frame, account_ids):
+        # Snapshots in the window plus each account's last one before it, as
+        # db_queries._balance_snapshots selects
+        balances = self._balances
+        if account_ids:
+            balances = balances[balances["account_id"].isin(account_ids)]
+        cutoff = self._cutoff(time_frame)
+        if cutoff is None:
+            return balances, None
+        before = balances[balances["snapshot_date"] < pd.Timestamp(cutoff)]
+        carried = before.groupby("account_id", observed=True).tail(1)
+        inside = balances[balances["snapshot_date"] >= pd.Timestamp(cutoff)]
+        return pd.concat([carried, inside], ignore_index=True), cutoff
+
+    def total_balance_history(self, time_frame="All time", points=CHART_POINTS, account_ids=None):
+        """Total balance per day, gap-filled and downsampled (columns: current_balance, snapshot_date)."""
+        # Hashable and order-free, so a list works and [a, b] shares [b, a]'s memo entry
+        account_ids = tuple(sorted(account_ids)) if account_ids else None
+        def compute():
+            self._snapshot()
+            balances, cutoff = self._balance_window(time_frame, account_ids)
+            return balance_series(balances, cutoff, points)
+        return self._memoised(("total_balance_history", self._cutoff(time_frame), date.today(), points, account_ids), compute)
+
+    def each_account_balance_history(self, time_frame="All time", points=CHART_POINTS, account_ids=None):
+        """Balance per account per day, gap-filled and downsampled (columns: account_id, snapshot_date, current_balance)."""
+        # As in total_balance_history
+        account_ids = tuple(sorted(account_ids)) if account_ids else None
+        def compute():
+            self._snapshot()
+            balances, cutoff = self._balance_window(time_frame, account_ids)
+            return balance_series(balances, cutoff, points, per_account=True)
+        return self._memoised(("each_account_balance_history", self._cutoff(time_frame), date.today(), points, account_ids), compute)
@@ -0,0 +1,206 @@
+"""
+Streaming anomaly scores for outgoing transactions.
+
+Running statistics are kept per (account, category, merchant), with
+(account, category) and account-wide fallbacks for merchants with little
+history:
+
+- Welford mean/variance of log(amount)
+- a log-bucketed quantile sketch (relative error SKETCH_ACCURACY) for a
+  robust median/p95 that one huge payment can't drag around
+
+Each new row is scored against the statistics as they stood before it, then
+folded in, so scoring is O(1) per row and never rescans history. The score
+is the smaller of the classic and the robust z-score of log(amount): both
+have to agree the amount is unusual. Statistics live in anomaly_stats and
+are written in the same transaction as the scores they produced, so a
+crashed run never counts a row twice.
+
+Usage:
+    python anomalies.py            # score every unscored transaction
+"""
+import json
+import math
+import os
+import sys
+
+from change_events import publish_change
+from db import get_connection
+
+ANOMALY_THRESHOLD = float(os.getenv("ANOMALY_THRESHOLD", 3.0))
+# Rows at a level with less history than this fall back to a coarser level
+MIN_HISTORY = 5
+# Floor on the spread (in log space, ~10%), so fixed-price subscriptions
+# don't turn every penny of change into an anomaly
+MIN_LOG_STD = 0.1
+SKETCH_ACCURACY = 0.05
+_LOG_GAMMA = math.log((1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY))
+
+ANY = "*"
+
+
+class RunningStats:
+    """Mergeable per-key statistics over log(amount)."""
+
+    __slots__ = ("n", "mean", "m2", "buckets")
+
+    def __init__(self, n=0, mean=0.0, m2=0.0, buckets=None):
+        self.n = n
+        self.mean = mean
+        self.m2 = m2
+        self.buckets = buckets or {}
+
+    def update(self, amount):
+        """Fold in one (positive) amount."""
+        x = math.log(amount)
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+        bucket = math.ceil(x / _LOG_GAMMA)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def std(self):
+        return math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else 0.0
+
+    def quantile(self, q):
+        """Approximate quantile of the amounts seen (within SKETCH_ACCURACY relative error)."""
+        rank = q * (self.n - 1)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen > rank:
+                break
+        # Bucket b covers (gamma^(b-1), gamma^b]; its log-midpoint is the estimate
+        return math.exp((bucket - 0.5) * _LOG_GAMMA)
+
+    def score(self, amount):
+        """How many (log-space) standard deviations above typical this amount is."""
+        x = math.log(amount)
+        z = (x - self.mean) / max(self.std(), MIN_LOG_STD)
+        median = math.log(self.quantile(0.5))
+        robust_std = max((math.log(self.quantile(0.95)) - median) / 1.645, MIN_LOG_STD)
+        return min(z, (x - median) / robust_std)
+
+    def to_row(self):
+        return self.n, self.mean, self.m2, json.dumps(self.buckets)
+
+    @classmethod
+    def from_row(cls, n, mean, m2, sketch):
+        return cls(n, float(mean), float(m2), {int(k): v for k, v in json.loads(sketch).items()})
+
+
+def stat_keys(account_id, category, merchant_name):
+    """Keys from most to least specific."""
+    category, merchant_name = category or "", merchant_name or ""
+    return [
+        (account_id, category, merchant_name),
+        (account_id, category, ANY),
+        (account_id, ANY, ANY),
+    ]
+
+
+def score_transaction(stats, account_id, category, merchant_name, amount):
+    """
+    Score one transaction, then fold it into the running statistics.
+
+    Args:
+        stats (dict): key -> RunningStats, updated in place
+        amount (float): Signed amount; only outgoing payments are scored
+
+    Returns:
+        tuple: (score, keys whose stats changed)
+    """
+    if amount >= 0:
+        return 0.0, []
+    value = max(-amount, 0.01)
+    keys = stat_keys(account_id, category, merchant_name)
+
+    score = 0.0
+    for key in keys:
+        key_stats = stats.get(key)
+        if key_stats and key_stats.n >= MIN_HISTORY:
+            score = max(key_stats.score(value), 0.0)
+            break
+
+    for key in keys:
+        stats.setdefault(key, RunningStats()).update(value)
+    return round(score, 2), keys
+
+
+def load_stats(cursor):
+    """Every persisted RunningStats, keyed by (account_id, category, merchant_name)."""
+    cursor.execute("""
+        SELECT account_id, category, merchant_name, n, mean, m2, sketch
+        FROM finance_sandbox.anomaly_stats
+    """)
+    return {tuple(row[:3]): RunningStats.from_row(*row[3:]) for row in cursor.fetchall()}
+
+
+def save_stats(cursor, stats, keys):
+    cursor.executemany("""
+        INSERT INTO finance_sandbox.anomaly_stats (account_id, category, merchant_name, n, mean, m2, sketch)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (account_id, category, merchant_name) DO UPDATE
+        SET n = excluded.n, mean = excluded.mean, m2 = excluded.m2, sketch = excluded.sketch
+    """, [(*key, *stats[key].to_row()) for key in keys])
+
+
+def score_new_transactions(chunk_size=1000):
+    """
+    Score every categorised transaction that has no anomaly_score yet.
+
+    Runs after categorisation in the sync, since the statistics are kept per
+    category. Rows are taken in date order so history builds up the way it
+    happened; each chunk's scores and statistics commit together.
+
+    Returns:
+        int: Transactions scored
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    stats = load_stats(cursor)
+    last_date, last_id = "0001-01-01", ""
+    scored = flagged = 0
+
+    try:
+        while True:
+            cursor.execute("""
+                SELECT transaction_id, account_id, category, merchant_name, amount, transaction_date
+                FROM finance_sandbox.transactions
+                WHERE anomaly_score IS NULL AND category IS NOT NULL
+                AND (transaction_date, transaction_id) > (%s, %s)
+                ORDER BY transaction_date, transaction_id
+                LIMIT %s
+            """, (last_date, last_id, chunk_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            last_date, last_id = str(rows[-1][5])[:10], rows[-1][0]
+
+            scores, changed = [], set()
+            for transaction_id, account_id, category, merchant_name, amount, _ in rows:
+                score, keys = score_transaction(stats, account_id, category, merchant_name, float(amount))
+                scores.append((score, transaction_id))
+                changed.update(keys)
+                flagged += score >= ANOMALY_THRESHOLD
+
+            cursor.executemany("UPDATE finance_sandbox.transactions SET anomaly_score = %s WHERE transaction_id = %s",
+                               scores)
+            save_stats(cursor, stats, changed)
+            dates = [str(row[5])[:10] for row in rows]
+            publish_change(conn, "transactions", "anomaly", {row[1] for row in rows},
+                           min(dates), max(dates), len(rows))
+            conn.commit()
+            scored += len(rows)
+            print(f"\rScored {scored:,} transactions, {flagged:,} unusual", end="", file=sys.stderr)
+    finally:
+        conn.close()
+
+    if scored:
+        print(file=sys.stderr)
+    return scored
+
+
+if __name__ == "__main__":
+    print(f"Scored {score_new_transactions()} transactions")
@@ -2,6 +2,7 @@ import requests
 import os
 from dotenv import load_dotenv
 import time
+from rate_limits import acquire
 
 
 load_dotenv()
@@ -11,6 +12,7 @@ def call_api(url,access_token, retries=3):
     """Generic API caller for TrueLayer endpoints."""
     headers = {"Authorization": f"Bearer {access_token}"}
     for attempt in range(retries):
+        acquire("truelayer")
         try:
             response = requests.get(url, headers=headers, timeout=10)
             response.raise_for_status()
@@ -44,7 +46,7 @@ def get_pending_transactions(access_token, account_id):
 
 def get_direct_debits(access_token, account_id):
     """Fetch direct debits for a specific account."""
-    return call_api(f"{API_BASE_URL}/data/v1/accounts/{account_id}/transactions/direct_debits", access_token)
+    return call_api(f"{API_BASE_URL}/data/v1/accounts/{account_id}/direct_debits", access_token)
 #
 # def get_account_balance(access_token, account_id):
 #     """Fetch balance for a specific account."""
@@ -3,6 +3,7 @@ import os
 from dotenv import load_dotenv
 import json
 import time
+from rate_limits import acquire
 
 load_dotenv()
 
@@ -10,8 +11,9 @@ AUTH_CODE = "" # <-- Changes everytime (For initial token Auth)
 TOKEN_URL = os.getenv("TL_AUTH_URL")
 
 
-def get_initial_token(auth_code):
-    """Exchange authorization code for initial access and refresh tokens."""
+def exchange_auth_code(auth_code):
+    """Exchange authorization code for initial access and refresh tokens (not saved)."""
+    acquire("truelayer")
     try:
         response = requests.post(
             TOKEN_URL,
@@ -27,18 +29,23 @@ def get_initial_token(auth_code):
         response.raise_for_status()
         data = response.json()
 
-        tokens = {
+        return {
             "access_token": data["access_token"],
             "refresh_token": data["refresh_token"],
             "expires_at": time.time() + data["expires_in"]
         }
-        save_tokens(tokens)
-        return tokens
 
     except requests.exceptions.RequestException as e:
         print(f"Failed to exchange auth code: {e}")
         return None
 
+def get_initial_token(auth_code):
+    """Exchange authorization code for initial access and refresh tokens, and save them."""
+    tokens = exchange_auth_code(auth_code)
+    if tokens:
+        save_tokens(tokens)
+    return tokens
+
 def load_tokens():
     """Load saved access and refresh tokens from JSON file."""
     try:
@@ -62,6 +69,7 @@ def save_tokens(tokens):
 def refresh_tokens(refresh_token, retries=3):
     """Exchange refresh token for new access and refresh tokens."""
     for attempt in range(retries):
+        acquire("truelayer")
         try:
             response = requests.post(
                 TOKEN_URL,
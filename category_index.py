@@ -0,0 +1,303 @@
+"""
+Nearest-neighbour categoriser over already-labelled transactions.
+
+Descriptions are cleaned with the merchant noise patterns (so new store
+numbers and reference suffixes don't matter), split into character
+n-grams, hashed into a fixed-width sparse TF-IDF space and compared by
+cosine similarity in batched sparse matrix products. A confident match is
+assigned straight away; everything else still goes to the LLM.
+
+The index keeps one row per distinct labelled description and is saved to
+CATEGORY_INDEX_PATH. It refreshes incrementally: change_log says which date
+ranges were (re)categorised since the last refresh, and only those rows are
+re-read.
+
+Usage:
+    python category_index.py build                        # from the database
+    python category_index.py build --csv transactions.csv # seed from an export too
+    python category_index.py predict "TESCO STORES 3297" "NETFLIX.COM"
+"""
+import argparse
+import os
+import zlib
+
+from change_events import change_horizon
+from db import pooled_connection
+from db_queries import iter_query_rows
+from llm import CATEGORY_VERSION
+from merchants import clean_descriptions
+from storage import get_backend
+from lazy_imports import np, pd, sp
+
+INDEX_PATH = os.getenv("CATEGORY_INDEX_PATH", "category_index.npz")
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", 0.75))
+
+NGRAM_RANGE = (2, 4)
+N_FEATURES = 2 ** 18
+NEIGHBOURS = 5
+# Neighbour votes are weighted by similarity ** SHARPNESS, so an exact match
+# outvotes several loose ones
+SHARPNESS = 4
+# Upper bound on the dense similarity block materialised per query batch
+MAX_BLOCK = 4_000_000
+
+# Labels that mean "the LLM didn't know"; never learned from
+UNLABELLED = {"Uncategorized"}
+# category_model value for labels assigned by this index
+INDEX_MODEL = "category_index"
+
+
+def _ngram_ids(key):
+    # crc32 rather than hash(): it is stable across processes, so a saved
+    # index still lines up with freshly hashed queries
+    padded = f" {key} "
+    return [
+        zlib.crc32(padded[i:i + n].encode()) % N_FEATURES
+        for n in range(NGRAM_RANGE[0], NGRAM_RANGE[1] + 1)
+        for i in range(len(padded) - n + 1)
+    ]
+
+
+def count_matrix(descriptions):
+    """
+    Hashed character n-gram counts, one row per description.
+
+    Returns:
+        scipy.sparse.csr_matrix: float32, shape (len(descriptions), N_FEATURES)
+    """
+    keys = clean_descriptions(pd.Series(list(descriptions), dtype=object).fillna(""))
+    ids = [_ngram_ids(key) if key else [] for key in keys]
+    lengths = np.fromiter((len(row) for row in ids), dtype=np.int64, count=len(ids))
+    columns = np.fromiter((i for row in ids for i in row), dtype=np.int32, count=int(lengths.sum()))
+    rows = np.repeat(np.arange(len(ids), dtype=np.int32), lengths)
+    matrix = sp.csr_matrix((np.ones(len(columns), dtype=np.float32), (rows, columns)),
+                           shape=(len(ids), N_FEATURES))
+    matrix.sum_duplicates()
+    return matrix
+
+
+class CategoryIndex:
+    """
+    Labelled descriptions and their n-gram counts.
+
+    Raw counts are stored; IDF weighting and normalisation are derived
+    lazily, so adding rows never requires re-hashing old ones.
+    """
+
+    def __init__(self):
+        self.descriptions = []
+        self.categories = []
+        self.positions = {}
+        self.counts = sp.csr_matrix((0, N_FEATURES), dtype=np.float32)
+        self.watermark = 0
+        # Labels from any other category version are stale (recategorise.py will
+        # redo them), so the index only learns from, and is only valid for, one
+        self.version = CATEGORY_VERSION
+        self._weighted = None
+
+    def __len__(self):
+        return len(self.descriptions)
+
+    #---------- PERSISTENCE ----------#
+
+    def save(self, path=INDEX_PATH):
+        """Write the index atomically (a crash mid-save keeps the old file)."""
+        # Per process: sync workers categorising side by side each save their copy
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            descriptions=np.array(self.descriptions, dtype=str),
+            categories=np.array(self.categories, dtype=str),
+            data=self.counts.data,
+            indices=self.counts.indices,
+            indptr=self.counts.indptr,
+            watermark=np.array(self.watermark, dtype=np.int64),
+            version=np.array(self.version),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        """Load a saved index, or return an empty one if there is none."""
+        index = cls()
+        if not os.path.exists(path):
+            return index
+        with np.load(path) as saved:
+            if "version" not in saved or str(saved["version"]) != index.version:
+                print(f"Category index at {path} was built for another category version; rebuilding")
+                return index
+            index.descriptions = saved["descriptions"].tolist()
+            index.categories = saved["categories"].tolist()
+            index.counts = sp.csr_matrix((saved["data"], saved["indices"], saved["indptr"]),
+                                         shape=(len(index.descriptions), N_FEATURES))
+            index.watermark = int(saved["watermark"])
+        index.positions = {description: row for row, description in enumerate(index.descriptions)}
+        return index
+
+    #---------- UPDATES ----------#
+
+    def add(self, descriptions, categories):
+        """
+        Learn labels. A description already in the index takes the new label.
+
+        Returns:
+            int: Descriptions added as new rows
+        """
+        new = {}
+        for description, category in zip(descriptions, categories):
+            if not description or not category or category in UNLABELLED:
+                continue
+            if description in self.positions:
+                self.categories[self.positions[description]] = category
+            else:
+                new[description] = category
+
+        if new:
+            start = len(self.descriptions)
+            self.positions.update({description: start + i for i, description in enumerate(new)})
+            self.descriptions.extend(new)
+            self.categories.extend(new.values())
+            self.counts = sp.vstack([self.counts, count_matrix(new)], format="csr")
+        self._weighted = None
+        return len(new)
+
+    def refresh(self):
+        """
+        Pull in labels written since the last refresh.
+
+        The first refresh reads every row labelled under the current
+        CATEGORY_VERSION; later ones only re-read the date range covered by
+        new transactions changes in change_log.
+
+        Returns:
+            int: Descriptions added as new rows
+        """
+        with pooled_connection() as conn:
+            cursor = conn.cursor()
+            watermark = change_horizon(cursor)
+            order = get_backend().CHANGE_ORDER
+            cursor.execute(f"""
+                SELECT COUNT(*), MIN(COALESCE(date_from, '0001-01-01')), MAX(COALESCE(date_to, '9999-12-31'))
+                FROM finance_sandbox.change_log
+                WHERE table_name = 'transactions' AND {order} >= %s AND {order} < %s
+            """, (self.watermark, watermark))
+            changes, date_from, date_to = cursor.fetchone()
+            cursor.close()
+        if not changes and self.watermark:
+            self.watermark = watermark
+            return 0
+
+        window, params = "", ()
+        # Changes without a date range (the COALESCE sentinels) can touch anything
+        if self.watermark:
+            window = "AND transaction_date BETWEEN %s AND %s"
+            params = (str(date_from)[:10], str(date_to)[:10])
+        # Labels for one description can disagree; most frequent last, so add()
+        # leaves each description with its majority label. The index's own
+        # guesses are skipped so it only ever learns from real labels, and so
+        # are labels from other category versions: a match is stamped with the
+        # current version, which would hide an old label from recategorise.py.
+        query = f"""
+            SELECT description, category FROM finance_sandbox.transactions
+            WHERE category IS NOT NULL {window}
+            AND (category_model IS NULL OR category_model <> '{INDEX_MODEL}')
+            AND category_version = %s
+            GROUP BY description, category
+            ORDER BY COUNT(*)
+        """
+
+        added = 0
+        for batch in iter_query_rows(query, (*params, self.version)):
+            added += self.add(*zip(*batch))
+        self.watermark = watermark
+        return added
+
+    #---------- QUERIES ----------#
+
+    def _weigh(self, counts):
+        """Sublinear TF * IDF, L2-normalised per row."""
+        weighted = counts.copy()
+        weighted.data = (1 + np.log(weighted.data)) * self._idf[weighted.indices]
+        norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return sp.csr_matrix(sp.diags(1 / norms) @ weighted)
+
+    def _matrix(self):
+        if self._weighted is None:
+            doc_freq = np.bincount(self.counts.indices, minlength=N_FEATURES)
+            self._idf = (np.log((1 + len(self)) / (1 + doc_freq)) + 1).astype(np.float32)
+            self._labels, self._label_codes = np.unique(np.array(self.categories, dtype=object),
+                                                        return_inverse=True)
+            self._weighted = self._weigh(self.counts).T.tocsr()
+        return self._weighted
+
+    def predict(self, descriptions):
+        """
+        Category and confidence for each description.
+
+        Confidence is the best match's cosine similarity scaled by how much of
+        the (sharpened) neighbour vote agrees with it: 1.0 for an exact match
+        with unanimous neighbours, near 0 for nothing similar.
+
+        Returns:
+            tuple: (list of categories (None if the index is empty), np.ndarray of confidences)
+        """
+        descriptions = list(descriptions)
+        categories = [None] * len(descriptions)
+        confidences = np.zeros(len(descriptions), dtype=np.float32)
+        if not descriptions or not len(self):
+            return categories, confidences
+
+        index = self._matrix()
+        queries = self._weigh(count_matrix(descriptions))
+        k = min(NEIGHBOURS, len(self))
+        batch_size = max(1, MAX_BLOCK // len(self))
+
+        for start in range(0, len(descriptions), batch_size):
+            similarities = (queries[start:start + batch_size] @ index).toarray()
+            rows = np.arange(len(similarities))
+            top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+            top_similarity = np.take_along_axis(similarities, top, axis=1)
+            best = top[rows, top_similarity.argmax(axis=1)]
+
+            votes = top_similarity ** SHARPNESS
+            agree = self._label_codes[top] == self._label_codes[best][:, None]
+            share = (votes * agree).sum(axis=1) / np.maximum(votes.sum(axis=1), 1e-12)
+
+            confidences[start:start + len(rows)] = similarities[rows, best] * share
+            for offset, code in enumerate(self._label_codes[best]):
+                categories[start + offset] = self._labels[code]
+
+        return categories, confidences
+
+
+def get_category_index(path=INDEX_PATH):
+    """Load the saved index and bring it up to date with the database."""
+    index = CategoryIndex.load(path)
+    if index.refresh():
+        index.save(path)
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Nearest-neighbour transaction categoriser")
+    parser.add_argument("command", choices=["build", "predict"])
+    parser.add_argument("descriptions", nargs="*", help="predict: descriptions to categorise")
+    parser.add_argument("--csv", help="build: also learn labels from a transactions.csv export")
+    parser.add_argument("--path", default=INDEX_PATH, help="Index file")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        category_index = CategoryIndex()
+        if args.csv:
+            export = pd.read_csv(args.csv, usecols=["description", "category"]).dropna()
+            labels = export.value_counts(ascending=True).index
+            category_index.add(labels.get_level_values(0), labels.get_level_values(1))
+        category_index.refresh()
+        category_index.save(args.path)
+        print(f"Indexed {len(category_index)} labelled descriptions to {args.path}")
+    else:
+        category_index = CategoryIndex.load(args.path)
+        predicted, confidence = category_index.predict(args.descriptions)
+        for description, category, score in zip(args.descriptions, predicted, confidence):
+            print(f"{description!r} -> {category} ({score:.2f})")
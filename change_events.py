@@ -0,0 +1,222 @@
+import json
+import select
+import time
+from db import get_connection
+from storage import get_backend
+from lazy_imports import psycopg2_extensions
+
+CHANNEL = "finance_changes"
+
+
+def publish_change(conn, table_name, event, account_ids=None, date_from=None, date_to=None, row_count=None):
+    """
+    Record a data change and notify listeners.
+
+    Runs inside the caller's transaction, so the event only becomes visible
+    (and the NOTIFY is only delivered) when the data change itself commits.
+
+    Args:
+        conn: Open connection the change was made on
+        table_name (str): Affected table, e.g. "transactions" or "balance_history"
+        event (str): What happened, e.g. "ingest", "categorise", "snapshot"
+        account_ids (iterable): Affected account IDs, if known
+        date_from (str): Earliest affected date (YYYY-MM-DD), if known
+        date_to (str): Latest affected date (YYYY-MM-DD), if known
+        row_count (int): Number of rows touched, if known
+    """
+    accounts = sorted(set(account_ids)) if account_ids else []
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO finance_sandbox.change_log
+        (table_name, event, account_ids, date_from, date_to, row_count)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        RETURNING id
+    """, (table_name, event, json.dumps(accounts), date_from, date_to, row_count))
+    change_id = cursor.fetchone()[0]
+
+    payload = {
+        "id": change_id,
+        "table": table_name,
+        "event": event,
+        "accounts": accounts,
+        "date_from": str(date_from) if date_from else None,
+        "date_to": str(date_to) if date_to else None,
+    }
+    cursor.execute("SELECT pg_notify(%s, %s)", (CHANNEL, json.dumps(payload)))
+    return change_id
+
+
+def change_horizon(cursor):
+    """
+    Commit-ordered watermark over change_log.
+
+    ids are handed out when a change is inserted, not when its transaction
+    commits, so a reader that has seen id 12 can still get id 11 later.
+    Every change ordered below the horizon (by the backend's CHANGE_ORDER
+    column) has already committed or never will, so a consumer that reads
+    [previous horizon, horizon) each time never skips one.
+
+    Returns:
+        int: The horizon, exclusive
+    """
+    cursor.execute(f"SELECT {get_backend().CHANGE_HORIZON}")
+    return cursor.fetchone()[0]
+
+
+def settled_changes():
+    """SQL condition for change_log rows below the current horizon, for single-query readers."""
+    backend = get_backend()
+    return f"{backend.CHANGE_ORDER} < {backend.CHANGE_HORIZON}"
+
+
+def get_change_versions(conn, cutoffs=None):
+    """
+    Latest settled change per table, optionally restricted to date windows.
+
+    A panel that only shows the last 7 days should not be invalidated by a
+    recategorisation of last year's rows, so each window gets its own version:
+    the newest change whose date range reaches into that window. Only changes
+    below change_horizon() count, so a change that commits late still moves
+    the version when it lands.
+
+    Args:
+        conn: Open connection
+        cutoffs (dict): Window label -> cutoff date (YYYY-MM-DD)
+
+    Returns:
+        dict: {table_name: {"all": version, <label>: version, ...}} (missing -> 0)
+    """
+    cutoffs = cutoffs or {}
+    labels = list(cutoffs)
+    order = get_backend().CHANGE_ORDER
+    window_columns = "".join(
+        f", MAX(CASE WHEN date_to IS NULL OR date_to >= %s THEN {order} END)" for _ in labels
+    )
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT table_name, MAX({order}){window_columns}
+        FROM finance_sandbox.change_log
+        WHERE {settled_changes()}
+        GROUP BY table_name
+    """, tuple(cutoffs[label] for label in labels))
+
+    versions = {}
+    for row in cursor.fetchall():
+        table_versions = {"all": row[1] or 0}
+        for label, value in zip(labels, row[2:]):
+            table_versions[label] = value or 0
+        versions[row[0]] = table_versions
+    cursor.close()
+    return versions
+
+
+def get_unconsumed_changes(conn, consumer, table_name):
+    """
+    Changes to a table that an incremental consumer has not processed yet.
+
+    Args:
+        conn: Open connection
+        consumer (str): Consumer name in change_consumers, e.g. "recurring"
+        table_name (str): Table whose changes the consumer follows
+
+    Returns:
+        tuple: (list of change dicts oldest first, consumer's previous horizon (0 if it
+               never ran), horizon to pass to mark_changes_consumed())
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT last_change_id FROM finance_sandbox.change_consumers WHERE consumer = %s", (consumer,))
+    row = cursor.fetchone()
+    last_horizon = row[0] if row else 0
+    horizon = change_horizon(cursor)
+    order = get_backend().CHANGE_ORDER
+    cursor.execute(f"""
+        SELECT id, event, account_ids, date_from, date_to
+        FROM finance_sandbox.change_log
+        WHERE table_name = %s AND {order} >= %s AND {order} < %s
+        ORDER BY {order}, id
+    """, (table_name, last_horizon, horizon))
+    changes = [
+        {
+            "id": change_id,
+            "event": event,
+            "accounts": json.loads(account_ids or "[]"),
+            "date_from": str(date_from)[:10] if date_from else None,
+            "date_to": str(date_to)[:10] if date_to else None,
+        }
+        for change_id, event, account_ids, date_from, date_to in cursor.fetchall()
+    ]
+    cursor.close()
+    return changes, last_horizon, horizon
+
+
+def mark_changes_consumed(conn, consumer, horizon):
+    """Advance a consumer's watermark to a horizon. Call in the transaction that applies the changes."""
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO finance_sandbox.change_consumers (consumer, last_change_id)
+        VALUES (%s, %s)
+        ON CONFLICT (consumer) DO UPDATE
+        SET last_change_id = excluded.last_change_id, updated_at = CURRENT_TIMESTAMP
+    """, (consumer, horizon))
+    cursor.close()
+
+
+def listen_for_changes(callback, timeout=60):
+    """
+    Block and call callback(event_dict) for every change notification.
+
+    For long-lived consumers (workers, API servers) that want push delivery
+    rather than polling change_log. Runs until interrupted. SQLite has no
+    NOTIFY, so there it polls change_log every timeout seconds instead.
+    """
+    if get_backend().name == "sqlite":
+        poll_for_changes(callback, interval=timeout)
+        return
+
+    conn = get_connection()
+    conn.set_isolation_level(psycopg2_extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    cursor = conn.cursor()
+    cursor.execute(f"LISTEN {CHANNEL}")
+
+    try:
+        while True:
+            if select.select([conn], [], [], timeout) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                callback(json.loads(notify.payload))
+    finally:
+        conn.close()
+
+
+def poll_for_changes(callback, interval=5):
+    """Call callback(event_dict) for each new change_log row, polling every interval seconds."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    horizon = change_horizon(cursor)
+    order = get_backend().CHANGE_ORDER
+
+    try:
+        while True:
+            time.sleep(interval)
+            # End the last read transaction so this poll sees new commits
+            conn.rollback()
+            last_horizon, horizon = horizon, change_horizon(cursor)
+            cursor.execute(f"""
+                SELECT id, table_name, event, account_ids, date_from, date_to
+                FROM finance_sandbox.change_log
+                WHERE {order} >= %s AND {order} < %s
+                ORDER BY {order}, id
+            """, (last_horizon, horizon))
+            for change_id, table_name, event, account_ids, date_from, date_to in cursor.fetchall():
+                callback({
+                    "id": change_id,
+                    "table": table_name,
+                    "event": event,
+                    "accounts": json.loads(account_ids or "[]"),
+                    "date_from": str(date_from) if date_from else None,
+                    "date_to": str(date_to) if date_to else None,
+                })
+    finally:
+        conn.close()
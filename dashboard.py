@@ -1,18 +1,194 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
 from account_data import get_current_balances
 from auth import get_access_token
 from db_queries import get_spending_this_week, get_spending_this_month, get_last_transactions
 from db_queries import get_spending_by_months, get_spending_by_category, get_each_account_balance_history
-from db_queries import get_total_balance_history
-from datetime import datetime, date
-import plotly.express as px
+from db_queries import get_total_balance_history, get_unusual_transactions
+from db_queries import get_recurring_payments, get_upcoming_payments
+from db_queries import get_transactions_page, get_explorer_filter_options, EXPLORER_SORTS
+from db_queries import search_transactions
+from trends import get_rolling_spending, get_latest_category_changes, get_running_balances
+from datetime import datetime, date, timedelta
 from llm import generate_insights
+from profiling import Profiler
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from change_events import get_change_versions
+from db import pinned_reads, read_connection
+from analytics import AnalyticsEngine
+from lazy_imports import px
+import os
+
+# Seconds between change_log polls; panels re-query only when their inputs changed
+POLL_SECONDS = int(os.getenv("DASHBOARD_POLL_SECONDS", 30))
+
+TIME_PERIOD_DAYS = {
+    "Last 7 days": 7,
+    "Last 30 days": 30,
+    "Last 3 months": 90,
+    "Last 6 months": 180,
+    "All time": None
+}
+
+# "memory" answers panels from the in-process AnalyticsEngine; "sql" queries per panel
+DASHBOARD_ENGINE = os.getenv("DASHBOARD_ENGINE", "memory")
+
+# Panel name -> (SQL query function, AnalyticsEngine method (None: always SQL), table it reads)
+PANEL_QUERIES = {
+    "last_transactions": (get_last_transactions, "last_transactions", "transactions"),
+    "spending_this_week": (get_spending_this_week, "spending_this_week", "transactions"),
+    "spending_this_month": (get_spending_this_month, "spending_this_month", "transactions"),
+    "spending_by_months": (get_spending_by_months, "spending_by_months", "transactions"),
+    "spending_by_category": (get_spending_by_category, "spending_by_category", "transactions"),
+    "unusual_transactions": (get_unusual_transactions, "unusual_transactions", "transactions"),
+    "total_balance_history": (get_total_balance_history, "total_balance_history", "balance_history"),
+    "each_account_balance_history": (get_each_account_balance_history, "each_account_balance_history", "balance_history"),
+    "recurring_payments": (get_recurring_payments, None, "recurring_series"),
+    "upcoming_payments": (get_upcoming_payments, None, "recurring_series"),
+    "rolling_spending": (get_rolling_spending, None, "transactions"),
+    "category_changes": (get_latest_category_changes, None, "transactions"),
+    "running_balances": (get_running_balances, None, "transactions"),
+}
 
 
 #---------- FUNCTIONS ----------#
 
+def get_window_cutoffs():
+    """Cutoff date for every date window a panel can show."""
+    today = date.today()
+    cutoffs = {
+        label: (today - timedelta(days=days)).isoformat()
+        for label, days in TIME_PERIOD_DAYS.items() if days
+    }
+    cutoffs["This week"] = (today - timedelta(days=6)).isoformat()
+    cutoffs["This month"] = today.replace(day=1).isoformat()
+    return cutoffs
+
+
+def fetch_change_versions():
+    """Latest settled change per table and date window (from the same target panels read)."""
+    with read_connection() as conn:
+        return get_change_versions(conn, get_window_cutoffs())
+
+
+@st.cache_data(show_spinner=False)
+def load_panel(name, version, as_of, *args):
+    """
+    Run a panel's query. Cached per (panel, version, as_of, args).
+
+    version is the newest change to the panel's table within its date window,
+    so a sync only invalidates the panels whose inputs it actually touched.
+    as_of is today's date: windows and balance series are relative to it, so
+    they roll over at midnight even when no data changed.
+    """
+    query, _, _ = PANEL_QUERIES[name]
+    return query(*args)
+
+
+def _pinned_call(backend, func, *args):
+    # Worker threads don't inherit the script thread's pin
+    with pinned_reads(backend):
+        return func(*args)
+
+
+@st.cache_resource
+def get_analytics():
+    """In-memory analytics engine shared by all sessions."""
+    return AnalyticsEngine()
+
+
+def submit_panel(executor, name, *args, window="All time"):
+    """Submit a panel load to the executor."""
+    _, method, table = PANEL_QUERIES[name]
+    if DASHBOARD_ENGINE == "memory" and method:
+        # The engine memoises its own results and is refreshed once per run
+        return executor.submit(getattr(get_analytics(), method), *args)
+
+    # Versions are read here, in the script thread; workers have no session state.
+    # Rows are read from the target the versions came from, so a panel is never
+    # cached under a primary version with stale replica rows.
+    table_versions = st.session_state["change_versions"].get(table, {})
+    version = table_versions.get("all" if window == "All time" else window, 0)
+    return executor.submit(_pinned_call, st.session_state["read_backend"], load_panel,
+                           name, version, date.today().isoformat(), *args)
+
+
+@st.fragment(run_every=POLL_SECONDS)
+def watch_for_changes():
+    """Poll change_log and rerun the page when a sync has changed any data."""
+    versions = fetch_change_versions()
+    if versions != st.session_state.get("change_versions"):
+        st.session_state["change_versions"] = versions
+        # Unchanged panels are served from cache; only stale ones re-query
+        st.rerun(scope="app")
+    st.caption(f"Checking for new data every {POLL_SECONDS}s")
+
+
+@st.cache_resource
+def get_executor():
+    """Thread pool shared by all sessions for loading dashboard data concurrently."""
+    # Sized to the connection pool so workers never wait on a connection
+    return ThreadPoolExecutor(max_workers=int(os.getenv("DB_POOL_MAX", 10)),
+                              thread_name_prefix="dashboard-loader")
+
+
+def render_balances(current_balances):
+    """Render total and (if show_all) per-account balance metrics."""
+    if current_balances:
+        # Total balance always visible
+        st.markdown("### Total Balance")
+        total = sum(current_balances.values())
+        st.metric(label="Total Balance", value=f"£{total:,.2f}")
+
+
+        if show_all: # Show_all toggle in sidebar
+            st.markdown("#### Individual Accounts")
+            # Use columns for horizontal layout
+            cols = st.columns(min(len(current_balances), 3))  # Max 3 columns
+            for idx, (acc_id, balance) in enumerate(current_balances.items()):
+                with cols[idx % 3]:
+                    st.metric(
+                        label=f"Account {acc_id[:8]}...",
+                        value=f"£{balance:,.2f}"
+                    )
+    else:
+        st.error("Failed to get account balances")
+
+
+def render_last_transactions(df):
+    """Render the recent transactions table with coloured amounts."""
+    st.markdown("### Last 10 transactions")
+    styled_df = df.style.map(
+        lambda x: 'color: red' if x < 0 else 'color: green' if x > 0 else '',
+        subset=['amount']
+    ).format({'amount': '£{:.2f}'})
+    st.dataframe(styled_df, hide_index=True)
+
+
+def render_spending(weeks_spending, month_spending):
+    """Render week-to-date and month-to-date spending metrics."""
+    st.markdown("### Spending")
+    dt = datetime.now()
+    month_name = dt.strftime('%B')
+
+    st.metric(label=f"Week {dt.isocalendar()[1]} spending's", value=f"£{weeks_spending:,.2f}")
+    st.metric(label=f"{month_name} spending's", value=f"£{month_spending:,.2f}")
+
+
+def render_recurring_payments(subscriptions, upcoming):
+    """Render active recurring payments and the next 30 days' expected payments."""
+    if subscriptions.empty:
+        st.info("No recurring payments detected yet.")
+        return
+    col1, col2 = st.columns([3, 2])
+    with col1:
+        st.markdown("### Subscriptions & bills")
+        st.dataframe(subscriptions.style.format({'typical_amount': '£{:.2f}'}), hide_index=True)
+    with col2:
+        st.markdown("### Due in the next 30 days")
+        st.metric(label="Expected outgoings", value=f"£{-upcoming['amount'].astype(float).sum():,.2f}")
+        st.dataframe(upcoming.style.format({'amount': '£{:.2f}'}), hide_index=True)
+
+
 def display_balance_transactions(access_token):
     """
     Display account balances and recent transactions in the Overview tab.
@@ -28,65 +204,122 @@ def display_balance_transactions(access_token):
         - Individual account balances (toggle-able)
         - Last 10 transactions table
         - Week and month spending metrics
+        - Recurring payments and the payments expected in the next 30 days
 
     Note:
         Requires active API connection. Shows error if token invalid or
-        balance data unavailable.
+        balance data unavailable. The balance API call and the three
+        queries run concurrently; each section renders as soon as its
+        data arrives.
     """
     #Row 1: Account balances
     st.markdown("## 💰 Balances")
+    balances_section = st.container()
 
+    # Row 3: Last Transactions and Spending
+    col1, col2 = st.columns([3,2])
+
+    # Row 4: Recurring payments
+    st.markdown("## 🔁 Recurring payments")
+    recurring_section = st.container()
+
+    executor = get_executor()
+    loads = {
+        submit_panel(executor, "last_transactions", 10): "transactions",
+        submit_panel(executor, "spending_this_week", window="This week"): "week",
+        submit_panel(executor, "spending_this_month", window="This month"): "month",
+        submit_panel(executor, "recurring_payments", date.today().isoformat()): "recurring",
+        submit_panel(executor, "upcoming_payments", 30, date.today().isoformat()): "upcoming",
+    }
     if access_token:
-        with st.spinner("Loading balances..."):
-            current_balances = get_current_balances(access_token) # current_balances = get_current_balances(access_token) # Getting current Balance with API call
-
-        if current_balances:
-            # Total balance always visible
-            st.markdown("### Total Balance")
-            total = sum(current_balances.values())
-            st.metric(label="Total Balance", value=f"£{total:,.2f}")
-
-
-            if show_all: # Show_all toggle in sidebar
-                st.markdown("#### Individual Accounts")
-                # Use columns for horizontal layout
-                cols = st.columns(min(len(current_balances), 3))  # Max 3 columns
-                for idx, (acc_id, balance) in enumerate(current_balances.items()):
-                    with cols[idx % 3]:
-                        st.metric(
-                            label=f"Account {acc_id[:8]}...",
-                            value=f"£{balance:,.2f}"
-                        )
-        else:
-            st.error("Failed to get account balances")
+        loads[executor.submit(get_current_balances, access_token)] = "balances"
     else:
-        st.error("Failed to get access token")
+        balances_section.error("Failed to get access token")
+
+    spending, recurring = {}, {}
+    with st.spinner("Loading balances..."):
+        for future in as_completed(loads):
+            section = loads[future]
+            if section == "balances":
+                with balances_section:
+                    render_balances(future.result())
+            elif section == "transactions":
+                with col1:
+                    render_last_transactions(future.result())
+            elif section in ("recurring", "upcoming"):
+                recurring[section] = future.result()
+                if len(recurring) == 2:
+                    with recurring_section:
+                        render_recurring_payments(recurring["recurring"], recurring["upcoming"])
+            else:
+                spending[section] = future.result()
+                if len(spending) == 2:
+                    with col2:
+                        render_spending(spending["week"], spending["month"])
+
+
+
+def render_monthly_trend(monthly_spending, time_period):
+    """Render the monthly spending line chart for long enough periods."""
+    if time_period in ["Last 3 months", "Last 6 months", "All time"]:
+        st.markdown(f"**For {time_period}**")
+        st.line_chart(monthly_spending, x="month", y="spending")
+    else:
+        st.info("Monthly trend not available for periods under 3 months")
 
 
-    # Row 3: Last Transactions and Spending
-    col1, col2 = st.columns([3,2])
-    # Last Transactions
-    with col1:
-        # Fetching and displaying current balance
-        st.markdown("### Last 10 transactions")
-        df = get_last_transactions(10)
-        styled_df = df.style.map(
-            lambda x: 'color: red' if x < 0 else 'color: green' if x > 0 else '',
-            subset=['amount']
-        ).format({'amount': '£{:.2f}'})
-        st.dataframe(styled_df, hide_index=True)
+def render_rolling_spending(rolling_spending):
+    """Render daily spend with its trailing 7- and 30-day totals."""
+    if rolling_spending.empty:
+        st.info("No spending data for this period.")
+        return
+    fig = px.line(rolling_spending, x="spend_date", y=["rolling_7d", "rolling_30d"],
+                  labels={"value": "spending", "variable": "window"})
+    st.plotly_chart(fig)
 
-    # Spending
-    with col2:
-        st.markdown("### Spending")
-        dt = datetime.now()
-        month_name = dt.strftime('%B')
-        weeks_spending = get_spending_this_week()
-        month_spending = get_spending_this_month()
 
-        st.metric(label=f"Week {dt.isocalendar()[1]} spending's", value=f"£{weeks_spending:,.2f}")
-        st.metric(label=f"{month_name} spending's", value=f"£{month_spending:,.2f}")
+def render_category_changes(category_changes):
+    """Render the latest month's biggest category moves against last month and last year."""
+    if category_changes.empty:
+        st.info("No spending data for this period.")
+        return
+    st.markdown(f"**{category_changes['month'].iloc[0]} against the previous month and a year earlier**")
+    columns = ["category", "spending", "mom_change", "mom_pct", "yoy_change", "yoy_pct"]
+    styled_df = category_changes[columns].style.format({
+        "spending": "£{:,.2f}", "mom_change": "£{:+,.2f}", "yoy_change": "£{:+,.2f}",
+        "mom_pct": "{:+.1f}%", "yoy_pct": "{:+.1f}%",
+    }, na_rep="–")
+    st.dataframe(styled_df, hide_index=True)
+
+
+def render_category_spending(categories_spending, time_period):
+    """Render the top category highlight and spending by category bar chart."""
+    categories_spending_reversed = categories_spending.iloc[::-1] # Reversing so catgories pending in order
+    if categories_spending.empty:
+        st.info("No spending data for this period.")
+        return
+    top_category = categories_spending.iloc[0]# Top spending category
+
+    st.markdown(f"""
+    🏆 **Highest spending for {time_period}:**  
+    {top_category['category']} - £{top_category['spending']:,.2f}
+    """)
+    fig = px.bar(
+        categories_spending_reversed,
+        x='spending',
+        y='category',
+        orientation='h'
+    )
+    st.plotly_chart(fig)
+
 
+def render_unusual_transactions(df):
+    """Render transactions the anomaly scorer flagged, most unusual first."""
+    if df.empty:
+        st.info("Nothing unusual in this period.")
+        return
+    styled_df = df.style.format({'amount': '£{:.2f}', 'anomaly_score': '{:.1f}'})
+    st.dataframe(styled_df, hide_index=True)
 
 
 def display_spending_trends(time_period):
@@ -106,64 +339,99 @@ def display_spending_trends(time_period):
 
      Displays:
          - Monthly spending trend line chart (if period >= 3 months)
+         - Rolling 7/30-day spend and the latest month's category changes
+           (month-over-month and year-over-year)
          - Spending by category horizontal bar chart (descending order)
          - Highest spending category highlight
+         - Unusual transactions (scored against each merchant's history at ingest)
+         - Total (and, if show_all, per-account) balance history for the period,
+           gap-filled and downsampled server-side (see timeseries)
+         - If show_all, running balance per account reconstructed from transactions
 
      Note:
          Monthly trend chart only available for periods of 3 months or longer.
-         Shorter periods show informational message instead.
+         Shorter periods show informational message instead. All queries run
+         concurrently and each chart renders as soon as its data arrives.
      """
 
     st.markdown("## 📊 Spending Trends")
 
     # Monthly Trend
     st.markdown("### Monthly Trend")
+    monthly_section = st.container()
 
-    monthly_spending = get_spending_by_months(time_period)
-    if time_period in ["Last 3 months", "Last 6 months", "All time"]:
-        st.markdown(f"**For {time_period}**")
-        st.line_chart(monthly_spending, x="month", y="spending")
-    else:
-        st.info("Monthly trend not available for periods under 3 months")
+    # Rolling 7/30-day spend and category month-over-month (computed in SQL, see trends)
+    st.markdown("### Rolling spend")
+    rolling_section = st.container()
+    st.markdown("### Month-over-month by category")
+    changes_section = st.container()
 
     # Spending by category
     st.markdown("### Spending by category")
+    category_section = st.container()
 
-    categories_spending = get_spending_by_category(time_period)
-    categories_spending_reversed = categories_spending.iloc[::-1] # Reversing so catgories pending in order
-    if categories_spending.empty:
-        st.info("No spending data for this period.")
-        return
-    top_category = categories_spending.iloc[0]# Top spending category
-
-    st.markdown(f"""
-    🏆 **Highest spending for {time_period}:**  
-    {top_category['category']} - £{top_category['spending']:,.2f}
-    """)
-    fig = px.bar(
-        categories_spending_reversed,
-        x='spending',
-        y='category',
-        orientation='h'
-    )
-    st.plotly_chart(fig)
+    # Unusual transactions
+    st.markdown("### ⚠️ Unusual transactions")
+    unusual_section = st.container()
 
     # ROW 2: Balance History
     st.markdown("## Balance History")
 
     # Total Balance history
     st.markdown("### Total balance History")
-    total_balance_df = get_total_balance_history()
-    # st.write(total_balance_df)
-    fig_1 = px.line(total_balance_df, x='snapshot_date', y='current_balance')
-    st.plotly_chart(fig_1)
+    total_balance_section = st.container()
 
     # History for each  account if show_all
     if show_all:
         st.markdown("### Balance History for each account")
-        each_account_history = get_each_account_balance_history()
-        fig_2 = px.line(each_account_history, x='snapshot_date', y='current_balance', color='account_id')
-        st.plotly_chart(fig_2)
+    each_account_section = st.container()
+    if show_all:
+        st.markdown("### Running balance for each account (from transactions)")
+    running_section = st.container()
+
+    executor = get_executor()
+    loads = {
+        submit_panel(executor, "spending_by_months", time_period, window=time_period): "monthly",
+        submit_panel(executor, "spending_by_category", time_period, window=time_period): "category",
+        submit_panel(executor, "unusual_transactions", time_period, window=time_period): "unusual",
+        submit_panel(executor, "total_balance_history", time_period, window=time_period): "total_balance",
+        # Rolling windows and year-over-year reach back before the period, so any change invalidates them
+        submit_panel(executor, "rolling_spending", time_period): "rolling",
+        submit_panel(executor, "category_changes", time_period): "changes",
+    }
+    if show_all:
+        loads[submit_panel(executor, "each_account_balance_history", time_period, window=time_period)] = "each_account"
+        loads[submit_panel(executor, "running_balances", time_period)] = "running"
+
+    for future in as_completed(loads):
+        section = loads[future]
+        if section == "monthly":
+            with monthly_section:
+                render_monthly_trend(future.result(), time_period)
+        elif section == "rolling":
+            with rolling_section:
+                render_rolling_spending(future.result())
+        elif section == "changes":
+            with changes_section:
+                render_category_changes(future.result())
+        elif section == "category":
+            with category_section:
+                render_category_spending(future.result(), time_period)
+        elif section == "unusual":
+            with unusual_section:
+                render_unusual_transactions(future.result())
+        elif section == "total_balance":
+            with total_balance_section:
+                fig_1 = px.line(future.result(), x='snapshot_date', y='current_balance')
+                st.plotly_chart(fig_1)
+        elif section == "running":
+            with running_section:
+                fig_3 = px.line(future.result(), x='balance_date', y='running_balance', color='account_id')
+                st.plotly_chart(fig_3)
+        else:
+            with each_account_section:
+                fig_2 = px.line(future.result(), x='snapshot_date', y='current_balance', color='account_id')
+                st.plotly_chart(fig_2)
 
 
 def display_llm_insights(time_period):
@@ -201,11 +469,152 @@ def display_llm_insights(time_period):
 
 
 
+@st.cache_data(ttl=300, show_spinner=False)
+def load_explorer_filter_options():
+    """Accounts and categories for the explorer filters, refreshed every 5 minutes."""
+    return get_explorer_filter_options()
+
+
+def explorer_next_page(next_key):
+    st.session_state["explorer_keys"].append(next_key)
+
+
+def explorer_previous_page():
+    st.session_state["explorer_keys"].pop()
+
+
+def render_search_results(term):
+    """Render ranked search results with per-category facets."""
+    results, facets = search_transactions(term, limit=100)
+    if facets.empty:
+        st.info(f"No transactions match '{term}'.")
+        return
+
+    labels = [f"{row.category or 'Uncategorised'} ({row.matches})" for row in facets.itertuples()]
+    choice = st.radio("Category", ["All"] + labels, horizontal=True)
+    if choice != "All":
+        category = facets.iloc[labels.index(choice)]["category"]
+        results, _ = search_transactions(term, limit=100, category=category)
+
+    st.caption(f"{int(facets['matches'].sum())} matches, best first")
+    styled_df = results.drop(columns=["transaction_id", "score"]).style.map(
+        lambda x: 'color: red' if x < 0 else 'color: green' if x > 0 else '',
+        subset=['amount']
+    ).format({'amount': '£{:.2f}'})
+    st.dataframe(styled_df, hide_index=True)
+
+
+def display_transaction_explorer():
+    """
+    Display the paginated transaction explorer in the Explorer tab.
+
+    Pages through the full transaction history with keyset pagination, so
+    every page costs the same however far back the user browses. The next
+    page is prefetched in the background while the current one is shown.
+
+    Displays:
+        - Search box (ranked, indexed search with category facets)
+        - Sort, account, category, amount range and date range filters
+        - One page of matching transactions
+        - Previous / Next page buttons
+
+    Note:
+        Changing any filter returns to the first page.
+    """
+    st.markdown("## 🔎 Transaction Explorer")
+
+    term = st.text_input("Search descriptions and merchants", placeholder="e.g. tesco, netflix")
+    if term.strip():
+        render_search_results(term)
+        return
+
+    accounts, categories = load_explorer_filter_options()
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        sort = st.selectbox("Sort by", list(EXPLORER_SORTS))
+        page_size = st.selectbox("Rows per page", [25, 50, 100], index=1)
+    with col2:
+        account_ids = st.multiselect("Accounts", accounts, format_func=lambda acc_id: f"{acc_id[:8]}...")
+        selected_categories = st.multiselect("Categories", categories)
+    with col3:
+        min_amount = st.number_input("Min amount (£)", value=None, step=10.0)
+        max_amount = st.number_input("Max amount (£)", value=None, step=10.0)
+        date_range = st.date_input("Date range", value=())
+
+    filters = {
+        "sort": sort,
+        "limit": page_size,
+        "account_ids": account_ids,
+        "categories": selected_categories,
+        "min_amount": min_amount,
+        "max_amount": max_amount,
+        "date_from": date_range[0].isoformat() if len(date_range) > 0 else None,
+        "date_to": date_range[1].isoformat() if len(date_range) > 1 else None,
+    }
+
+    # Any filter change starts again from page 1
+    signature = repr(filters)
+    if st.session_state.get("explorer_filters") != signature:
+        st.session_state["explorer_filters"] = signature
+        st.session_state["explorer_keys"] = [None]  # start key of each visited page
+        st.session_state["explorer_prefetch"] = {}
+
+    keys = st.session_state["explorer_keys"]
+    prefetch = st.session_state["explorer_prefetch"]
+    after = keys[-1]
+
+    if after in prefetch:
+        df, next_key = prefetch.pop(after).result()
+    else:
+        df, next_key = get_transactions_page(after=after, **filters)
+
+    # Fetch the following page in the background while this one is read
+    if next_key is not None and next_key not in prefetch:
+        prefetch.clear()
+        prefetch[next_key] = get_executor().submit(get_transactions_page, after=next_key, **filters)
+
+    if df.empty:
+        st.info("No transactions match these filters.")
+    else:
+        styled_df = df.drop(columns=["transaction_id"]).style.map(
+            lambda x: 'color: red' if x < 0 else 'color: green' if x > 0 else '',
+            subset=['amount']
+        ).format({'amount': '£{:.2f}'})
+        st.dataframe(styled_df, hide_index=True)
+
+    prev_col, page_col, next_col = st.columns([1, 2, 1])
+    with prev_col:
+        st.button("◀ Previous", disabled=len(keys) == 1, on_click=explorer_previous_page)
+    with page_col:
+        st.markdown(f"Page {len(keys)}")
+    with next_col:
+        st.button("Next ▶", disabled=next_key is None, on_click=explorer_next_page, args=(next_key,))
+
+
+
+#----------PROFILING---------#
+
+# Set PROFILE_DASHBOARD=1 to profile every display_* call on each rerun. The
+# panel loads it submits run on dashboard-loader threads: they are only in the
+# .collapsed samples (along with any other session's loads at the time)
+profiler = Profiler("dashboard", enabled=os.getenv("PROFILE_DASHBOARD") == "1")
+display_balance_transactions = profiler.wrap(display_balance_transactions)
+display_spending_trends = profiler.wrap(display_spending_trends)
+display_llm_insights = profiler.wrap(display_llm_insights)
+display_transaction_explorer = profiler.wrap(display_transaction_explorer)
+
+
 #----------DASHBOARD---------#
 
 # Title and get access token for API call
 st.markdown("# Personal Finance Dashboard")
 access_token = get_access_token()
+# One routing decision per run: panel workers read from wherever the versions came from
+with pinned_reads() as read_backend:
+    st.session_state["change_versions"] = fetch_change_versions()
+st.session_state["read_backend"] = read_backend
+if DASHBOARD_ENGINE == "memory":
+    get_analytics().refresh()
 
 # Sidebar settings. Control time_period for trends.
 with st.sidebar:
@@ -219,9 +628,10 @@ with st.sidebar:
     if st.button("🔄 Refresh Data"):
         st.cache_data.clear()
         st.rerun()
+    watch_for_changes()
 
 # Display data
-tab1, tab2, tab3 = st.tabs(["Overview", "Trends", "AI Insights"])
+tab1, tab2, tab3, tab4 = st.tabs(["Overview", "Trends", "AI Insights", "Explorer"])
 
 # Overview
 with tab1:
@@ -234,6 +644,8 @@ with tab3:
     placeholder = st.empty()
     full_text = ""
     display_llm_insights(time_period)
+# Transaction Explorer
+with tab4:
+    display_transaction_explorer()
 
-
-
+profiler.write_summary()
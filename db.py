@@ -1,16 +1,171 @@
 # db.py
-import psycopg2
 import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
 from dotenv import load_dotenv
+from storage import get_backend, get_read_backend
 
 load_dotenv()
 
+# Dashboard reads may lag the primary by this many seconds before they
+# fall back to it
+READ_MAX_STALENESS = float(os.getenv("DB_READ_MAX_STALENESS", 30))
+# How often replica lag is re-measured
+READ_LAG_CHECK_SECONDS = float(os.getenv("DB_READ_LAG_CHECK_SECONDS", 5))
+
+_pools = {}
+_pool_lock = threading.Lock()
+_routing = {"checked_at": None, "use_replica": True}
+_routing_lock = threading.Lock()
+_pinned = threading.local()
+
 def get_connection():
-    return psycopg2.connect(
-        host=os.getenv("DB_HOST"),
-        port=os.getenv("DB_PORT"),
-        database=os.getenv("DB_NAME"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD")
-    )
+    """Open a new connection on the primary. Use for everything that writes."""
+    return get_backend().connect()
+
+def get_read_connection():
+    """Open a new connection on the read target (the replica if DB_READ_DSN is set)."""
+    return _read_target().connect()
+
+def _pool_for(backend):
+    with _pool_lock:
+        key = id(backend)
+        if key not in _pools:
+            _pools[key] = backend.create_pool(
+                minconn=int(os.getenv("DB_POOL_MIN", 1)),
+                maxconn=int(os.getenv("DB_POOL_MAX", 10)),
+            )
+        return _pools[key]
+
+def get_pool():
+    """Return the process-wide connection pool on the primary, creating it on first use."""
+    return _pool_for(get_backend())
+
+def get_read_pool():
+    """Return the process-wide connection pool on the replica (the primary's if there is none)."""
+    return _pool_for(get_read_backend())
+
+@contextmanager
+def _borrow(conn_pool):
+    conn = conn_pool.getconn()
+    try:
+        yield conn
+    finally:
+        if not conn.closed:
+            conn.rollback()
+        conn_pool.putconn(conn)
+
+@contextmanager
+def pooled_connection():
+    """
+    Borrow a connection on the primary from the pool and return it when done.
+
+    Safe to use from worker threads. Any open transaction is rolled back
+    before the connection goes back to the pool.
+    """
+    with _borrow(get_pool()) as conn:
+        yield conn
+
+def replica_lag():
+    """
+    Seconds the replica is behind the primary (0 without a replica).
+
+    Measured on change_log, which every write path appends to: the age of
+    the oldest change the primary has and the replica doesn't. That works
+    for any replication method (streaming replicas, copied SQLite files),
+    and an idle primary never makes an up-to-date replica look stale.
+    """
+    if get_read_backend() is get_backend():
+        return 0.0
+    with _borrow(get_read_pool()) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM finance_sandbox.change_log")
+        replica_id = cursor.fetchone()[0]
+    with _borrow(get_pool()) as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT MIN(created_at), CURRENT_TIMESTAMP
+            FROM finance_sandbox.change_log
+            WHERE id > %s
+        """, (replica_id,))
+        oldest_missing, now = cursor.fetchone()
+    if oldest_missing is None:
+        return 0.0
+    # created_at and CURRENT_TIMESTAMP both come from the primary's clock
+    lag = datetime.fromisoformat(str(now)[:19]) - datetime.fromisoformat(str(oldest_missing)[:19])
+    return max(lag.total_seconds(), 0.0)
+
+def _use_replica():
+    with _routing_lock:
+        checked_at = _routing["checked_at"]
+        if checked_at is None or time.monotonic() - checked_at >= READ_LAG_CHECK_SECONDS:
+            was_using_replica = _routing["use_replica"]
+            try:
+                lag = replica_lag()
+                _routing["use_replica"] = lag <= READ_MAX_STALENESS
+                if was_using_replica and not _routing["use_replica"]:
+                    print(f"Replica is {lag:.0f}s behind; reading from the primary")
+            except get_backend().errors as e:
+                _routing["use_replica"] = False
+                if was_using_replica:
+                    print(f"Replica unavailable, reading from the primary: {e}")
+            if _routing["use_replica"] and not was_using_replica:
+                print("Replica caught up; reading from it again")
+            _routing["checked_at"] = time.monotonic()
+        return _routing["use_replica"]
+
+def _read_target():
+    pinned = getattr(_pinned, "backend", None)
+    if pinned is not None:
+        return pinned
+    if get_read_backend() is get_backend() or not _use_replica():
+        return get_backend()
+    return get_read_backend()
+
+@contextmanager
+def read_connection():
+    """
+    Borrow a pooled connection for dashboard reads.
+
+    Goes to the replica (DB_READ_DSN) while it is within
+    READ_MAX_STALENESS seconds of the primary, to the primary otherwise.
+    Never write through it.
+    """
+    with _borrow(_pool_for(_read_target())) as conn:
+        yield conn
+
+@contextmanager
+def pinned_reads(backend=None):
+    """
+    Send every read_connection() in this thread to the same target until exit.
+
+    For readers that combine a change_log watermark with the rows it covers:
+    taking them from different targets could record a watermark newer than
+    the rows actually read. Pins are per thread, so work handed to other
+    threads passes the yielded backend on and pins it there.
+
+    Args:
+        backend: Target to pin (default: the enclosing pin, or the current read target)
+
+    Yields:
+        The pinned backend
+    """
+    previous = getattr(_pinned, "backend", None)
+    _pinned.backend = backend or previous or _read_target()
+    try:
+        yield _pinned.backend
+    finally:
+        _pinned.backend = previous
 
+def create_schema():
+    """Create all tables and indexes on the configured backend."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    get_backend().migrate(conn)
+    for statement in get_backend().schema_statements():
+        cursor.execute(statement)
+    conn.commit()
+    conn.close()
+    print(f"Schema created on {get_backend().name} backend")
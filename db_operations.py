@@ -1,119 +1,53 @@
-import sqlite3
 from account_data import fetching_all_transactions, get_all_accounts_balance
-from llm import batch_categorise_llm
+from llm import batch_categorise_llm, CATEGORY_VERSION, MODEL
 from datetime import datetime
-from db import get_connection
-import psycopg2
-
-def create_transactions_database():
-    conn = sqlite3.connect("spending.db")
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS transactions (
-            transaction_id TEXT PRIMARY KEY,
-            account_id TEXT,
-            amount REAL,
-            currency TEXT,
-            description TEXT,
-            transaction_date TEXT,
-            timestamp TEXT,
-            transaction_type TEXT,
-            category TEXT,
-            merchant_name TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
-    print("Database created successfully")
-
-def create_balances_table():
-    conn = sqlite3.connect("spending.db")
-    cursor = conn.cursor()
-    cursor.execute( ''' 
-        CREATE TABLE IF NOT EXISTS balance_history (
-            account_id TEXT NOT NULL,
-            current_balance REAL,
-            available_balance REAL,
-            overdraft_limit REAL,
-            snapshot_date TEXT NOT NULL,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP,  -- When record was created
-            PRIMARY KEY (account_id, snapshot_date)
-        )
-    ''')
-    conn.commit()
+from db import get_connection, create_schema
+from db_queries import iter_query_rows, sample_transactions
+from change_events import publish_change
+from storage import get_backend
+from merchants import normalise_merchants
+from category_index import get_category_index, SIMILARITY_THRESHOLD, INDEX_MODEL
+from records import BALANCE_COLUMNS, TRANSACTION_COLUMNS
+
+def create_database():
+    """Create all tables on the configured storage backend (STORAGE_BACKEND)."""
+    create_schema()
+    conn = get_connection()
+    get_backend().rebuild_search_index(conn)
     conn.close()
-    print("Database created successfully")
 
-#Create api_cost table
-# conn = sqlite3.connect("spending.db")
-# cursor = conn.cursor()
-#
-# cursor.execute("""
-#     CREATE TABLE IF NOT EXISTS api_costs (
-#         id INTEGER PRIMARY KEY AUTOINCREMENT,
-#         model TEXT NOT NULL,
-#         input_tokens INTEGER,
-#         output_tokens INTEGER,
-#         total_tokens INTEGER,
-#         cost REAL,
-#         timestamp TEXT DEFAULT CURRENT_TIMESTAMP
-#     )
-# """)
-# conn.commit()
-# conn.close()
-# print("Database created successfully")
-
-def save_single_transaction_to_db(transaction, account_id, conn):
-    """Save a single transaction to the database."""
-    conn = conn
+def save_single_transaction_to_db(transaction, conn):
+    """Save a single Transaction record to the database."""
     cursor = conn.cursor()
 
-    # Extract date from timestamp (YYYY-MM-DD)
-    transaction_date = transaction['timestamp'][:10]
-
-    # Extract running balance if exists
-    running_balance = transaction.get('running_balance', {}).get('amount')
-
     try:
-        cursor.execute("""
+        cursor.execute(f"""
     INSERT INTO finance_sandbox.transactions
-    (transaction_id, account_id, amount, currency, description,
-     transaction_date, timestamp, transaction_type, category,
-     merchant_name)
+    ({', '.join(TRANSACTION_COLUMNS)})
     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
     ON CONFLICT (transaction_id) DO NOTHING
-    """, (
-            transaction['transaction_id'],
-            account_id,
-            transaction['amount'],
-            transaction['currency'],
-            transaction['description'],
-            transaction_date,
-            transaction['timestamp'],
-            transaction['transaction_type'],
-            None,  # category - will categorize later
-            None,  # merchant_name - will extract later
-        ))
+    """, transaction.to_row())
         return True
-    except psycopg2.Error as e:
+    except get_backend().errors as e:
         print(f"Error saving transaction: {e}")
         return False
 
 
 
-def save_all_transactions_to_db(access_token):
+def save_all_transactions_to_db(access_token, account_ids=None):
     """
     Fetch and save all transactions for all accounts to the database.
 
     Args:
         access_token (str): Valid TrueLayer access token
+        account_ids (list): Accounts to sync (default: those in accounts.json)
 
     Returns:
         list: Transaction IDs that failed to save (empty if all successful)
         True: If all transactions saved successfully
     """
     print("Fetching all transactions...")
-    all_transactions = fetching_all_transactions(access_token)
+    all_transactions = fetching_all_transactions(access_token, account_ids)
     print(f"Got transactions: {all_transactions is not None}")
     failed_transactions = []
     saved_count = 0
@@ -122,7 +56,14 @@ def save_all_transactions_to_db(access_token):
         print("No transactions found")
         return []
 
+    # Normalise every distinct description in one vectorised pass up front
+    descriptions = list({t.description for transactions in all_transactions.values() if transactions
+                         for t in transactions})
+    merchant_names = dict(zip(descriptions, normalise_merchants(descriptions)))
+
     conn = get_connection()
+    saved_accounts = set()
+    saved_dates = []
 
     try:
         for account_id in all_transactions:
@@ -132,14 +73,20 @@ def save_all_transactions_to_db(access_token):
                 continue
 
             for transaction in all_transactions[account_id]:
-                # print(f"Saving transaction: {transaction['transaction_id']}")
+                # print(f"Saving transaction: {transaction.transaction_id}")
                 try:
-                    result = save_single_transaction_to_db(transaction, account_id, conn)
-                    # print(f"Saved: {transaction['transaction_id']} - {result}")
+                    transaction.merchant_name = merchant_names.get(transaction.description)
+                    result = save_single_transaction_to_db(transaction, conn)
+                    # print(f"Saved: {transaction.transaction_id} - {result}")
                     saved_count += 1
-                except psycopg2.Error as e:
-                    print(f"Database error for transaction {transaction['transaction_id']}: {e}")
-                    failed_transactions.append(transaction["transaction_id"])
+                    saved_accounts.add(account_id)
+                    saved_dates.append(transaction.transaction_date)
+                except get_backend().errors as e:
+                    print(f"Database error for transaction {transaction.transaction_id}: {e}")
+                    failed_transactions.append(transaction.transaction_id)
+        if saved_dates:
+            publish_change(conn, "transactions", "ingest", saved_accounts,
+                           min(saved_dates).isoformat(), max(saved_dates).isoformat(), saved_count)
         conn.commit()
         print(f"Successfully saved {saved_count} transactions")
     finally:
@@ -177,69 +124,97 @@ def save_all_transactions_to_db(access_token):
 #     conn.close()
 #     print("Done!")
 
-def update_all_categories_batch():
-    """Update categories for all transactions using batch processing."""
+def update_all_categories_batch(account_ids=None):
+    """
+    Update categories for all transactions using batch processing.
+
+    Uncategorised rows are streamed from a server-side cursor one batch at a
+    time, so memory stays flat however many rows need categorising. Each
+    description is first matched against already-labelled ones (see
+    category_index); only those below SIMILARITY_THRESHOLD go to the LLM.
+
+    Args:
+        account_ids (list): Only categorise these accounts' transactions (default: all)
+    """
     conn = get_connection()
     cursor = conn.cursor()
 
-    cursor.execute("SELECT transaction_id, description FROM finance_sandbox.transactions WHERE category IS NULL")
-    transactions = cursor.fetchall()
-
-    print(f"Categorizing {len(transactions)} transactions...")
+    where, params = "WHERE category IS NULL", ()
+    if account_ids:
+        where += f" AND account_id IN ({', '.join(['%s'] * len(account_ids))})"
+        params = tuple(account_ids)
+    cursor.execute(f"SELECT COUNT(*) FROM finance_sandbox.transactions {where}", params)
+    total = cursor.fetchone()[0]
+    print(f"Categorizing {total} transactions...")
 
     batch_size = 50
     total_updated = 0
-
-    for i in range(0, len(transactions), batch_size):
-        batch = transactions[i:i + batch_size]
-        descriptions = [desc for _, desc in batch]
-
-        # Get categories for batch
-        category_map = batch_categorise_llm(descriptions)
-
-        # Update database
-        for trans_id, description in batch:
-            category = category_map.get(description, 'Uncategorized')
-            cursor.execute(
-                "UPDATE finance_sandbox.transactions SET category = %s WHERE transaction_id = %s",
-                (category, trans_id)
-            )
-            total_updated += 1
-
+    matched_locally = 0
+    index = get_category_index()
+
+    for batch in iter_query_rows(f"""
+        SELECT transaction_id, description, account_id, transaction_date
+        FROM finance_sandbox.transactions
+        {where}
+    """, params, itersize=batch_size):
+        # Repeated descriptions (same merchant, same wording) only need categorising once
+        descriptions = list(dict.fromkeys(desc for _, desc, _, _ in batch))
+
+        # Confident nearest-neighbour matches skip the LLM entirely
+        predicted, confidence = index.predict(descriptions)
+        category_map = {description: category
+                        for description, category, score in zip(descriptions, predicted, confidence)
+                        if score >= SIMILARITY_THRESHOLD}
+        local_matches = set(category_map)
+        matched_locally += len(local_matches)
+
+        unmatched = [description for description in descriptions if description not in category_map]
+        if unmatched:
+            llm_map = batch_categorise_llm(unmatched)
+            category_map.update(llm_map)
+            index.add(llm_map.keys(), llm_map.values())
+
+        # Update database, recording which model and prompt version produced each label
+        cursor.executemany("""
+            UPDATE finance_sandbox.transactions
+            SET category = %s, category_version = %s, category_model = %s
+            WHERE transaction_id = %s
+        """, [
+            (category_map.get(description, 'Uncategorized'), CATEGORY_VERSION,
+             INDEX_MODEL if description in local_matches else MODEL, trans_id)
+            for trans_id, description, _, _ in batch
+        ])
+        total_updated += len(batch)
+
+        batch_dates = [str(date) for _, _, _, date in batch]
+        publish_change(conn, "transactions", "categorise", {acc for _, _, acc, _ in batch},
+                       min(batch_dates), max(batch_dates), len(batch))
         conn.commit()
-        print(f"Processed {total_updated}/{len(transactions)} transactions...")
+        print(f"Processed {total_updated}/{total} transactions...")
 
     conn.close()
-    print("Done!")
+    index.save()
+    print(f"Done! {matched_locally} descriptions matched locally without the LLM")
 
 def get_random_transactions(number):
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    # cursor.execute("SELECT description, category FROM transactions LIMIT 100")
-    cursor.execute("""
-        SELECT description, category FROM finance_sandbox.transactions 
-        ORDER BY RANDOM() 
-        LIMIT %s
-    """,(number,))
-
-    for row in cursor.fetchall():
+    """Print a random sample of descriptions and categories, proportional per category."""
+    sample = sample_transactions(number)
+    for row in sample[["description", "category"]].itertuples(index=False):
         print(tuple(row))
 
-    conn.close()
-
-def save_daily_balance_snapshot(access_token):
+def save_daily_balance_snapshot(access_token, account_ids=None):
     """
     Save daily balance snapshot for all accounts.
 
     Args:
         access_token (str): Valid TrueLayer access token
+        account_ids (list): Accounts to snapshot (default: those in accounts.json)
 
     Note:
         Should be run once per day (e.g., midnight via cron job).
         Uses INSERT OR IGNORE to prevent duplicates if run multiple times.
     """
-    balances = get_all_accounts_balance(access_token)
+    balances = get_all_accounts_balance(access_token, account_ids)
 
     if not balances:
         print("No balances to save")
@@ -250,20 +225,16 @@ def save_daily_balance_snapshot(access_token):
 
     snapshot_date = datetime.now().date().isoformat()  # YYYY-MM-DD format
 
-    for account_id, balance_info in balances.items():
-        cursor.execute("""
+    for balance in balances.values():
+        cursor.execute(f"""
             INSERT INTO finance_sandbox.balance_history
-            (account_id, current_balance, available_balance, overdraft_limit, snapshot_date)
+            ({', '.join(BALANCE_COLUMNS)})
             VALUES (%s, %s, %s, %s, %s)
             ON CONFLICT (account_id, snapshot_date) DO NOTHING
-        """, (
-            account_id,
-            balance_info.get('current'),
-            balance_info.get('available'),
-            balance_info.get('overdraft'),
-            snapshot_date
-        ))
+        """, balance.to_row(snapshot_date))
 
+    publish_change(conn, "balance_history", "snapshot", balances.keys(),
+                   snapshot_date, snapshot_date, len(balances))
     conn.commit()
     conn.close()
     print(f"Saved balance snapshot for {len(balances)} accounts on {snapshot_date}")
\ No newline at end of file
@@ -1,58 +1,118 @@
-import sqlite3
-import pandas as pd
-from datetime import datetime, timedelta
-import psycopg2
-from db import get_connection
+from datetime import date, datetime, timedelta
+import math
+import os
+import random
+import re
+from db import get_read_connection, pooled_connection, read_connection
+from storage import get_backend
+from anomalies import ANOMALY_THRESHOLD
+from recurring import forecast_payments, LAPSED_AFTER_DAYS
+from timeseries import balance_series, CHART_POINTS
+from lazy_imports import pd
+
+# Rows fetched per round trip by the streaming helpers
+ITERSIZE = int(os.getenv("DB_ITERSIZE", 5000))
+# SQLite fuzzy search: share of the term's trigrams a result must contain
+# (pg_trgm's word_similarity threshold plays this role on Postgres)
+MIN_TRIGRAM_SHARE = float(os.getenv("MIN_TRIGRAM_SHARE", 0.5))
 
 
 def count_nulls(column):
     """Gets Null vales for field selected in as parameter"""
-    with get_connection() as conn:
+    with get_read_connection() as conn:
         cursor = conn.cursor()
 
         cursor.execute(f"SELECT COUNT(*) FROM transactions WHERE {column} IS NULL")
         null_count = cursor.fetchone()[0]
         return null_count
 
+def iter_query_rows(sql, params=(), itersize=ITERSIZE, replica=False):
+    """
+    Stream a query's rows without loading the whole result set.
+
+    Uses a server-side cursor on Postgres, so memory and time to first row
+    stay flat however large the table grows. The pooled connection is held
+    until the generator is exhausted or closed.
+
+    Args:
+        replica (bool): Read through read_connection() (see db). Only for
+            dashboard reads; anything that writes based on the rows must
+            read the primary.
+
+    Yields:
+        list: Batches of up to itersize row tuples
+    """
+    with (read_connection() if replica else pooled_connection()) as conn:
+        cursor = get_backend().stream_cursor(conn, itersize)
+        try:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(itersize)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+def iter_query_chunks(sql, params=(), itersize=ITERSIZE, columns=None, replica=False):
+    """
+    Stream a query as DataFrame chunks of up to itersize rows.
+
+    Args:
+        sql (str): Query; select only the columns you need
+        params (tuple): Query parameters
+        itersize (int): Rows per chunk
+        columns (list): Column names, in SELECT order
+        replica (bool): Read from the replica (see iter_query_rows)
+
+    Yields:
+        pd.DataFrame: One chunk per batch
+    """
+    for rows in iter_query_rows(sql, params, itersize, replica):
+        yield pd.DataFrame(rows, columns=columns)
+
 def get_spending_this_week():
     """Query db for total spending of the current week to date"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT SUM(amount) FROM finance_sandbox.transactions 
-        WHERE transaction_date >= CURRENT_DATE - INTERVAL '6 days'
-        AND amount < 0
-    """)
-    result = cursor.fetchone()[0]
-    cursor.close()
+    # Cutoffs computed here rather than with INTERVAL so the SQL runs on every backend
+    cutoff_date = (date.today() - timedelta(days=6)).isoformat()
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT SUM(amount) FROM finance_sandbox.transactions 
+            WHERE transaction_date >= %s
+            AND amount < 0
+        """, (cutoff_date,))
+        result = cursor.fetchone()[0]
+        cursor.close()
     return abs(result) if result else 0.0
 
 
 def get_spending_this_month():
     """Query db for total spending of the current month to date"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT SUM(amount) FROM finance_sandbox.transactions 
-        WHERE transaction_date >= DATE_TRUNC('month', CURRENT_DATE)
-        AND amount < 0
-    """)
-    result= cursor.fetchone()[0]
-    cursor.close()
+    cutoff_date = date.today().replace(day=1).isoformat()
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT SUM(amount) FROM finance_sandbox.transactions 
+            WHERE transaction_date >= %s
+            AND amount < 0
+        """, (cutoff_date,))
+        result= cursor.fetchone()[0]
+        cursor.close()
     return abs(result) if result else 0.0
 
 
 def get_last_transactions(limit=10):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT description, transaction_date, amount FROM finance_sandbox.transactions 
-        ORDER BY transaction_date DESC 
-        LIMIT %s
-    """, (limit,))
-    columns = [desc[0] for desc in cursor.description]
-    data = cursor.fetchall()
-    cursor.close()
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT description, transaction_date, amount FROM finance_sandbox.transactions 
+            ORDER BY transaction_date DESC 
+            LIMIT %s
+        """, (limit,))
+        columns = [desc[0] for desc in cursor.description]
+        data = cursor.fetchall()
+        cursor.close()
     return pd.DataFrame(data, columns=columns)
 
 def get_spending_by_months(time_frame="All time"):
@@ -66,33 +126,31 @@ def get_spending_by_months(time_frame="All time"):
         "All time": None
     }
     days = days_map[time_frame]
-    if days:
-        cutoff_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT TO_CHAR(timestamp, 'YYYY-MM') AS month,
-            ABS(SUM(amount)) AS spending
-            FROM finance_sandbox.transactions
-            WHERE amount < 0 AND transaction_date >= %s
-            GROUP BY month
-            ORDER BY month
-        """, (cutoff_date,))
-    else:
-        conn = get_connection()
+    with read_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("""
-            SELECT TO_CHAR(timestamp, 'YYYY-MM') AS month,
-            ABS(SUM(amount)) AS spending
-            FROM finance_sandbox.transactions
-            WHERE amount < 0
-            GROUP BY month
-            ORDER BY month
-        """)
+        if days:
+            cutoff_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+            cursor.execute("""
+                SELECT TO_CHAR(timestamp, 'YYYY-MM') AS month,
+                ABS(SUM(amount)) AS spending
+                FROM finance_sandbox.transactions
+                WHERE amount < 0 AND transaction_date >= %s
+                GROUP BY month
+                ORDER BY month
+            """, (cutoff_date,))
+        else:
+            cursor.execute("""
+                SELECT TO_CHAR(timestamp, 'YYYY-MM') AS month,
+                ABS(SUM(amount)) AS spending
+                FROM finance_sandbox.transactions
+                WHERE amount < 0
+                GROUP BY month
+                ORDER BY month
+            """)
 
-    columns = [desc[0] for desc in cursor.description]
-    data = cursor.fetchall()
-    cursor.close()
+        columns = [desc[0] for desc in cursor.description]
+        data = cursor.fetchall()
+        cursor.close()
     return pd.DataFrame(data, columns=columns)
 
 def get_spending_by_category(time_frame="All time"):
@@ -107,35 +165,33 @@ def get_spending_by_category(time_frame="All time"):
         "All time": None
     }
     days = days_map[time_frame]
-    if days:
-        cutoff_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
-
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT category, ROUND(ABS(SUM(amount)), 2) AS spending
-            FROM finance_sandbox.transactions
-            WHERE amount < 0 AND transaction_date >= %s
-            GROUP BY category
-            ORDER BY spending DESC
-        """, (cutoff_date,))
-    else:
-        conn = get_connection()
+    with read_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("""
-            SELECT category, ROUND(ABS(SUM(amount)), 2) AS spending
-            FROM finance_sandbox.transactions
-            WHERE amount < 0
-            GROUP BY category
-            ORDER BY spending DESC
-        """)
+        if days:
+            cutoff_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+            cursor.execute("""
+                SELECT category, ROUND(ABS(SUM(amount)), 2) AS spending
+                FROM finance_sandbox.transactions
+                WHERE amount < 0 AND transaction_date >= %s
+                GROUP BY category
+                ORDER BY spending DESC
+            """, (cutoff_date,))
+        else:
+            cursor.execute("""
+                SELECT category, ROUND(ABS(SUM(amount)), 2) AS spending
+                FROM finance_sandbox.transactions
+                WHERE amount < 0
+                GROUP BY category
+                ORDER BY spending DESC
+            """)
 
-    columns = [desc[0] for desc in cursor.description]
-    data = cursor.fetchall()
-    cursor.close()
+        columns = [desc[0] for desc in cursor.description]
+        data = cursor.fetchall()
+        cursor.close()
     return pd.DataFrame(data, columns=columns)
 
 def get_largest_transactions(time_frame="All time"):
+    """Largest outgoing payments in the period, biggest first."""
     days_map = {
         "Last 7 days": 7,
         "Last 30 days": 30,
@@ -144,29 +200,60 @@ def get_largest_transactions(time_frame="All time"):
         "All time": None
     }
     days = days_map[time_frame]
-    if days:
-        cutoff_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
-        conn = get_connection()
+    with read_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("""
-            SELECT transaction_date, description, category, amount
-            FROM finance_sandbox.transactions
-            WHERE transaction_date >= %s
-            ORDER BY amount DESC
-            LIMIT 10
-        """, (cutoff_date,))
-    else:
-        conn = get_connection()
+        if days:
+            cutoff_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+            cursor.execute("""
+                SELECT transaction_date, description, category, amount
+                FROM finance_sandbox.transactions
+                WHERE amount < 0 AND transaction_date >= %s
+                ORDER BY amount ASC
+                LIMIT 10
+            """, (cutoff_date,))
+        else:
+            cursor.execute("""
+                SELECT transaction_date, description, category, amount
+                FROM finance_sandbox.transactions
+                WHERE amount < 0
+                ORDER BY amount ASC
+                LIMIT 10
+            """)
+        columns = [desc[0] for desc in cursor.description]
+        data = cursor.fetchall()
+        cursor.close()
+    return pd.DataFrame(data, columns=columns)
+
+def get_unusual_transactions(time_frame="All time", limit=10):
+    """
+    Transactions flagged by the anomaly scorer (see anomalies), most unusual first.
+
+    Only reads rows already scored at ingest; no statistics are computed here.
+    """
+    days_map = {
+        "Last 7 days": 7,
+        "Last 30 days": 30,
+        "Last 3 months": 90,
+        "Last 6 months": 180,
+        "All time": None
+    }
+    days = days_map[time_frame]
+    conditions, params = ["anomaly_score >= %s"], [ANOMALY_THRESHOLD]
+    if days:
+        conditions.append("transaction_date >= %s")
+        params.append((datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d'))
+    with read_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("""
-            SELECT transaction_date, description, category, amount
+        cursor.execute(f"""
+            SELECT transaction_date, description, merchant_name, category, amount, anomaly_score
             FROM finance_sandbox.transactions
-            ORDER BY amount DESC
-            LIMIT 10
-        """)
-    columns = [desc[0] for desc in cursor.description]
-    data = cursor.fetchall()
-    cursor.close()
+            WHERE {' AND '.join(conditions)}
+            ORDER BY anomaly_score DESC
+            LIMIT %s
+        """, (*params, limit))
+        columns = [desc[0] for desc in cursor.description]
+        data = cursor.fetchall()
+        cursor.close()
     return pd.DataFrame(data, columns=columns)
 
 def get_total_spending(time_frame="All time"):
@@ -178,46 +265,416 @@ def get_total_spending(time_frame="All time"):
         "All time": None
     }
     days = days_map[time_frame]
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        if days:
+            cutoff_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+            cursor.execute("""
+                SELECT SUM(amount) AS total_spending
+                FROM finance_sandbox.transactions
+                WHERE transaction_date >= %s
+            """, (cutoff_date,))
+        else:
+            cursor.execute("SELECT SUM(amount) as total_spending "
+                           "FROM finance_sandbox.transactions "
+                           )
+        columns = [desc[0] for desc in cursor.description]
+        data = cursor.fetchall()
+        cursor.close()
+    return pd.DataFrame(data, columns=columns)
+
+
+def _balance_snapshots(time_frame="All time", account_ids=None):
+    """
+    Balance snapshots in a window, plus each account's last one before it.
+
+    The extra row per account lets the chart start the window filled rather
+    than blank until each account's first snapshot inside it.
+    """
+    days_map = {
+        "Last 7 days": 7,
+        "Last 30 days": 30,
+        "Last 3 months": 90,
+        "Last 6 months": 180,
+        "All time": None
+    }
+    days = days_map[time_frame]
+    conditions, params = [], []
+    cutoff_date = None
     if days:
         cutoff_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
-        conn = get_connection()
+        conditions.append("""
+            b.snapshot_date >= COALESCE((
+                SELECT MAX(p.snapshot_date) FROM finance_sandbox.balance_history p
+                WHERE p.account_id = b.account_id AND p.snapshot_date < %s
+            ), %s)
+        """)
+        params.extend([cutoff_date, cutoff_date])
+    if account_ids:
+        conditions.append(f"b.account_id IN ({', '.join(['%s'] * len(account_ids))})")
+        params.extend(account_ids)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = f"SELECT account_id, snapshot_date, current_balance FROM finance_sandbox.balance_history b {where}"
+    columns = ["account_id", "snapshot_date", "current_balance"]
+    chunks = list(iter_query_chunks(query, tuple(params), columns=columns, replica=True))
+    snapshots = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=columns)
+    return snapshots, cutoff_date
+
+def get_each_account_balance_history(time_frame="All time", points=CHART_POINTS, account_ids=None):
+    """
+    Balance per account per day, gap-filled and downsampled for charting.
+
+    Args:
+        time_frame (str): Window to show, as in get_spending_by_category
+        points (int): Maximum points per account line
+        account_ids (tuple): Only these accounts (default: all)
+
+    Returns:
+        pd.DataFrame: account_id, snapshot_date, current_balance
+    """
+    snapshots, cutoff_date = _balance_snapshots(time_frame, account_ids)
+    return balance_series(snapshots, cutoff_date, points, per_account=True)
+
+def get_total_balance_history(time_frame="All time", points=CHART_POINTS, account_ids=None):
+    """
+    Total balance per day, gap-filled and downsampled for charting.
+
+    Accounts are forward-filled before summing, so a day one account missed
+    its snapshot no longer shows as a dip in the total.
+
+    Returns:
+        pd.DataFrame: current_balance, snapshot_date
+    """
+    snapshots, cutoff_date = _balance_snapshots(time_frame, account_ids)
+    return balance_series(snapshots, cutoff_date, points)
+
+def _active_recurring_series(as_of):
+    """recurring_series rows still running on as_of: not lapsed and no cancelled direct debit."""
+    cutoff = (as_of - timedelta(days=LAPSED_AFTER_DAYS)).isoformat()
+    with read_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("""
-            SELECT SUM(amount) AS total_spending
+            SELECT merchant_name, cadence, typical_amount, occurrences, last_date, next_expected, anchor_day, account_id,
+                   CASE WHEN direct_debit_id IS NULL THEN 'transactions'
+                        WHEN occurrences > 0 THEN 'transactions + direct debit'
+                        ELSE 'direct debit' END AS source
+            FROM finance_sandbox.recurring_series
+            WHERE next_expected >= %s AND (direct_debit_status IS NULL OR direct_debit_status = 'active')
+            ORDER BY typical_amount ASC
+        """, (cutoff,))
+        columns = [desc[0] for desc in cursor.description]
+        data = cursor.fetchall()
+        cursor.close()
+    return pd.DataFrame(data, columns=columns)
+
+def get_recurring_payments(as_of=None):
+    """Active subscriptions and other recurring payments (see recurring), largest first."""
+    as_of = date.fromisoformat(as_of) if as_of else date.today()
+    return _active_recurring_series(as_of).drop(columns="anchor_day")
+
+def get_upcoming_payments(days=30, start=None):
+    """
+    Forecast of recurring payments due in the next days days.
+
+    start (YYYY-MM-DD, default today) is a parameter so cached results roll over daily.
+    """
+    start = date.fromisoformat(start) if start else date.today()
+    series = _active_recurring_series(start)
+    forecast = forecast_payments(series.to_dict("records"), start, start + timedelta(days=days))
+    return pd.DataFrame(forecast, columns=["due_date", "merchant_name", "amount", "cadence"])
+
+# Sort option -> (key column, direction). transaction_id breaks ties so keys are unique.
+EXPLORER_SORTS = {
+    "Newest first": ("transaction_date", "DESC"),
+    "Oldest first": ("transaction_date", "ASC"),
+    "Largest amount": ("amount", "DESC"),
+    "Smallest amount": ("amount", "ASC"),
+}
+
+def get_transactions_page(sort="Newest first", after=None, limit=50, account_ids=None, categories=None,
+                          min_amount=None, max_amount=None, date_from=None, date_to=None):
+    """
+    One page of transactions using keyset pagination.
+
+    Instead of OFFSET (which scans and discards every earlier row), each page
+    starts strictly after the (sort column, transaction_id) of the previous
+    page's last row, so page 1000 costs the same as page 1. Matching
+    composite indexes are created by the storage backend schema.
+
+    Args:
+        sort (str): Key of EXPLORER_SORTS
+        after (tuple): (sort value, transaction_id) of the last row of the previous page
+        limit (int): Rows per page
+        account_ids (list): Only these accounts
+        categories (list): Only these categories
+        min_amount (float): Lower bound on amount (inclusive)
+        max_amount (float): Upper bound on amount (inclusive)
+        date_from (str): First transaction_date (inclusive, YYYY-MM-DD)
+        date_to (str): Last transaction_date (inclusive, YYYY-MM-DD)
+
+    Returns:
+        tuple: (DataFrame of up to limit rows, key for the next page or None if this is the last page)
+    """
+    key_column, direction = EXPLORER_SORTS[sort]
+    conditions, params = [], []
+
+    if account_ids:
+        conditions.append(f"account_id IN ({', '.join(['%s'] * len(account_ids))})")
+        params.extend(account_ids)
+    if categories:
+        conditions.append(f"category IN ({', '.join(['%s'] * len(categories))})")
+        params.extend(categories)
+    if min_amount is not None:
+        conditions.append("amount >= %s")
+        params.append(min_amount)
+    if max_amount is not None:
+        conditions.append("amount <= %s")
+        params.append(max_amount)
+    if date_from:
+        conditions.append("transaction_date >= %s")
+        params.append(date_from)
+    if date_to:
+        conditions.append("transaction_date <= %s")
+        params.append(date_to)
+    if after is not None:
+        operator = "<" if direction == "DESC" else ">"
+        conditions.append(f"({key_column}, transaction_id) {operator} (%s, %s)")
+        params.extend(after)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    columns = ["transaction_id", "transaction_date", "description", "category", "amount", "account_id"]
+
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        # One extra row tells us whether there is a next page without a COUNT(*)
+        cursor.execute(f"""
+            SELECT {', '.join(columns)}
             FROM finance_sandbox.transactions
-            WHERE transaction_date >= %s
-        """, (cutoff_date,))
-    else:
-        conn = get_connection()
+            {where}
+            ORDER BY {key_column} {direction}, transaction_id {direction}
+            LIMIT %s
+        """, (*params, limit + 1))
+        rows = cursor.fetchall()
+        cursor.close()
+
+    df = pd.DataFrame(rows[:limit], columns=columns)
+    next_key = None
+    if len(rows) > limit:
+        # Take the key from the raw row so it round-trips with its DB type
+        last = rows[limit - 1]
+        next_key = (last[columns.index(key_column)], last[columns.index("transaction_id")])
+    return df, next_key
+
+def get_explorer_filter_options():
+    """Distinct accounts and categories for the explorer filters."""
+    with read_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT SUM(amount) as total_spending "
-                       "FROM finance_sandbox.transactions "
-                       )
-    columns = [desc[0] for desc in cursor.description]
-    data = cursor.fetchall()
-    cursor.close()
-    return pd.DataFrame(data, columns=columns)
+        cursor.execute("SELECT DISTINCT account_id FROM finance_sandbox.transactions ORDER BY account_id")
+        accounts = [row[0] for row in cursor.fetchall() if row[0]]
+        cursor.execute("SELECT DISTINCT category FROM finance_sandbox.transactions ORDER BY category")
+        categories = [row[0] for row in cursor.fetchall() if row[0]]
+        cursor.close()
+    return accounts, categories
 
+def _search_terms(term):
+    """Split user input into plain alphanumeric words (nothing to escape)."""
+    return re.findall(r"\w+", term.lower())
 
-def get_each_account_balance_history():
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM finance_sandbox.balance_history")
+def _search_plan(term, mode):
+    """
+    Build the backend-specific FROM/WHERE/rank SQL for a search.
 
-    columns = [desc[0] for desc in cursor.description]
-    data = cursor.fetchall()
-    cursor.close()
-    return pd.DataFrame(data, columns=columns)
+    Returns:
+        tuple: (from_sql, where_sql, rank_sql, params, rank_params) or None if the
+               term has nothing searchable
+    """
+    words = _search_terms(term)
+    if not words:
+        return None
+    backend = get_backend().name
+
+    if mode == "prefix":
+        if backend == "sqlite":
+            # FTS5 prefix query, ranked by bm25 (lower is better, so negate)
+            return ("finance_sandbox.transactions_fts JOIN finance_sandbox.transactions t "
+                    "ON t.rowid = transactions_fts.rowid",
+                    "transactions_fts MATCH %s", "-bm25(transactions_fts)",
+                    [" ".join(f'"{word}"*' for word in words)], [])
+        query = " & ".join(f"{word}:*" for word in words)
+        return ("finance_sandbox.transactions t",
+                "t.search_vector @@ to_tsquery('simple', %s)",
+                "ts_rank(t.search_vector, to_tsquery('simple', %s))",
+                [query], [query])
+
+    # Fuzzy: rank by shared trigrams, so typos and partial store names still match
+    text = " ".join(words)
+    if backend == "sqlite":
+        trigrams = sorted({word[i:i + 3] for word in words for i in range(len(word) - 2)})
+        if not trigrams:
+            return None
+        # Any shared trigram makes a candidate; only rows sharing at least
+        # MIN_TRIGRAM_SHARE of the term's trigrams are kept, ranked by that share
+        # (one common trigram such as "etf" would otherwise match "BETFRED" for "netflx")
+        document = "lower(coalesce(t.description, '') || ' ' || coalesce(t.merchant_name, ''))"
+        shared = "(" + " + ".join(f"(instr({document}, %s) > 0)" for _ in trigrams) + ")"
+        return ("finance_sandbox.transactions_trigram JOIN finance_sandbox.transactions t "
+                "ON t.rowid = transactions_trigram.rowid",
+                f"transactions_trigram MATCH %s AND {shared} >= %s",
+                f"{shared} * 1.0 / {len(trigrams)}",
+                [" OR ".join(f'"{trigram}"' for trigram in trigrams), *trigrams,
+                 math.ceil(MIN_TRIGRAM_SHARE * len(trigrams))],
+                trigrams)
+    document = "(coalesce(t.description, '') || ' ' || coalesce(t.merchant_name, ''))"
+    return ("finance_sandbox.transactions t",
+            f"%s <%% {document}",
+            f"word_similarity(%s, {document})",
+            [text], [text])
+
+def search_transactions(term, limit=50, category=None, mode="auto"):
+    """
+    Ranked search over transaction descriptions and merchant names.
+
+    Backed by indexes, never a LIKE '%term%' scan: tsvector + pg_trgm GIN
+    indexes on Postgres, FTS5 word and trigram tables on SQLite.
+
+    Args:
+        term (str): Search text
+        limit (int): Maximum results
+        category (str): Only return results in this category (facets still cover all)
+        mode (str): "prefix" (word prefixes, e.g. "tes co"), "fuzzy" (typo tolerant)
+                    or "auto" (prefix, falling back to fuzzy when nothing matches)
+
+    Returns:
+        tuple: (results DataFrame ordered by relevance, facets DataFrame of category/matches)
+    """
+    columns = ["transaction_id", "transaction_date", "description", "merchant_name", "category", "amount", "score"]
+    if mode == "auto":
+        results, facets = search_transactions(term, limit, category, "prefix")
+        if facets.empty:
+            return search_transactions(term, limit, category, "fuzzy")
+        return results, facets
+
+    plan = _search_plan(term, mode)
+    if plan is None:
+        return pd.DataFrame(columns=columns), pd.DataFrame(columns=["category", "matches"])
+    from_sql, where_sql, rank_sql, params, rank_params = plan
+
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        category_sql = ""
+        category_params = []
+        if category:
+            category_sql = "AND t.category = %s"
+            category_params = [category]
+        cursor.execute(f"""
+            SELECT t.transaction_id, t.transaction_date, t.description, t.merchant_name,
+                   t.category, t.amount, {rank_sql} AS score
+            FROM {from_sql}
+            WHERE {where_sql} {category_sql}
+            ORDER BY score DESC
+            LIMIT %s
+        """, (*rank_params, *params, *category_params, limit))
+        results = pd.DataFrame(cursor.fetchall(), columns=columns)
+
+        cursor.execute(f"""
+            SELECT t.category, COUNT(*) AS matches
+            FROM {from_sql}
+            WHERE {where_sql}
+            GROUP BY t.category
+            ORDER BY matches DESC
+        """, tuple(params))
+        facets = pd.DataFrame(cursor.fetchall(), columns=["category", "matches"])
+        cursor.close()
+    return results, facets
+
+def _allocate_sample(counts, size, min_per_category=0):
+    """
+    Split a sample size across strata in proportion to their row counts.
+
+    Every stratum first gets min_per_category rows (or all it has), so rare
+    categories are represented; the rest is shared by largest remainder.
+
+    Args:
+        counts (dict): Stratum -> rows in the population
+        size (int): Total sample size
+        min_per_category (int): Floor per stratum
+
+    Returns:
+        dict: Stratum -> rows to sample
+    """
+    quotas = {stratum: min(count, min_per_category) for stratum, count in counts.items()}
+    remaining = size - sum(quotas.values())
+    spare = {stratum: count - quotas[stratum] for stratum, count in counts.items()}
+    total_spare = sum(spare.values())
+    if remaining <= 0 or total_spare == 0:
+        return quotas
+
+    remaining = min(remaining, total_spare)
+    shares = {stratum: remaining * rows / total_spare for stratum, rows in spare.items()}
+    for stratum, share in shares.items():
+        quotas[stratum] += int(share)
+    leftover = remaining - sum(int(share) for share in shares.values())
+    for stratum in sorted(shares, key=lambda s: shares[s] - int(shares[s]), reverse=True)[:leftover]:
+        quotas[stratum] += 1
+    return quotas
+
+def sample_transactions(size, min_per_category=0, labelled_only=False, seed=None):
+    """
+    Random sample of transactions, stratified by category.
+
+    Every row carries a uniform random sample_key, indexed per category, so
+    the rows following a random start in key order are a uniform random
+    sample of that category. Each stratum costs one index seek instead of
+    ORDER BY random(), which scans and sorts the whole table.
+
+    Args:
+        size (int): Rows to sample in total
+        min_per_category (int): Floor per category, so rare ones are represented
+        labelled_only (bool): Leave out uncategorised rows (category IS NULL)
+        seed (int): Seed for a repeatable sample
+
+    Returns:
+        pd.DataFrame: transaction_id, description, merchant_name, category,
+                      category_model, weight (population rows each sampled row
+                      stands for in its category, for weighted estimates)
+    """
+    rng = random.Random(seed)
+    columns = ["transaction_id", "description", "merchant_name", "category", "category_model"]
+    rows, weights = [], []
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT category, COUNT(*) FROM finance_sandbox.transactions
+            GROUP BY category
+        """)
+        counts = {category: count for category, count in cursor.fetchall()
+                  if category is not None or not labelled_only}
+
+        for category, quota in _allocate_sample(counts, size, min_per_category).items():
+            if not quota:
+                continue
+            match, params = ("category IS NULL", []) if category is None else ("category = %s", [category])
+            start = rng.random()
+            # Wrap around to the lowest keys if the start is too close to 1
+            stratum = []
+            for bound in ("sample_key >= %s", "sample_key < %s"):
+                cursor.execute(f"""
+                    SELECT {', '.join(columns)} FROM finance_sandbox.transactions
+                    WHERE {match} AND {bound}
+                    ORDER BY sample_key
+                    LIMIT %s
+                """, (*params, start, quota - len(stratum)))
+                stratum.extend(cursor.fetchall())
+                if len(stratum) >= quota:
+                    break
+            # Rows recategorised since the count (e.g. by a running recategorise job)
+            if not stratum:
+                continue
+            rows.extend(stratum)
+            weights.extend([counts[category] / len(stratum)] * len(stratum))
+        cursor.close()
 
-def get_total_balance_history():
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT SUM(current_balance) AS current_balance, snapshot_date "
-                   "FROM finance_sandbox.balance_history "
-                   "GROUP BY snapshot_date "
-                   "ORDER BY snapshot_date")
-
-    columns = [desc[0] for desc in cursor.description]
-    data = cursor.fetchall()
-    cursor.close()
-    return pd.DataFrame(data, columns=columns)
\ No newline at end of file
+    sample = pd.DataFrame(rows, columns=columns)
+    sample["weight"] = weights
+    return sample
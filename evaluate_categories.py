@@ -0,0 +1,386 @@
+"""
+Offline accuracy, latency and cost evaluation for transaction categorisation.
+
+Compares the categorisation paths on a labelled gold set, so a change to the
+prompt, model, similarity threshold or index can be judged on quality and on
+speed and cost before it ships:
+
+- rule: merchant and keyword rules, the free baseline (not on the sync path)
+- similarity: the nearest-neighbour CategoryIndex on its own
+- llm: batch_categorise_llm for every row
+- hybrid: what update_all_categories_batch does; similarity where its
+  confidence reaches SIMILARITY_THRESHOLD, the LLM for the rest
+
+Nothing calls the network. litellm.completion() is replaced by a replay of
+recorded answers: by default the labels the configured model already wrote to
+the database (category_model = MODEL), or a JSON file of description ->
+category captured from another model or prompt. Token counts use the real
+prompts, so cost reflects the prompt in this tree; LLM latency only covers
+local work unless --llm-latency-ms adds a per-request round trip.
+
+The gold set is a stratified sample (see db_queries.sample_transactions),
+written to CSV with gold_category pre-filled from the current label for a
+reviewer to correct. Rare categories can be oversampled with
+--min-per-category; weighted accuracy undoes that using each row's weight.
+The similarity index is rebuilt without the gold rows, so it never sees
+their labels.
+
+Usage:
+    python evaluate_categories.py sample --size 500 --min-per-category 10 --out gold_set.csv
+    python evaluate_categories.py run --gold gold_set.csv
+    python evaluate_categories.py run --gold gold_set.csv --llm-answers new_prompt.json --confusion llm
+    python evaluate_categories.py run --gold gold_set.csv --llm-latency-ms 1500 --price-in 3 --price-out 15
+"""
+import argparse
+import json
+import re
+import time
+from collections import Counter
+from types import SimpleNamespace
+from unittest import mock
+
+import llm
+from category_index import CategoryIndex, INDEX_MODEL, SIMILARITY_THRESHOLD
+from db import read_connection
+from db_queries import iter_query_rows, sample_transactions
+from llm import CATEGORIES, MODEL, batch_categorise_llm, count_tokens
+from merchants import clean_descriptions, normalise_merchants
+from lazy_imports import litellm, pd
+
+GOLD_COLUMNS = ["transaction_id", "description", "merchant_name", "category", "gold_category", "weight"]
+CATEGORISERS = ["rule", "similarity", "llm", "hybrid"]
+# Distinct descriptions per completion() call, as in update_all_categories_batch
+LLM_BATCH_SIZE = 50
+
+# Canonical merchant (see merchants.MERCHANT_ALIASES) -> category
+MERCHANT_CATEGORIES = {
+    **dict.fromkeys(["Tesco", "Sainsbury's", "Asda", "Morrisons", "Lidl", "Aldi", "Spar", "Centra",
+                     "SuperValu", "Dunnes Stores", "Booker"], "Groceries"),
+    **dict.fromkeys(["Amazon", "eBay", "Home Bargains", "Tails.com"], "Shopping"),
+    **dict.fromkeys(["Amazon Prime", "Netflix", "Spotify", "Apple", "Google Play"], "Subscriptions"),
+    **dict.fromkeys(["Tesco Mobile", "EE", "TalkTalk", "E.ON", "EDF Energy", "OVO Energy"], "Utilities"),
+    **dict.fromkeys(["Circle K", "Applegreen", "DVLA"], "Transport"),
+    **dict.fromkeys(["Bet365", "Betfred", "Betropolis", "Bingo.com", "Virgin Games"], "Entertainment"),
+    **dict.fromkeys(["Metro Bank", "Revolut", "Halifax", "TSB", "Ulster Bank", "Vanquis Bank"], "Banking"),
+    "Link ATM": "Cash Withdrawal",
+    "AA Insurance": "Insurance",
+}
+# Checked in order against the cleaned description when no merchant rule matches
+KEYWORD_RULES = [
+    (re.compile(r"\bATM\b|CASH WITHDRAWAL"), "Cash Withdrawal"),
+    (re.compile(r"INSURANCE"), "Insurance"),
+    (re.compile(r"SALARY|PAYROLL|WAGES"), "Income"),
+    (re.compile(r"\bFEE\b|\bCHARGE\b|\bINTEREST\b|OVERDRAFT"), "Fees"),
+    (re.compile(r"\bRENT\b|MORTGAGE|COUNCIL TAX"), "Housing"),
+    (re.compile(r"\bSAVINGS?\b|\bISA\b"), "Savings"),
+    (re.compile(r"TRANSFER|\bTFR\b|STANDING ORDER"), "Transfers"),
+    (re.compile(r"\bTFL\b|TRAINLINE|\bUBER\b|PARKING|PETROL|\bFUEL\b"), "Transport"),
+]
+
+
+#---------- GOLD SET ----------#
+
+def build_gold_set(path, size, min_per_category=0, seed=None):
+    """
+    Write a stratified sample of labelled transactions for review.
+
+    Args:
+        path (str): CSV to write
+        size (int): Rows to sample
+        min_per_category (int): Floor per category
+        seed (int): Seed for a repeatable sample
+
+    Returns:
+        pd.DataFrame: The rows written
+    """
+    sample = sample_transactions(size, min_per_category, labelled_only=True, seed=seed)
+    sample["gold_category"] = sample["category"]
+    sample[GOLD_COLUMNS].to_csv(path, index=False)
+    per_category = sample["category"].value_counts()
+    print(f"Wrote {len(sample)} rows across {len(per_category)} categories to {path}")
+    print("Review gold_category (pre-filled with the current label); blank it to leave a row out")
+    return sample[GOLD_COLUMNS]
+
+
+def load_gold_set(path):
+    """Read a reviewed gold set, skipping rows without a gold_category."""
+    gold = pd.read_csv(path, dtype={"transaction_id": str})
+    missing = set(GOLD_COLUMNS) - set(gold.columns)
+    if missing:
+        raise ValueError(f"{path} is missing column(s): {', '.join(sorted(missing))}")
+    gold = gold.dropna(subset=["description", "gold_category"]).reset_index(drop=True)
+    unknown = sorted(set(gold["gold_category"]) - set(CATEGORIES))
+    if unknown:
+        print(f"Gold categories not in llm.CATEGORIES (no categoriser can predict them): {unknown}")
+    return gold
+
+
+#---------- CATEGORISERS ----------#
+
+def rule_categorise(descriptions):
+    """Categorise by merchant, then by keyword; "Uncategorized" where no rule matches."""
+    merchants = normalise_merchants(descriptions).map(MERCHANT_CATEGORIES)
+    cleaned = clean_descriptions(pd.Series(list(descriptions), dtype=object).fillna(""))
+    predictions = []
+    for merchant_category, text in zip(merchants, cleaned):
+        if isinstance(merchant_category, str):
+            predictions.append(merchant_category)
+            continue
+        predictions.append(next((category for pattern, category in KEYWORD_RULES if pattern.search(text)),
+                                "Uncategorized"))
+    return predictions
+
+
+def build_similarity_index(exclude_ids):
+    """
+    CategoryIndex over every labelled transaction except the gold rows.
+
+    Labels are learned the way CategoryIndex.refresh learns them: the index's
+    own guesses are skipped and each description keeps its majority label.
+    Unlike refresh, labels from every category version are used, so data
+    labelled under an older prompt can still be evaluated.
+    """
+    exclude_ids = set(exclude_ids)
+    labels = Counter()
+    for batch in iter_query_rows(f"""
+        SELECT transaction_id, description, category FROM finance_sandbox.transactions
+        WHERE category IS NOT NULL
+        AND (category_model IS NULL OR category_model <> '{INDEX_MODEL}')
+    """):
+        labels.update((description, category) for transaction_id, description, category in batch
+                      if transaction_id not in exclude_ids)
+
+    index = CategoryIndex()
+    # Least frequent first, so add() leaves each description with its majority label
+    ordered = sorted(labels, key=labels.get)
+    if ordered:
+        index.add(*zip(*ordered))
+    return index
+
+
+def recorded_llm_answers(model=MODEL):
+    """Description -> the category the model assigned it most often, from the database."""
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT description, category FROM finance_sandbox.transactions
+            WHERE category_model = %s AND category IS NOT NULL
+            GROUP BY description, category
+            ORDER BY COUNT(*)
+        """, (model,))
+        answers = dict(cursor.fetchall())
+        cursor.close()
+    return answers
+
+
+def token_prices(model=MODEL, price_in=None, price_out=None):
+    """
+    (input, output) USD per token: overrides in USD per million tokens, else litellm's cost map.
+    """
+    known = litellm.model_cost.get(model) or litellm.model_cost.get(model.split("/")[-1]) or {}
+    input_price = price_in / 1e6 if price_in is not None else known.get("input_cost_per_token")
+    output_price = price_out / 1e6 if price_out is not None else known.get("output_cost_per_token")
+    if input_price is None or output_price is None:
+        print(f"No token prices for {model} in litellm's cost map; LLM cost is reported as 0 "
+              f"(pass --price-in/--price-out)")
+    return input_price or 0.0, output_price or 0.0
+
+
+class ReplayCompletion:
+    """
+    Stand-in for litellm.completion() that answers from recorded labels.
+
+    Reads the numbered descriptions out of the categorisation prompt and
+    replies with a JSON array in the same order, with usage and cost filled
+    in from the real prompt, so batch_categorise_llm runs unchanged.
+    """
+
+    def __init__(self, answers, prices):
+        self.answers = answers
+        self.prices = prices
+        self.requests = 0
+        self.unanswered = 0
+
+    def __call__(self, model, messages, **kwargs):
+        self.requests += 1
+        lines = messages[-1]["content"].splitlines()
+        descriptions = [line.split(". ", 1)[1] if ". " in line else line for line in lines]
+        categories = []
+        for description in descriptions:
+            if description not in self.answers:
+                self.unanswered += 1
+            categories.append(self.answers.get(description, "Uncategorized"))
+
+        content = json.dumps(categories)
+        prompt_tokens = count_tokens(messages)
+        completion_tokens = len(litellm.encoding.encode(content))
+        cost = prompt_tokens * self.prices[0] + completion_tokens * self.prices[1]
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                  total_tokens=prompt_tokens + completion_tokens),
+            _hidden_params={"response_cost": cost},
+        )
+
+
+def run_llm(descriptions, answers, prices):
+    """
+    Run batch_categorise_llm offline over descriptions.
+
+    completion() is replayed, api_costs logging is captured instead of
+    written, and rate limits are skipped.
+
+    Returns:
+        tuple: (predictions in input order, stats dict: requests, unanswered,
+               prompt_tokens, completion_tokens, cost)
+    """
+    replay = ReplayCompletion(answers, prices)
+    responses = []
+    distinct = list(dict.fromkeys(descriptions))
+    category_map = {}
+    with mock.patch("litellm.completion", replay), \
+            mock.patch.object(llm, "log_api_cost", responses.append), \
+            mock.patch.object(llm, "acquire", lambda service: None):
+        for start in range(0, len(distinct), LLM_BATCH_SIZE):
+            category_map.update(batch_categorise_llm(distinct[start:start + LLM_BATCH_SIZE]))
+
+    stats = {
+        "requests": replay.requests,
+        "unanswered": replay.unanswered,
+        "prompt_tokens": sum(response.usage.prompt_tokens for response in responses),
+        "completion_tokens": sum(response.usage.completion_tokens for response in responses),
+        "cost": sum(response._hidden_params["response_cost"] for response in responses),
+    }
+    return [category_map.get(description, "Uncategorized") for description in descriptions], stats
+
+
+#---------- EVALUATION ----------#
+
+def evaluate(gold, answers, prices, threshold=SIMILARITY_THRESHOLD, llm_latency_ms=0.0):
+    """
+    Run every categoriser over the gold set.
+
+    Args:
+        gold (pd.DataFrame): Gold set (load_gold_set)
+        answers (dict): Description -> category replayed as the LLM's answer
+        prices (tuple): (input, output) USD per token
+        threshold (float): Similarity confidence at which hybrid skips the LLM
+        llm_latency_ms (float): Simulated round trip added per LLM request
+
+    Returns:
+        tuple: (summary DataFrame, one per categoriser;
+                predictions DataFrame, gold plus one column per categoriser)
+    """
+    descriptions = gold["description"].tolist()
+    predictions = gold.copy()
+    runs = {}
+
+    started = time.perf_counter()
+    predictions["rule"] = rule_categorise(descriptions)
+    runs["rule"] = {"seconds": time.perf_counter() - started}
+
+    started = time.perf_counter()
+    index = build_similarity_index(gold["transaction_id"])
+    print(f"Similarity index: {len(index)} labelled descriptions, built in {time.perf_counter() - started:.1f}s")
+    started = time.perf_counter()
+    similar, confidence = index.predict(descriptions) if len(index) else (["Uncategorized"] * len(gold),
+                                                                         [0.0] * len(gold))
+    predictions["similarity"] = list(similar)
+    predictions["confidence"] = list(confidence)
+    runs["similarity"] = {"seconds": time.perf_counter() - started}
+
+    started = time.perf_counter()
+    predictions["llm"], stats = run_llm(descriptions, answers, prices)
+    runs["llm"] = {"seconds": time.perf_counter() - started, **stats}
+
+    confident = predictions["confidence"] >= threshold
+    started = time.perf_counter()
+    fallback, stats = run_llm(predictions.loc[~confident, "description"].tolist(), answers, prices)
+    predictions["hybrid"] = predictions["similarity"].where(confident, None)
+    predictions.loc[~confident, "hybrid"] = fallback
+    runs["hybrid"] = {"seconds": runs["similarity"]["seconds"] + time.perf_counter() - started, **stats}
+
+    rows = []
+    for name in CATEGORISERS:
+        run = runs[name]
+        correct = predictions[name] == predictions["gold_category"]
+        seconds = run["seconds"] + run.get("requests", 0) * llm_latency_ms / 1000
+        if name == "rule":
+            coverage = (predictions[name] != "Uncategorized").mean()
+        elif name == "similarity":
+            coverage = confident.mean()
+        else:
+            coverage = 1 - run["unanswered"] / max(len(gold), 1)
+        rows.append({
+            "categoriser": name,
+            "accuracy": correct.mean(),
+            "weighted_accuracy": (correct * predictions["weight"]).sum() / predictions["weight"].sum(),
+            "coverage": coverage,
+            "ms_per_1k": seconds / len(gold) * 1e6,
+            "usd_per_1k": run.get("cost", 0.0) / len(gold) * 1000,
+            "llm_requests": run.get("requests", 0),
+        })
+    return pd.DataFrame(rows), predictions
+
+
+def category_recall(predictions):
+    """Share of each gold category every categoriser got right (the confusion matrix diagonal)."""
+    recall = {name: (predictions[name] == predictions["gold_category"]).groupby(predictions["gold_category"]).mean()
+              for name in CATEGORISERS}
+    table = pd.DataFrame(recall)
+    table.insert(0, "rows", predictions["gold_category"].value_counts())
+    return table.sort_values("rows", ascending=False)
+
+
+def confusion(predictions, name):
+    """Gold category (rows) x predicted category (columns) counts for one categoriser."""
+    return pd.crosstab(predictions["gold_category"], predictions[name].rename("predicted"))
+
+
+def print_report(summary, predictions, confusion_for=None):
+    """Print the summary, per-category recall and optionally one confusion matrix."""
+    print(f"\n{len(predictions)} gold rows, {predictions['gold_category'].nunique()} categories")
+    print(summary.to_string(index=False, float_format=lambda value: f"{value:,.3f}"))
+    print("coverage: rule matched / similarity confident / LLM answer recorded; "
+          "weighted_accuracy corrects for per-category oversampling")
+    print("\nPer-category recall")
+    print(category_recall(predictions).to_string(float_format=lambda value: f"{value:.2f}"))
+    if confusion_for:
+        print(f"\nConfusion for {confusion_for} (rows: gold, columns: predicted)")
+        print(confusion(predictions, confusion_for).to_string())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate categorisation accuracy, latency and cost offline")
+    parser.add_argument("command", choices=["sample", "run"])
+    parser.add_argument("--out", default="gold_set.csv", help="sample: CSV to write")
+    parser.add_argument("--size", type=int, default=500, help="sample: rows to sample")
+    parser.add_argument("--min-per-category", type=int, default=10, help="sample: floor per category")
+    parser.add_argument("--seed", type=int, help="sample: seed for a repeatable sample")
+    parser.add_argument("--gold", default="gold_set.csv", help="run: reviewed gold set")
+    parser.add_argument("--llm-answers", help="run: JSON of description -> category to replay "
+                                              "(default: labels MODEL wrote to the database)")
+    parser.add_argument("--threshold", type=float, default=SIMILARITY_THRESHOLD,
+                        help="run: similarity confidence at which hybrid skips the LLM")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="run: simulated round trip per request")
+    parser.add_argument("--price-in", type=float, help="run: USD per million input tokens")
+    parser.add_argument("--price-out", type=float, help="run: USD per million output tokens")
+    parser.add_argument("--confusion", choices=CATEGORISERS, help="run: print this categoriser's confusion matrix")
+    parser.add_argument("--predictions", help="run: also write every row's predictions to this CSV")
+    args = parser.parse_args()
+
+    if args.command == "sample":
+        build_gold_set(args.out, args.size, args.min_per_category, args.seed)
+    else:
+        gold_set = load_gold_set(args.gold)
+        if args.llm_answers:
+            with open(args.llm_answers) as f:
+                replayed = json.load(f)
+        else:
+            replayed = recorded_llm_answers()
+        summary_table, predicted = evaluate(gold_set, replayed, token_prices(MODEL, args.price_in, args.price_out),
+                                            args.threshold, args.llm_latency_ms)
+        print_report(summary_table, predicted, args.confusion)
+        if args.predictions:
+            predicted.to_csv(args.predictions, index=False)
@@ -0,0 +1,368 @@
+"""
+Read-only JSON API over the dashboard's aggregates.
+
+Serves the db_queries and trends aggregates (spending by month and category,
+balances, recent transactions) as JSON for other tools, so they don't have
+to query the database themselves. Built on the standard library's
+http.server, so it runs locally with nothing but the database, including the
+embedded SQLite backend (STORAGE_BACKEND=sqlite).
+
+Polling is cheap. Every response carries a weak ETag and a Last-Modified
+header taken from change_log: the newest change to the endpoint's table
+inside its date window, the same version the dashboard's panel cache uses.
+A request then costs one indexed change_log lookup:
+
+- If-None-Match / If-Modified-Since that still match get 304 Not Modified
+- otherwise the body comes from an in-process LRU cache keyed by
+  (endpoint, parameters, version, date), so each aggregate runs once per
+  change (and once a day, as relative windows roll over) however many
+  clients poll it
+- bodies of API_GZIP_MIN_BYTES or more are gzipped for clients that accept it
+
+Reads go through read_connection(), so a configured replica serves them too.
+
+Usage:
+    python http_api.py                          # http://127.0.0.1:8600/api
+    python http_api.py --host 0.0.0.0 --port 8080
+    curl -s --compressed "http://127.0.0.1:8600/api/spending/categories?time_frame=Last%2030%20days"
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from email.utils import format_datetime, parsedate_to_datetime
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from change_events import settled_changes
+from db import pinned_reads, read_connection
+from db_queries import get_spending_by_months, get_spending_by_category, get_total_spending
+from db_queries import get_largest_transactions, get_last_transactions
+from db_queries import get_total_balance_history, get_each_account_balance_history
+from storage import get_backend
+from timeseries import CHART_POINTS
+from trends import TIME_FRAME_DAYS, get_rolling_spending, get_latest_category_changes
+from lazy_imports import np, pd
+
+# Responses kept in memory (entries, across all endpoints and versions)
+CACHE_SIZE = int(os.getenv("API_CACHE_SIZE", 256))
+# Smaller bodies aren't worth compressing
+GZIP_MIN_BYTES = int(os.getenv("API_GZIP_MIN_BYTES", 1024))
+# How long clients may reuse a response before revalidating
+MAX_AGE = int(os.getenv("API_MAX_AGE", 5))
+MAX_LIMIT = 500
+MAX_POINTS = 5000
+
+# Path -> (query, table whose changes invalidate it, query parameters, windowed).
+# Windowed endpoints are only invalidated by changes inside their time_frame;
+# rolling windows and year-over-year reach back before it, so any change counts.
+ENDPOINTS = {
+    "/api/spending/months": (get_spending_by_months, "transactions", ("time_frame",), True),
+    "/api/spending/categories": (get_spending_by_category, "transactions", ("time_frame",), True),
+    "/api/spending/total": (get_total_spending, "transactions", ("time_frame",), True),
+    "/api/spending/largest": (get_largest_transactions, "transactions", ("time_frame",), True),
+    "/api/transactions/recent": (get_last_transactions, "transactions", ("limit",), False),
+    "/api/balances/total": (get_total_balance_history, "balance_history", ("time_frame", "points"), True),
+    "/api/balances/accounts": (get_each_account_balance_history, "balance_history", ("time_frame", "points"), True),
+    "/api/trends/rolling": (get_rolling_spending, "transactions", ("time_frame",), False),
+    "/api/trends/categories": (get_latest_category_changes, "transactions", ("time_frame",), False),
+}
+PARAM_DEFAULTS = {"time_frame": "All time", "limit": 10, "points": CHART_POINTS}
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "not_modified": 0}
+
+
+class BadRequest(ValueError):
+    """A query parameter the API can't serve."""
+
+
+#---------- PARAMETERS AND VERSIONS ----------#
+
+def parse_params(names, query_string):
+    """
+    Validate an endpoint's query parameters and fill in defaults.
+
+    Args:
+        names (tuple): Parameters the endpoint takes, in call order
+        query_string (str): Raw query string
+
+    Returns:
+        dict: Parameter name -> value, in call order
+
+    Raises:
+        BadRequest: If a parameter is unknown or out of range
+    """
+    raw = {key: values[-1] for key, values in parse_qs(query_string).items()}
+    unknown = set(raw) - set(names)
+    if unknown:
+        raise BadRequest(f"Unknown parameter(s): {', '.join(sorted(unknown))}")
+
+    params = {}
+    for name in names:
+        value = raw.get(name, PARAM_DEFAULTS[name])
+        if name == "time_frame":
+            if value not in TIME_FRAME_DAYS:
+                raise BadRequest(f"time_frame must be one of: {', '.join(TIME_FRAME_DAYS)}")
+        else:
+            upper = MAX_LIMIT if name == "limit" else MAX_POINTS
+            try:
+                value = int(value)
+            except ValueError:
+                raise BadRequest(f"{name} must be an integer") from None
+            if not 1 <= value <= upper:
+                raise BadRequest(f"{name} must be between 1 and {upper}")
+        params[name] = value
+    return params
+
+
+def _as_utc(timestamp):
+    # created_at is the database's CURRENT_TIMESTAMP: a datetime from
+    # Postgres, ISO text from SQLite. Only its ordering matters to clients.
+    if not isinstance(timestamp, datetime):
+        timestamp = datetime.fromisoformat(str(timestamp)[:19])
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(timezone.utc)
+
+
+def get_data_version(table, time_frame=None):
+    """
+    Newest change to a table, optionally only those reaching into a time frame.
+
+    Args:
+        table (str): change_log table_name, e.g. "transactions"
+        time_frame (str): Dashboard time frame; None or "All time" for any change
+
+    Returns:
+        tuple: (version (0 if none), the change's created_at as an aware UTC datetime or None)
+    """
+    days = TIME_FRAME_DAYS.get(time_frame) if time_frame else None
+    conditions = ["table_name = %s"]
+    params = [table]
+    if days:
+        conditions.append("(date_to IS NULL OR date_to >= %s)")
+        params.append((date.today() - timedelta(days=days)).isoformat())
+
+    # Settled changes only, so a change that commits late still moves the version
+    conditions.append(settled_changes())
+    order = get_backend().CHANGE_ORDER
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT {order}, created_at
+            FROM finance_sandbox.change_log
+            WHERE {' AND '.join(conditions)}
+            ORDER BY {order} DESC, id DESC
+            LIMIT 1
+        """, tuple(params))
+        row = cursor.fetchone()
+        cursor.close()
+    if row is None:
+        return 0, None
+    return row[0], _as_utc(row[1]) if row[1] else None
+
+
+#---------- SERIALISATION AND CACHE ----------#
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date, pd.Timestamp)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serialisable")
+
+
+def frame_to_json(df, **metadata):
+    """Encode a DataFrame as {**metadata, "rows": [...]} JSON bytes; NaN becomes null."""
+    rows = df.astype(object).where(df.notna(), None).to_dict("records")
+    return json.dumps({**metadata, "rows": rows}, default=_json_default, separators=(",", ":")).encode()
+
+
+def get_response(path, params, version, as_of):
+    """
+    JSON body for an endpoint at a data version, from the cache or a fresh query.
+
+    Args:
+        as_of (str): Today's date (YYYY-MM-DD); relative windows and balance
+            series padded to today change with it even when no data does
+
+    Returns:
+        dict: {"body": bytes, "gzip": bytes or None (filled on first gzip request)}
+    """
+    key = (path, tuple(params.items()), version, as_of)
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return entry
+
+    # Queried outside the lock, so one slow aggregate doesn't hold up other endpoints
+    query = ENDPOINTS[path][0]
+    body = frame_to_json(query(*params.values()), version=version, params=params)
+    entry = {"body": body, "gzip": None}
+    with _cache_lock:
+        _stats["misses"] += 1
+        _cache[key] = entry
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return entry
+
+
+def _gzipped(entry):
+    if entry["gzip"] is None:
+        entry["gzip"] = gzip.compress(entry["body"], compresslevel=6)
+    return entry["gzip"]
+
+
+#---------- CONDITIONAL REQUESTS ----------#
+
+def make_etag(path, params, version, as_of):
+    """Weak ETag: identity and gzip bodies of one version (and day) are equivalent, not byte-identical."""
+    digest = hashlib.sha1(f"{path}?{sorted(params.items())}@{as_of}".encode()).hexdigest()[:12]
+    return f'W/"{version}-{digest}"'
+
+
+def is_not_modified(headers, etag, last_modified):
+    """
+    Whether a conditional GET can be answered with 304 (RFC 9110 section 13.2.2).
+
+    If-None-Match takes precedence; If-Modified-Since is only consulted
+    without it, and only at one-second resolution.
+    """
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        # Weak comparison: W/ prefixes are ignored
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return etag.removeprefix("W/") in candidates
+
+    if_modified_since = headers.get("If-Modified-Since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def accepts_gzip(headers):
+    """Whether Accept-Encoding allows gzip (an explicit q=0 refuses it)."""
+    for coding in headers.get("Accept-Encoding", "").split(","):
+        name, _, quality = coding.strip().partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            return quality.replace(" ", "").lower() not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+#---------- SERVER ----------#
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """GET/HEAD handler for ENDPOINTS; everything else is rejected."""
+
+    server_version = "SpendingTrackerAPI/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self.do_GET(send_body=False)
+
+    def do_GET(self, send_body=True):
+        url = urlsplit(self.path)
+        path = url.path.rstrip("/") or "/"
+        if path == "/api":
+            return self._send_json(HTTPStatus.OK, self._index(), send_body)
+        if path not in ENDPOINTS:
+            return self._send_json(HTTPStatus.NOT_FOUND, {"error": f"No endpoint {path}"}, send_body)
+
+        _, table, names, windowed = ENDPOINTS[path]
+        try:
+            params = parse_params(names, url.query)
+        except BadRequest as e:
+            return self._send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)}, send_body)
+
+        try:
+            # Version and rows from the same target, so an ETag never claims
+            # data newer than what was actually read
+            with pinned_reads():
+                version, last_modified = get_data_version(table, params.get("time_frame") if windowed else None)
+                # Windows are relative to today, so a new day is a new version even without new data
+                today = date.today()
+                as_of_midnight = datetime.combine(today, datetime.min.time()).astimezone(timezone.utc)
+                last_modified = max(last_modified, as_of_midnight) if last_modified else as_of_midnight
+                etag = make_etag(path, params, version, today.isoformat())
+                if is_not_modified(self.headers, etag, last_modified):
+                    with _cache_lock:
+                        _stats["not_modified"] += 1
+                    return self._send(HTTPStatus.NOT_MODIFIED, etag, last_modified)
+                entry = get_response(path, params, version, today.isoformat())
+        except get_backend().errors as e:
+            print(f"API query failed for {self.path}: {e}")
+            return self._send_json(HTTPStatus.SERVICE_UNAVAILABLE, {"error": "Database unavailable"}, send_body)
+
+        if len(entry["body"]) >= GZIP_MIN_BYTES and accepts_gzip(self.headers):
+            self._send(HTTPStatus.OK, etag, last_modified, _gzipped(entry), "gzip", send_body)
+        else:
+            self._send(HTTPStatus.OK, etag, last_modified, entry["body"], None, send_body)
+
+    def _index(self):
+        return {
+            "endpoints": {path: list(spec[2]) for path, spec in ENDPOINTS.items()},
+            "time_frames": list(TIME_FRAME_DAYS),
+            "cache": {**_stats, "entries": len(_cache)},
+        }
+
+    def _send(self, status, etag=None, last_modified=None, body=b"", encoding=None, send_body=True):
+        self.send_response(status)
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", f"max-age={MAX_AGE}, must-revalidate")
+            self.send_header("Vary", "Accept-Encoding")
+        if last_modified is not None:
+            self.send_header("Last-Modified", format_datetime(last_modified, usegmt=True))
+        if status != HTTPStatus.NOT_MODIFIED:
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.end_headers()
+        if send_body and status != HTTPStatus.NOT_MODIFIED:
+            self.wfile.write(body)
+
+    def _send_json(self, status, payload, send_body=True):
+        body = json.dumps(payload, default=_json_default).encode()
+        self._send(status, body=body, send_body=send_body)
+
+
+def serve(host="127.0.0.1", port=8600):
+    """Serve the API until interrupted, one thread per connection."""
+    server = ThreadingHTTPServer((host, port), ApiHandler)
+    server.daemon_threads = True
+    print(f"Serving the analytics API on http://{host}:{port}/api ({get_backend().name} backend)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read-only JSON API over the spending aggregates")
+    parser.add_argument("--host", default=os.getenv("API_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("API_PORT", 8600)))
+    args = parser.parse_args()
+    serve(args.host, args.port)
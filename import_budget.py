@@ -0,0 +1,97 @@
+"""
+Import-time budget for the entry points.
+
+Cold start dominates short cron runs and container restarts, so each entry
+point's imports are timed with `python -X importtime` in a fresh
+interpreter and checked against a budget. The heavy dependencies
+(HEAVY_MODULES) must not be imported at all until a stage needs them: they
+sit behind the facades in lazy_imports.
+
+Exits non-zero if any entry point is over budget or imports a heavy module,
+so it can gate CI or a deploy; test_import_budget.py runs the same check
+under pytest.
+
+Usage:
+    python import_budget.py               # check every entry point
+    python import_budget.py --show 10     # also list each entry point's 10 slowest imports
+    python import_budget.py --runs 5      # best of 5 (default 3) to smooth out noise
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+# Entry point -> (modules it imports at start-up, budget in milliseconds).
+# dashboard.py runs Streamlit calls at import time, so its own imports are
+# listed instead of importing the script.
+IMPORT_BUDGETS = {
+    "main": (["main"], 250),
+    "sync stages": (["db_operations", "merchants", "anomalies", "recurring"], 600),
+    "sync_workers": (["sync_workers"], 700),
+    "dashboard": (["llm", "db_queries", "analytics", "account_data", "auth", "change_events", "profiling"], 600),
+    "http_api": (["http_api"], 400),
+}
+HEAVY_MODULES = ["litellm", "pandas", "plotly", "psycopg2", "scipy"]
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def measure_imports(modules):
+    """
+    Import modules in a fresh interpreter under -X importtime.
+
+    Returns:
+        tuple: (total milliseconds, list of (cumulative ms, module) for every import)
+    """
+    search_path = [os.path.dirname(os.path.abspath(__file__)), os.environ.get("PYTHONPATH")]
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(path for path in search_path if path)}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+        capture_output=True, text=True, env=env,
+    )
+    if result.returncode:
+        raise RuntimeError(f"importing {modules} failed:\n{result.stderr[-2000:]}")
+
+    total, imports = 0.0, []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative_ms = int(match.group(2)) / 1000
+        imports.append((cumulative_ms, match.group(4)))
+        if len(match.group(3)) == 1:  # top level: not counted inside a parent
+            total += cumulative_ms
+    return total, imports
+
+
+def check_budgets(runs=3, show=0):
+    """
+    Check every entry point against its budget.
+
+    Returns:
+        bool: True if all are within budget and import no heavy module
+    """
+    ok = True
+    for entry_point, (modules, budget_ms) in IMPORT_BUDGETS.items():
+        measurements = [measure_imports(modules) for _ in range(runs)]
+        total, imports = min(measurements, key=lambda measurement: measurement[0])
+        imported = {name for _, name in imports}
+        heavy = [name for name in HEAVY_MODULES if name in imported]
+
+        passed = total <= budget_ms and not heavy
+        ok = ok and passed
+        print(f"{'ok  ' if passed else 'FAIL'} {entry_point}: {total:.0f} ms (budget {budget_ms} ms)"
+              + (f", imports {', '.join(heavy)}" if heavy else ""))
+        for cumulative_ms, name in sorted(imports, reverse=True)[:show]:
+            print(f"       {cumulative_ms:8.1f} ms  {name}")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check entry point import times against their budgets")
+    parser.add_argument("--runs", type=int, default=3, help="Measure this many times and keep the fastest")
+    parser.add_argument("--show", type=int, default=0, help="List the N slowest imports per entry point")
+    args = parser.parse_args()
+
+    sys.exit(0 if check_budgets(args.runs, args.show) else 1)
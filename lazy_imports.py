@@ -0,0 +1,47 @@
+"""
+Lazy facades for the heavy dependencies.
+
+litellm alone takes seconds to import, pandas, plotly and scipy hundreds of
+milliseconds each, and most entry points only need some of them on some
+runs: a balance snapshot never touches the LLM, the dashboard only needs
+litellm once someone asks for insights. Modules import the facades below
+instead of the packages,
+
+    from lazy_imports import pd
+
+and the real import happens on first attribute access (pd.DataFrame), so
+start-up only pays for what a run actually uses. import_budget.py checks
+the entry points stay within their import-time budgets.
+"""
+import importlib
+
+
+class LazyModule:
+    """Stands in for a module until one of its attributes is needed."""
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            module = self.__dict__["_module"] = importlib.import_module(self._name)
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self.__dict__["_module"] is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+litellm = LazyModule("litellm")
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
+px = LazyModule("plotly.express")
+psycopg2 = LazyModule("psycopg2")
+psycopg2_extensions = LazyModule("psycopg2.extensions")
+psycopg2_extras = LazyModule("psycopg2.extras")
+sp = LazyModule("scipy.sparse")
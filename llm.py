@@ -1,16 +1,46 @@
 import os
 import json
-from litellm import completion
+import hashlib
+from functools import lru_cache
 from dotenv import load_dotenv
-import os
 from db_queries import get_spending_by_months, get_spending_by_category
-from db_queries import get_total_spending, get_largest_transactions
+from db_queries import get_total_spending, get_largest_transactions, get_unusual_transactions
 from db import get_connection
+from trends import get_rolling_spending, get_latest_category_changes
+from rate_limits import acquire
+from lazy_imports import litellm
 
 
 load_dotenv()
 # client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
 
+MODEL = os.getenv("LLM_MODEL", "claude-sonnet-4-20250514")
+# Prompts above this are split (categorisation) or flagged (insights) before sending
+MAX_PROMPT_TOKENS = int(os.getenv("MAX_PROMPT_TOKENS", 8000))
+
+CATEGORIES = [
+    "Groceries", "Transport", "Utilities", "Insurance", "Shopping", "Subscriptions",
+    "Entertainment", "Banking", "Income", "Fees", "Transfers", "Housing",
+    "Cash Withdrawal", "Savings", "Uncategorized",
+]
+
+# Identical on every call, so it is sent once as the system message and each
+# request only adds the numbered descriptions
+CATEGORISE_PROMPT = "Categorize each bank transaction into ONE of these categories:\n" + "\n".join(
+    f"- {category}" for category in CATEGORIES
+) + """
+
+The user sends one transaction per line, numbered.
+Return ONLY a JSON array with the category for each transaction in order.
+Example: ["Groceries", "Transport", "Insurance"]
+
+Return only the JSON array, nothing else."""
+
+# Stored with every label; changes whenever the model, prompt or category list
+# does, so recategorise.py knows which rows are stale
+CATEGORY_VERSION = os.getenv("CATEGORY_VERSION") or hashlib.sha1(
+    f"{MODEL}\n{CATEGORISE_PROMPT}".encode()).hexdigest()[:12]
+
 SYSTEM_PROMPT = """You are a personal finance analyst helping users understand their spending patterns.
 
    Your role:
@@ -68,86 +98,88 @@ def log_api_cost(response, project="finance_sandbox"):
     conn.commit()
     conn.close()
 
+@lru_cache(maxsize=1)
+def _encoding():
+    # litellm bundles tiktoken's cl100k_base, so this works offline where
+    # tiktoken.get_encoding() would download it. There is no tiktoken Claude
+    # tokenizer; cl100k_base is close enough for budgeting.
+    return litellm.encoding
+
+
+def count_tokens(messages):
+    """Approximate prompt tokens for a list of chat messages."""
+    encoding = _encoding()
+    total = 0
+    for message in messages:
+        content = message["content"]
+        parts = content if isinstance(content, list) else [{"text": content}]
+        # A few tokens of per-message framing (role, separators)
+        total += 4 + sum(len(encoding.encode(part["text"])) for part in parts)
+    return total
+
+
+def compact_table(df, decimals=2):
+    """
+    Encode a DataFrame as CSV rows with rounded numbers.
+
+    Far fewer tokens than DataFrame.to_string(), which pads every column
+    to a fixed width and prints full float precision.
+    """
+    return df.round(decimals).to_csv(index=False, lineterminator="\n").strip()
+
+
+def build_request(system_prompt, user_content, max_tokens):
+    """
+    Assemble completion() arguments: the static instructions as the system
+    message, the per-call data as the user message.
+
+    No cache_control marker is set: both prompts are a few hundred tokens,
+    below Anthropic's minimum cacheable prefix (1024 tokens on Sonnet), so a
+    marker would never produce a cache hit.
+
+    Returns:
+        tuple: (completion kwargs, estimated prompt tokens)
+    """
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_content},
+    ]
+    request = {
+        "model": MODEL,
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "api_key": os.getenv("ANTHROPIC_API_KEY"),
+    }
+    return request, count_tokens(messages)
+
+
 def categorise_transaction(description):
     """Categorize transaction using Claude API via LiteLLM."""
-
-    prompt = f"""Categorize this bank transaction into ONE of these categories:
-- Groceries
-- Transport
-- Utilities
-- Insurance
-- Shopping
-- Subscriptions
-- Entertainment
-- Banking
-- Income
-- Fees
-- Transfers
-- Housing
-- Cash Withdrawal
-- Savings
-- Uncategorized
-
-Transaction: "{description}"
-
-Return ONLY the category name, nothing else."""
-
-    response = completion(
-        model="claude-sonnet-4-20250514",
-        messages=[
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=50,
-        api_key=os.getenv("ANTHROPIC_API_KEY")
-    )
-    log_api_cost(response)
-    return response.choices[0].message.content.strip()
+    return batch_categorise_llm([description]).get(description, "Uncategorized")
 
 
 def batch_categorise_llm(descriptions):
     """
     Categorize multiple transactions at once.
 
+    Batches whose prompt would exceed MAX_PROMPT_TOKENS are split in half
+    and sent as separate requests.
+
     Args:
         descriptions (list): List of transaction descriptions
 
     Returns:
         dict: Mapping of description to category
     """
-    # Format descriptions for prompt
     desc_list = "\n".join([f"{i + 1}. {desc}" for i, desc in enumerate(descriptions)])
+    request, prompt_tokens = build_request(CATEGORISE_PROMPT, desc_list, max_tokens=10 * len(descriptions) + 50)
 
-    prompt = f"""Categorize each of these bank transactions into ONE of these categories:
-- Groceries
-- Transport
-- Utilities
-- Insurance
-- Shopping
-- Subscriptions
-- Entertainment
-- Banking
-- Income
-- Fees
-- Transfers
-- Housing
-- Cash Withdrawal
-- Savings
-- Uncategorized
-
-Transactions:
-{desc_list}
+    if prompt_tokens > MAX_PROMPT_TOKENS and len(descriptions) > 1:
+        middle = len(descriptions) // 2
+        return {**batch_categorise_llm(descriptions[:middle]), **batch_categorise_llm(descriptions[middle:])}
 
-Return ONLY a JSON array with the category for each transaction in order.
-Example: ["Groceries", "Transport", "Insurance"]
-
-Return only the JSON array, nothing else."""
-
-    response = completion(
-        model="claude-sonnet-4-20250514",
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=500,
-        api_key=os.getenv("ANTHROPIC_API_KEY")
-    )
+    acquire("llm")
+    response = litellm.completion(**request)
 
     # Parse JSON response
     response_text = response.choices[0].message.content.strip()
@@ -164,33 +196,40 @@ def generate_insights(time_frame="All time"):
     category_spending = get_spending_by_category(time_frame)
     total_spending = get_total_spending(time_frame)
     largest_transactions = get_largest_transactions(time_frame)
+    unusual_transactions = get_unusual_transactions(time_frame)
+    category_changes = get_latest_category_changes(time_frame)
+    rolling = get_rolling_spending(time_frame)
 
-    # Format as structured summary
-    user_data = f"""
-    Time Period: {time_frame}
+    total = round(float(total_spending["total_spending"].iloc[0] or 0), 2)
+    latest_month = category_changes["month"].iloc[0] if not category_changes.empty else "n/a"
+    rolling_7d = round(float(rolling["rolling_7d"].iloc[-1]), 2) if not rolling.empty else 0
+    rolling_30d = round(float(rolling["rolling_30d"].iloc[-1]), 2) if not rolling.empty else 0
 
-    Total Spending: £{total_spending}
+    # Format as structured summary; tables as CSV rows to keep the prompt small
+    user_data = f"""Time Period: {time_frame}
+Total Spending: £{total}
+Last 7 days: £{rolling_7d}; last 30 days: £{rolling_30d}
 
-    Spending by Category:
-    {category_spending.to_string(index=False)}
+Spending by Category:
+{compact_table(category_spending)}
 
-    Monthly Trend:
-    {monthly_trend.to_string(index=False)}
+Monthly Trend:
+{compact_table(monthly_trend)}
 
-    Largest Transactions:
-    {largest_transactions[['description', 'amount', 'category']].to_string(index=False)}
-    """
-    full_response =""
-    response = completion(
-        model="claude-sonnet-4-20250514",  # or "gpt-4", "llama-3.1-70b-versatile"
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": user_data}
-        ],
-        max_tokens=1000,
-        api_key=os.getenv("ANTHROPIC_API_KEY")  # or OPENAI_API_KEY, GROQ_API_KEY
-    )
+Month-over-month by category (latest month {latest_month}; pct = % change, yoy = against the same month last year):
+{compact_table(category_changes[['category', 'spending', 'mom_change', 'mom_pct', 'yoy_pct']])}
+
+Largest Transactions:
+{compact_table(largest_transactions[['description', 'amount', 'category']])}
+
+Unusual Transactions (anomaly_score = standard deviations above that merchant's usual amount):
+{compact_table(unusual_transactions[['transaction_date', 'description', 'amount', 'category', 'anomaly_score']])}"""
+
+    request, prompt_tokens = build_request(SYSTEM_PROMPT, user_data, max_tokens=1000)
+    if prompt_tokens > MAX_PROMPT_TOKENS:
+        print(f"Insights prompt is ~{prompt_tokens} tokens (budget {MAX_PROMPT_TOKENS})")
+    acquire("llm")
+    response = litellm.completion(**request)
 
     log_api_cost(response)
     return response.choices[0].message.content
-
@@ -0,0 +1,224 @@
+"""
+Render-latency load test for dashboard.py.
+
+Runs N simulated viewers concurrently, each driving its own Streamlit AppTest
+session through time_period changes, show_all toggles and tab switches, then
+reports p50/p95/p99 rerun latency and database connection usage. Each viewer
+runs in its own process: AppTest sessions share Streamlit's runtime state, so
+several in one process crash each other. The run fails if any rerun raised or
+went missing.
+
+The balance API and token refresh are stubbed, so the only external service
+is the database that DB_* points at. Use --seed to load transactions.csv and
+balance_history.csv into it first (point DB_* at a local scratch database),
+or --sqlite to run fully offline against an embedded database file.
+
+Usage:
+    python load_test.py --seed --users 10 --iterations 20 --max-p95 2000
+    python load_test.py --sqlite loadtest.db --seed --users 10
+"""
+import argparse
+import json
+import multiprocessing
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from streamlit.testing.v1 import AppTest
+
+import account_data
+import auth
+from csv_import import import_csv
+from db import create_schema
+from storage import SQLiteBackend, get_backend, set_backend
+
+TIME_PERIODS = ["Last 7 days", "Last 30 days", "Last 3 months", "Last 6 months", "All time"]
+STUB_BALANCES = {
+    "56c7b029e0f8ec5a2334fb0ffc2fface": 76.75,
+    "3c6edb9484ecd581dc1cedde8bedb1f1": 192.75,
+}
+
+
+def seed_database(transactions_csv="transactions.csv", balances_csv="balance_history.csv"):
+    """Create the schema and load the bundled CSV exports."""
+    create_schema()
+    for path in (transactions_csv, balances_csv):
+        stats = import_csv(path)
+        print(f"Seeded {stats['inserted']} {stats['table']} rows")
+
+
+class ConnectionCounter:
+    """Wrap the storage backend's connect() to count connections opened and left open."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = []
+        self.backend = get_backend()
+        self._connect = self.backend.connect
+
+    def install(self):
+        def counting_connect():
+            conn = self._connect()
+            with self.lock:
+                self.connections.append(conn)
+            return conn
+        self.backend.connect = counting_connect
+
+    def uninstall(self):
+        self.backend.connect = self._connect
+
+    def opened(self):
+        return len(self.connections)
+
+    def still_open(self):
+        return sum(1 for conn in self.connections if not conn.closed)
+
+
+def install_stubs():
+    """Stub the TrueLayer calls the dashboard makes on every rerun."""
+    auth.get_access_token = lambda: "load-test-token"
+    account_data.get_current_balances = lambda access_token: dict(STUB_BALANCES)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def simulate_user(user_id, iterations, seed, timeout, latencies, errors):
+    """
+    Drive one dashboard session through a random sequence of interactions.
+
+    Tabs in Streamlit are switched client side without a rerun and every tab
+    body executes on each run, so a tab switch is modelled as a plain rerun.
+    """
+    rng = random.Random(seed + user_id)
+    app = AppTest.from_file("dashboard.py", default_timeout=timeout)
+
+    def timed(action):
+        start = time.perf_counter()
+        action()
+        latencies.append((time.perf_counter() - start) * 1000)
+        if app.exception:
+            errors.append(f"user {user_id}: {app.exception[0].message}")
+
+    try:
+        timed(app.run)
+        for _ in range(iterations):
+            interaction = rng.choice(["time_period", "show_all", "tab"])
+            if interaction == "time_period":
+                timed(lambda: app.sidebar.selectbox[0].set_value(rng.choice(TIME_PERIODS)).run())
+            elif interaction == "show_all":
+                timed(lambda: app.sidebar.toggle[0].set_value(not app.sidebar.toggle[0].value).run())
+            else:
+                timed(app.run)
+    except Exception as e:
+        # A timed-out or crashed rerun ends this viewer; its remaining reruns show up as missing
+        errors.append(f"user {user_id}: {type(e).__name__}: {e}")
+
+
+def run_viewer(user_id, iterations, seed, timeout, sqlite_path=None):
+    """
+    Run one simulated viewer in this process, counting its DB connections.
+
+    Returns:
+        tuple: (latencies in ms, errors, connections opened, connections left open)
+    """
+    if sqlite_path:
+        set_backend(SQLiteBackend(sqlite_path))
+    install_stubs()
+    counter = ConnectionCounter()
+    counter.install()
+    latencies, errors = [], []
+    try:
+        simulate_user(user_id, iterations, seed, timeout, latencies, errors)
+    finally:
+        counter.uninstall()
+    return latencies, errors, counter.opened(), counter.still_open()
+
+
+def run_load_test(users, iterations, seed=42, timeout=30, sqlite_path=None):
+    """
+    Run the load test, one process per viewer, and return a summary dict.
+
+    Args:
+        sqlite_path (str): SQLite file the viewers read, or None for the DB_* database
+
+    Returns:
+        dict: reruns (and the number expected), errors, p50/p95/p99/max latency in ms
+              and DB connection counts
+    """
+    latencies, errors = [], []
+    opened = left_open = 0
+    start = time.perf_counter()
+    # spawn, so no viewer inherits Streamlit state from this process
+    with ProcessPoolExecutor(max_workers=users, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(run_viewer, i, iterations, seed, timeout, sqlite_path) for i in range(users)]
+        for user_id, future in enumerate(futures):
+            try:
+                user_latencies, user_errors, user_opened, user_left_open = future.result()
+            except Exception as e:
+                errors.append(f"user {user_id}: viewer process failed: {type(e).__name__}: {e}")
+                continue
+            latencies.extend(user_latencies)
+            errors.extend(user_errors)
+            opened += user_opened
+            left_open += user_left_open
+    elapsed = time.perf_counter() - start
+
+    return {
+        "users": users,
+        "reruns": len(latencies),
+        "expected_reruns": users * (iterations + 1),
+        "errors": len(errors),
+        "wall_seconds": round(elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "max_ms": round(max(latencies, default=0.0), 1),
+        "db_connections_opened": opened,
+        "db_connections_per_rerun": round(opened / max(len(latencies), 1), 2),
+        "db_connections_left_open": left_open,
+        "error_samples": errors[:5],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dashboard render-latency load test")
+    parser.add_argument("--users", type=int, default=5, help="Concurrent simulated viewers")
+    parser.add_argument("--iterations", type=int, default=10, help="Interactions per viewer")
+    parser.add_argument("--seed", action="store_true", help="Seed the database from the bundled CSVs first")
+    parser.add_argument("--sqlite", metavar="PATH", help="Use an embedded SQLite database instead of DB_*")
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--timeout", type=float, default=30, help="Per-rerun timeout in seconds")
+    parser.add_argument("--max-p95", type=float, help="Fail if p95 rerun latency (ms) exceeds this")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    if args.sqlite:
+        set_backend(SQLiteBackend(args.sqlite))
+    if args.seed:
+        seed_database()
+
+    report = run_load_test(args.users, args.iterations, args.random_seed, args.timeout, args.sqlite)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print(f"{key:<28} {value}")
+
+    if report["errors"]:
+        sys.exit(1)
+    if report["reruns"] != report["expected_reruns"]:
+        print(f"Only {report['reruns']} of {report['expected_reruns']} reruns completed")
+        sys.exit(1)
+    if args.max_p95 is not None and report["p95_ms"] > args.max_p95:
+        print(f"p95 {report['p95_ms']}ms exceeds budget {args.max_p95}ms")
+        sys.exit(1)
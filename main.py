@@ -1,16 +1,48 @@
 print("Starting...")
+import argparse
+import importlib
 from dotenv import load_dotenv
-from auth import get_access_token
-from db_operations import save_all_transactions_to_db
-from db_operations import update_all_categories_batch, save_daily_balance_snapshot
-import os
+from profiling import Profiler
 
 load_dotenv()
 
+# Stage -> (module, function, needs an access token), in the order they run.
+# Modules are imported only when their stage runs, so a balances-only cron
+# job never loads the categorisation or LLM code.
+STAGES = {
+    "transactions": ("db_operations", "save_all_transactions_to_db", True),
+    "merchants": ("merchants", "backfill_merchant_names", False),
+    "categories": ("db_operations", "update_all_categories_batch", False),
+    "anomalies": ("anomalies", "score_new_transactions", False),
+    "trends": ("trends", "refresh_daily_spending", False),
+    "recurring": ("recurring", "update_recurring_payments", True),
+    "balances": ("db_operations", "save_daily_balance_snapshot", True),
+}
+
 if __name__ == "__main__":
-    access_token = get_access_token()
-    save_all_transactions_to_db(access_token)
-    update_all_categories_batch()
-    save_daily_balance_snapshot(access_token)
+    parser = argparse.ArgumentParser(description="Sync transactions, categories and balances")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile each stage and write results to PROFILE_DIR (default: profiles/)")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES),
+                        help="Run only these stages (default: all, in order)")
+    args = parser.parse_args()
+
+    profiler = Profiler("sync", enabled=args.profile)
+    stages = [stage for stage in STAGES if stage in args.stages]
+
+    access_token = None
+    if any(STAGES[stage][2] for stage in stages):
+        with profiler.stage("get_access_token"):
+            from auth import get_access_token
+            access_token = get_access_token()
 
+    for stage in stages:
+        module_name, function_name, needs_token = STAGES[stage]
+        with profiler.stage(function_name):
+            function = getattr(importlib.import_module(module_name), function_name)
+            if needs_token:
+                function(access_token)
+            else:
+                function()
 
+    profiler.write_summary()
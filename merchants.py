@@ -0,0 +1,233 @@
+"""
+Merchant normalisation: turn raw bank descriptions into canonical merchants.
+
+Descriptions carry card numbers, references, dates, location codes and
+payment-processor prefixes ("PAYPAL *EBAY", "BROADWAY GAMING LT CD 0315"),
+so the same shop shows up under many strings. normalise_merchants() strips
+that noise with precompiled patterns and maps known variants to one name
+through MERCHANT_ALIASES, working on the distinct descriptions of a batch
+with vectorised pandas string operations.
+
+Usage:
+    python merchants.py backfill                 # fill rows with no merchant_name
+    python merchants.py backfill --all           # recompute every row (after alias changes)
+    python merchants.py show "PAYPAL *EBAY 12/03"
+"""
+import argparse
+import re
+
+from change_events import publish_change
+from db import get_connection
+from lazy_imports import pd
+
+MONTHS = "JAN|FEB|MAR|APR|MAY|JUN|JUL|AUG|SEP|OCT|NOV|DEC"
+
+# Applied in order to the upper-cased description; each match becomes a space
+NOISE_PATTERNS = [
+    # Payment-method wording in front of the merchant
+    re.compile(r"^(?:CARD PAYMENT TO|CARD PURCHASE|CONTACTLESS|DIRECT DEBIT TO|BILL PAYMENT TO|POS)\s+"),
+    # Payment processors / wallets in front of the real merchant
+    re.compile(r"^(?:PAYPAL|PP|SQ|SUMUP|IZ|ZTL|CRV|GOOGLE PAY|APPLE PAY)\s*\*\s*"),
+    re.compile(r"^PAYPAL\s+(?=\S)"),
+    # Leading hex reference tokens ("18DB38 BETROPOLIS"); a letter after a digit
+    # tells them apart from names that end in digits ("ABC123 STORES")
+    re.compile(r"^(?=[0-9A-F]*\d[A-F])[0-9A-F]{6,}\s+"),
+    # Card markers and masked card numbers
+    re.compile(r"\b(?:CD|CARD|CRD)\s*\d{3,4}\b"),
+    re.compile(r"(?:\*{2,}|\bX{4,})\d{4}\b"),
+    # Explicit references; the token must hold a digit so "ID CARD SERVICES" survives
+    re.compile(r"\b(?:REF|REFERENCE|TXN|AUTH|ID)\b[:.#\s]*(?=[^\s\d]*\d)\S+"),
+    # Dates and times: 12/03, 12-03-2024, 12MAR, 12 MAR 24, ON 12 MAR, 14:32
+    re.compile(r"\bON\s+\d{1,2}\s*(?:" + MONTHS + r")\b"),
+    re.compile(r"\b\d{1,2}[/.-]\d{1,2}(?:[/.-]\d{2,4})?\b"),
+    re.compile(r"\b\d{1,2}\s*(?:" + MONTHS + r")(?:\s*\d{2,4})?\b"),
+    re.compile(r"\b\d{1,2}:\d{2}(?::\d{2})?\b"),
+    # Long standalone numbers (store numbers, terminal IDs)
+    re.compile(r"\b\d{4,}\b"),
+    # Trailing country / location codes
+    re.compile(r"\s+(?:GB|GBR|UK|IE|IRL|US|USA|LONDON|LDN)\s*$"),
+    # Websites: keep the name, drop the scheme and TLD
+    re.compile(r"\b(?:HTTPS?://)?WWW\."),
+    re.compile(r"\.(?:CO\.UK|COM|NET|ORG|IE)\b"),
+    # Legal suffixes, including the truncated forms banks produce
+    re.compile(r"\b(?:LTD|LIMITED|LIM|LT|PLC|LLP|INC)\b\.?"),
+]
+# Apostrophes and dots join words (MCDONALD'S, E.ON); other punctuation splits them
+JOINING_PUNCTUATION = re.compile(r"['.]")
+SPLITTING_PUNCTUATION = re.compile(r"[^A-Z0-9& ]+")
+WHITESPACE = re.compile(r"\s+")
+
+# Cleaned key (matched as a whole-word prefix) -> canonical merchant
+MERCHANT_ALIASES = {
+    "TESCO MOBILE": "Tesco Mobile",
+    "TESCO": "Tesco",
+    "SAINSBURYS": "Sainsbury's",
+    "ASDA": "Asda",
+    "ASDA STOES": "Asda",
+    "MORRISONS": "Morrisons",
+    "W M MORRISONS": "Morrisons",
+    "WM MORRISONS": "Morrisons",
+    "LIDL": "Lidl",
+    "ALDI": "Aldi",
+    "SPAR": "Spar",
+    "CENTRA": "Centra",
+    "SUPERVALU": "SuperValu",
+    "SUPERVALUE": "SuperValu",
+    "DUNNES": "Dunnes Stores",
+    "HOME BARGAINS": "Home Bargains",
+    "BOOKER": "Booker",
+    "AMAZON PRIME": "Amazon Prime",
+    "AMAZON": "Amazon",
+    "AMZN": "Amazon",
+    "EBAY": "eBay",
+    "MCDONALDS": "McDonald's",
+    "GOOGLE PLAY": "Google Play",
+    "APPLE COM BILL": "Apple",
+    "NETFLIX": "Netflix",
+    "SPOTIFY": "Spotify",
+    "LNK ATM": "Link ATM",
+    "LINK ATM": "Link ATM",
+    "CIRCLE K": "Circle K",
+    "APPLEGREEN": "Applegreen",
+    "APLLEGREEN": "Applegreen",
+    "AA INSURANCE": "AA Insurance",
+    "AA MEMBERSHIP": "AA Membership",
+    "DVLA": "DVLA",
+    "EON": "E.ON",
+    "EDF": "EDF Energy",
+    "OVO": "OVO Energy",
+    "TALKTALK": "TalkTalk",
+    "EE & T MOBILE": "EE",
+    "BET365": "Bet365",
+    "BETFRED": "Betfred",
+    "BETROPOLIS": "Betropolis",
+    "BINGO": "Bingo.com",
+    "VIRGIN GAMES": "Virgin Games",
+    "TAILS": "Tails.com",
+    "TAILSCOM": "Tails.com",
+    "METROBANK": "Metro Bank",
+    "REVOLUT": "Revolut",
+    "HALIFAX": "Halifax",
+    "TSB": "TSB",
+    "ULSTER BANK": "Ulster Bank",
+    "VANQUIS": "Vanquis Bank",
+    "CIRCLE UK TRADING": "Circle UK Trading",
+}
+# Longest keys first so "TESCO MOBILE" wins over "TESCO"
+ALIAS_PATTERN = re.compile(
+    r"^(" + "|".join(re.escape(key) for key in sorted(MERCHANT_ALIASES, key=len, reverse=True)) + r")\b"
+)
+
+
+def clean_descriptions(descriptions):
+    """
+    Strip card/reference noise, dates and location codes from descriptions.
+
+    Args:
+        descriptions (pd.Series): Raw descriptions (no nulls)
+
+    Returns:
+        pd.Series: Upper-cased, noise-free keys ("" if nothing is left)
+    """
+    cleaned = descriptions.astype(str).str.upper()
+    for pattern in NOISE_PATTERNS:
+        cleaned = cleaned.str.replace(pattern, " ", regex=True)
+    cleaned = cleaned.str.replace(JOINING_PUNCTUATION, "", regex=True)
+    cleaned = cleaned.str.replace(SPLITTING_PUNCTUATION, " ", regex=True)
+    return cleaned.str.replace(WHITESPACE, " ", regex=True).str.strip()
+
+
+def normalise_merchants(descriptions):
+    """
+    Map raw descriptions to canonical merchant names.
+
+    Each distinct description is cleaned once, however often it repeats, so
+    a batch costs one vectorised pass over its unique strings.
+
+    Args:
+        descriptions (iterable): Raw transaction descriptions
+
+    Returns:
+        pd.Series: Canonical merchant per input (None where nothing usable remains),
+                   in input order
+    """
+    series = pd.Series(list(descriptions), dtype=object)
+    unique = pd.Series(series.dropna().unique(), dtype=object)
+    if unique.empty:
+        return pd.Series([None] * len(series), dtype=object)
+
+    cleaned = clean_descriptions(unique)
+    aliases = cleaned.str.extract(ALIAS_PATTERN, expand=False).map(MERCHANT_ALIASES)
+    merchants = aliases.fillna(cleaned.str.title()).where(cleaned != "", None)
+
+    result = series.map(dict(zip(unique, merchants)))
+    return result.astype(object).where(result.notna(), None)
+
+
+def backfill_merchant_names(chunk_size=5000, recompute=False):
+    """
+    Populate merchant_name for rows already in the database.
+
+    Walks the table in transaction_id order (keyset, so each chunk is an
+    index range scan) and commits per chunk, so an interrupted run keeps
+    everything up to its last chunk.
+
+    Args:
+        chunk_size (int): Rows read and updated per transaction
+        recompute (bool): Re-derive every row, not just those with no merchant_name
+
+    Returns:
+        int: Rows whose merchant_name changed
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    pending = "" if recompute else "AND merchant_name IS NULL"
+    last_id = ""
+    updated = 0
+
+    try:
+        while True:
+            cursor.execute(f"""
+                SELECT transaction_id, description, account_id, transaction_date, merchant_name
+                FROM finance_sandbox.transactions
+                WHERE transaction_id > %s {pending}
+                ORDER BY transaction_id
+                LIMIT %s
+            """, (last_id, chunk_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            merchants = normalise_merchants(row[1] for row in rows)
+            changed = [(merchant, row) for merchant, row in zip(merchants, rows) if merchant != row[4]]
+            if changed:
+                cursor.executemany(
+                    "UPDATE finance_sandbox.transactions SET merchant_name = %s WHERE transaction_id = %s",
+                    [(merchant, row[0]) for merchant, row in changed]
+                )
+                dates = [str(row[3])[:10] for _, row in changed]
+                publish_change(conn, "transactions", "merchants", {row[2] for _, row in changed},
+                               min(dates), max(dates), len(changed))
+            conn.commit()
+            updated += len(changed)
+            print(f"Merchant backfill: {updated} rows updated (up to {last_id})")
+    finally:
+        conn.close()
+
+    return updated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Canonical merchant names from transaction descriptions")
+    parser.add_argument("command", choices=["backfill", "show"])
+    parser.add_argument("descriptions", nargs="*", help="show: descriptions to normalise")
+    parser.add_argument("--all", action="store_true", help="backfill: recompute every row")
+    parser.add_argument("--chunksize", type=int, default=5000, help="backfill: rows per chunk")
+    args = parser.parse_args()
+
+    if args.command == "backfill":
+        print(f"Done: {backfill_merchant_names(args.chunksize, recompute=args.all)} rows updated")
+    else:
+        for description, merchant in zip(args.descriptions, normalise_merchants(args.descriptions)):
+            print(f"{description!r} -> {merchant!r}")
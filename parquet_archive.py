@@ -0,0 +1,352 @@
+"""
+Parquet archive for transaction and balance history.
+
+Writes hive-partitioned datasets (year=YYYY/month=M) with zstd compression,
+dictionary-encoded text columns and row-group statistics, so readers only
+touch the partitions and row groups their filters need.
+
+Usage:
+    python parquet_archive.py export                 # new/changed months only
+    python parquet_archive.py export --full          # rewrite everything
+    python parquet_archive.py load                   # bulk-load archive into the DB
+    python parquet_archive.py archive --before 2025-01  # export, verify, then drop from hot table
+"""
+import argparse
+import os
+from datetime import date
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from change_events import publish_change
+from db import get_connection
+from db_queries import iter_query_chunks
+from storage import get_backend
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ROWS_PER_GROUP = 64 * 1024
+
+PARTITIONING = ds.partitioning(pa.schema([("year", pa.int16()), ("month", pa.int8())]), flavor="hive")
+
+TRANSACTIONS_SCHEMA = pa.schema([
+    ("transaction_id", pa.string()),
+    ("account_id", pa.string()),
+    ("amount", pa.float64()),
+    ("currency", pa.string()),
+    ("description", pa.string()),
+    ("transaction_date", pa.date32()),
+    ("timestamp", pa.timestamp("us", tz="UTC")),
+    ("transaction_type", pa.string()),
+    ("category", pa.string()),
+    ("merchant_name", pa.string()),
+    ("year", pa.int16()),
+    ("month", pa.int8()),
+])
+
+BALANCES_SCHEMA = pa.schema([
+    ("account_id", pa.string()),
+    ("current_balance", pa.float64()),
+    ("available_balance", pa.float64()),
+    ("overdraft_limit", pa.float64()),
+    ("snapshot_date", pa.date32()),
+    ("created_at", pa.timestamp("us")),
+    ("year", pa.int16()),
+    ("month", pa.int8()),
+])
+
+# table -> (schema, date column, primary key)
+TABLES = {
+    "transactions": (TRANSACTIONS_SCHEMA, "transaction_date", ["transaction_id"]),
+    "balance_history": (BALANCES_SCHEMA, "snapshot_date", ["account_id", "snapshot_date"]),
+}
+
+# Low-cardinality text columns worth dictionary-encoding on disk
+DICTIONARY_COLUMNS = ["account_id", "currency", "description", "transaction_type", "category", "merchant_name"]
+
+
+def _dataset_path(table, root=ARCHIVE_DIR):
+    return os.path.join(root, table)
+
+
+def _to_arrow(df, table):
+    """Coerce a DataFrame from either backend into the archive schema."""
+    schema, date_column, _ = TABLES[table]
+    df = df.copy()
+    dates = pd.to_datetime(df[date_column])
+    df[date_column] = dates.dt.date
+    df["year"] = dates.dt.year.astype("int16")
+    df["month"] = dates.dt.month.astype("int8")
+    if table == "transactions":
+        df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True)
+    else:
+        df["created_at"] = pd.to_datetime(df["created_at"])
+    for column in schema.names:
+        if pa.types.is_floating(schema.field(column).type):
+            df[column] = df[column].astype("float64")
+    return pa.Table.from_pandas(df[schema.names], schema=schema, preserve_index=False)
+
+
+def _keys(arrow_table, primary_key):
+    """Primary key of each row as one string array, for membership tests."""
+    columns = [arrow_table[column].cast(pa.string()) for column in primary_key]
+    if len(columns) == 1:
+        return columns[0]
+    return pc.binary_join_element_wise(*columns, "\x1f")
+
+
+def _merge_archived(arrow_table, table, root=ARCHIVE_DIR):
+    """
+    arrow_table plus the already-archived rows of the months it touches that it doesn't replace.
+
+    The hot table may no longer hold a month's older rows (archive_before
+    deleted them), so a partition rewritten from the database alone would
+    lose them.
+    """
+    schema, _, primary_key = TABLES[table]
+    archived = set(archived_months(table, root))
+    months = arrow_table.select(["year", "month"]).group_by(["year", "month"]).aggregate([])
+    touched = [(year, month) for year, month in zip(months["year"].to_pylist(), months["month"].to_pylist())
+               if (year, month) in archived]
+    if not touched:
+        return arrow_table
+
+    dataset = ds.dataset(_dataset_path(table, root), schema=schema, format="parquet", partitioning=PARTITIONING)
+    condition = None
+    for year, month in touched:
+        match = (ds.field("year") == year) & (ds.field("month") == month)
+        condition = match if condition is None else condition | match
+    existing = dataset.to_table(filter=condition)
+    kept = existing.filter(pc.invert(pc.is_in(_keys(existing, primary_key),
+                                              value_set=_keys(arrow_table, primary_key))))
+    return pa.concat_tables([arrow_table, kept])
+
+
+def write_partitions(arrow_table, table, root=ARCHIVE_DIR):
+    """
+    Write rows into the archive, merging them into the month partitions they touch.
+
+    Each touched month is rewritten with the new rows plus its archived rows
+    they don't replace (by primary key), so re-exports stay idempotent (the
+    current month can be exported every night) and a late row for an
+    archived month doesn't wipe out the rows archived before it.
+    """
+    arrow_table = _merge_archived(arrow_table, table, root)
+    file_format = ds.ParquetFileFormat()
+    options = file_format.make_write_options(
+        compression="zstd",
+        use_dictionary=[c for c in DICTIONARY_COLUMNS if c in arrow_table.schema.names],
+        write_statistics=True,
+    )
+    ds.write_dataset(
+        arrow_table,
+        _dataset_path(table, root),
+        format=file_format,
+        file_options=options,
+        partitioning=PARTITIONING,
+        existing_data_behavior="delete_matching",
+        max_rows_per_group=ROWS_PER_GROUP,
+        basename_template="part-{i}.parquet",
+    )
+
+
+def archived_months(table, root=ARCHIVE_DIR):
+    """Sorted list of (year, month) partitions present in the archive."""
+    path = _dataset_path(table, root)
+    months = []
+    if not os.path.isdir(path):
+        return months
+    for year_dir in os.listdir(path):
+        if not year_dir.startswith("year="):
+            continue
+        for month_dir in os.listdir(os.path.join(path, year_dir)):
+            if month_dir.startswith("month="):
+                months.append((int(year_dir[5:]), int(month_dir[6:])))
+    return sorted(months)
+
+
+def export_table(table, since=None, before=None, root=ARCHIVE_DIR):
+    """
+    Export rows of a table to the archive.
+
+    Args:
+        table (str): "transactions" or "balance_history"
+        since (date): First day to export (inclusive). None exports from the start.
+        before (date): First day NOT to export. None exports to the end.
+
+    Returns:
+        int: Rows written
+    """
+    schema, date_column, _ = TABLES[table]
+    columns = [name for name in schema.names if name not in ("year", "month")]
+    conditions, params = [], []
+    if since:
+        conditions.append(f"{date_column} >= %s")
+        params.append(since.isoformat())
+    if before:
+        conditions.append(f"{date_column} < %s")
+        params.append(before.isoformat())
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    # Stream rows and convert each chunk to Arrow straight away; the columnar
+    # batches are far smaller than the equivalent row tuples
+    batches = [
+        _to_arrow(chunk, table)
+        for chunk in iter_query_chunks(f"SELECT {', '.join(columns)} FROM finance_sandbox.{table} {where}",
+                                       tuple(params), columns=columns)
+    ]
+    if not batches:
+        print(f"No {table} rows to export")
+        return 0
+
+    # One write per export: delete_matching replaces each month partition once
+    arrow_table = pa.concat_tables(batches)
+    write_partitions(arrow_table, table, root)
+    print(f"Exported {arrow_table.num_rows} {table} rows to {_dataset_path(table, root)}")
+    return arrow_table.num_rows
+
+
+def export_new_months(table, root=ARCHIVE_DIR):
+    """
+    Incrementally export a table.
+
+    Re-exports the newest archived month (it may have been partial when it
+    was written) and everything after it; older partitions are untouched.
+    """
+    months = archived_months(table, root)
+    since = date(*months[-1], 1) if months else None
+    return export_table(table, since=since, root=root)
+
+
+def read_archive(table, start=None, end=None, columns=None, root=ARCHIVE_DIR):
+    """
+    Read archived rows as an Arrow table.
+
+    Filters on the date column prune whole partitions and use row-group
+    statistics, so a one-month read only opens that month's files.
+
+    Args:
+        table (str): "transactions" or "balance_history"
+        start (date): Inclusive lower bound on the date column
+        end (date): Exclusive upper bound on the date column
+        columns (list): Columns to read (default: all)
+    """
+    schema, date_column, _ = TABLES[table]
+    dataset = ds.dataset(_dataset_path(table, root), schema=schema, format="parquet", partitioning=PARTITIONING)
+    condition = None
+    if start:
+        condition = ds.field(date_column) >= pa.scalar(start, pa.date32())
+        # Partition pruning needs a predicate on the partition columns themselves
+        condition &= (ds.field("year") > start.year) | (
+            (ds.field("year") == start.year) & (ds.field("month") >= start.month))
+    if end:
+        upper = ds.field(date_column) < pa.scalar(end, pa.date32())
+        upper &= (ds.field("year") < end.year) | (
+            (ds.field("year") == end.year) & (ds.field("month") <= end.month))
+        condition = upper if condition is None else condition & upper
+    return dataset.to_table(columns=columns, filter=condition)
+
+
+def load_archive_to_db(table, start=None, end=None, batch_size=10000, root=ARCHIVE_DIR):
+    """
+    Bulk-load archived rows back into the database, skipping rows already present.
+
+    Returns:
+        int: Rows read from the archive
+    """
+    schema, date_column, primary_key = TABLES[table]
+    columns = [name for name in schema.names if name not in ("year", "month")]
+    arrow_table = read_archive(table, start, end, columns, root)
+
+    backend = get_backend()
+    conn = get_connection()
+    cursor = conn.cursor()
+    loaded = 0
+    for batch in arrow_table.to_batches(max_chunksize=batch_size):
+        # Dates and timestamps as ISO strings load identically on both backends
+        values = [
+            [v.isoformat() if v is not None and hasattr(v, "isoformat") else v for v in column.to_pylist()]
+            for column in batch.columns
+        ]
+        rows = list(zip(*values))
+        backend.insert_rows(cursor, f"finance_sandbox.{table}", columns, rows, primary_key)
+        loaded += len(rows)
+
+    if loaded:
+        dates = arrow_table.column(date_column)
+        publish_change(conn, table, "archive_load", None,
+                       pc.min(dates).as_py().isoformat(), pc.max(dates).as_py().isoformat(), loaded)
+    conn.commit()
+    conn.close()
+    print(f"Loaded {loaded} {table} rows from archive")
+    return loaded
+
+
+def archive_before(table, before, root=ARCHIVE_DIR):
+    """
+    Move rows older than a date out of the hot table.
+
+    Exports them, checks the archive holds every one of them (by primary
+    key), and only then deletes them.
+
+    Returns:
+        int: Rows removed from the hot table (0 if verification failed)
+    """
+    _, date_column, primary_key = TABLES[table]
+    exported = export_table(table, before=before, root=root)
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT COUNT(*), MIN({date_column}) FROM finance_sandbox.{table} WHERE {date_column} < %s",
+                   (before.isoformat(),))
+    db_count, oldest = cursor.fetchone()
+    if not db_count:
+        conn.close()
+        return 0
+
+    # Only the range still in the DB; the archive may also hold rows from
+    # those months archived earlier, so compare keys rather than counts
+    oldest = date.fromisoformat(str(oldest)[:10])
+    archived = _keys(read_archive(table, start=oldest, end=before, columns=primary_key, root=root), primary_key)
+    missing = 0
+    for chunk in iter_query_chunks(f"""
+        SELECT {', '.join(primary_key)} FROM finance_sandbox.{table} WHERE {date_column} < %s
+    """, (before.isoformat(),), columns=primary_key):
+        keys = _keys(pa.Table.from_pandas(chunk.astype(str), preserve_index=False), primary_key)
+        missing += len(keys) - (pc.sum(pc.is_in(keys, value_set=archived)).as_py() or 0)
+    if missing or exported != db_count:
+        print(f"Archive verification failed: {missing} of {db_count} DB rows not in the archive. Nothing deleted.")
+        conn.close()
+        return 0
+
+    cursor.execute(f"DELETE FROM finance_sandbox.{table} WHERE {date_column} < %s", (before.isoformat(),))
+    publish_change(conn, table, "archive", None, None, before.isoformat(), db_count)
+    conn.commit()
+    conn.close()
+    print(f"Archived and removed {db_count} {table} rows before {before}")
+    return db_count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parquet archive for transaction and balance history")
+    parser.add_argument("command", choices=["export", "load", "archive"])
+    parser.add_argument("--table", choices=list(TABLES), help="Limit to one table (default: both)")
+    parser.add_argument("--root", default=ARCHIVE_DIR, help="Archive directory")
+    parser.add_argument("--full", action="store_true", help="export: rewrite every partition")
+    parser.add_argument("--before", help="archive: move rows before this month (YYYY-MM) out of the DB")
+    args = parser.parse_args()
+
+    tables = [args.table] if args.table else list(TABLES)
+    for name in tables:
+        if args.command == "export":
+            if args.full:
+                export_table(name, root=args.root)
+            else:
+                export_new_months(name, root=args.root)
+        elif args.command == "load":
+            load_archive_to_db(name, root=args.root)
+        else:
+            if not args.before:
+                parser.error("archive needs --before YYYY-MM")
+            archive_before(name, date.fromisoformat(f"{args.before}-01"), root=args.root)
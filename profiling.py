@@ -0,0 +1,160 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+
+class StackSampler:
+    """
+    Sample the call stack of one thread, or every thread, at a fixed interval.
+
+    Runs in a daemon thread and counts each distinct stack it sees, which is
+    exactly what the collapsed-stack flamegraph format needs
+    ("outer;inner;leaf count" per line). When sampling every thread each
+    stack starts with its thread's name, so work handed to a thread pool
+    shows up under the pool's workers.
+
+    Args:
+        thread_id (int): Thread to sample, or None for every thread but the sampler's own
+        interval (float): Sampling interval in seconds
+    """
+
+    def __init__(self, thread_id=None, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            if self.thread_id is not None:
+                frame = frames.get(self.thread_id)
+                if frame is not None:
+                    self.stacks[self._collapse(frame)] += 1
+                continue
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in frames.items():
+                if thread_id != self._thread.ident:
+                    self.stacks[f"{names.get(thread_id, thread_id)};{self._collapse(frame)}"] += 1
+
+    @staticmethod
+    def _collapse(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+    def write_collapsed(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Profiler:
+    """
+    Per-stage profiler for sync runs and dashboard page loads.
+
+    Each stage is run under cProfile (deterministic) and a StackSampler
+    (sampling). cProfile only sees the thread that runs the stage, so the
+    sampler covers every thread: loads the stage hands to an executor appear
+    in the .collapsed output under the worker thread's name. Results go to a
+    timestamped directory:
+        <stage>.pstats      - load with pstats / snakeviz
+        <stage>.collapsed   - feed to flamegraph.pl or speedscope
+        summary.txt         - wall time and top cumulative functions per stage
+
+    Args:
+        label (str): Prefix for the output directory, e.g. "sync" or "dashboard"
+        enabled (bool): When False, stage() and wrap() are no-ops
+        interval (float): Sampling interval in seconds
+    """
+
+    def __init__(self, label, enabled=True, interval=0.005, root=PROFILE_DIR):
+        self.enabled = enabled
+        self.interval = interval
+        self.output_dir = os.path.join(root, f"{label}_{datetime.now():%Y%m%d_%H%M%S_%f}")
+        self.stages = []  # (name, wall_seconds, pstats.Stats)
+
+    @contextmanager
+    def stage(self, name):
+        """Profile the enclosed block as one named stage."""
+        if not self.enabled:
+            yield
+            return
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        profile = cProfile.Profile()
+        sampler = StackSampler(interval=self.interval)
+
+        sampler.start()
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - start
+            sampler.stop()
+
+            profile.dump_stats(os.path.join(self.output_dir, f"{name}.pstats"))
+            sampler.write_collapsed(os.path.join(self.output_dir, f"{name}.collapsed"))
+            self.stages.append((name, elapsed, pstats.Stats(profile)))
+
+    def wrap(self, func, name=None):
+        """Return func wrapped so every call is profiled as a stage."""
+        if not self.enabled:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.stage(name or func.__name__):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    def write_summary(self, top=20):
+        """
+        Write summary.txt with wall time and top cumulative functions per stage.
+
+        Returns:
+            str: Path to the summary file, or None if nothing was profiled
+        """
+        if not self.enabled or not self.stages:
+            return None
+
+        path = os.path.join(self.output_dir, "summary.txt")
+        with open(path, "w") as f:
+            total = sum(elapsed for _, elapsed, _ in self.stages)
+            f.write(f"Total profiled time: {total:.3f}s\n\n")
+            for name, elapsed, _ in self.stages:
+                f.write(f"{name:<40} {elapsed:>8.3f}s\n")
+
+            for name, elapsed, stats in self.stages:
+                stream = io.StringIO()
+                stats.stream = stream
+                stats.sort_stats("cumulative").print_stats(top)
+                f.write(f"\n===== {name} ({elapsed:.3f}s) =====\n")
+                f.write(stream.getvalue())
+
+        print(f"Profile written to {self.output_dir}")
+        return path
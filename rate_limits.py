@@ -0,0 +1,88 @@
+"""
+Token-bucket rate limits for outbound TrueLayer and LLM calls.
+
+Every call waits on two buckets: one per (service, user), and one per
+service shared by the whole deployment. The user is taken from the
+current_user context variable, set by the sync worker for the duration of
+a user's job; calls made outside a job (single-user main.py, dashboard)
+only wait on the global bucket.
+
+Global buckets are process-local by default. The sync coordinator creates
+them in shared memory (shared_buckets()) and installs them in every worker
+process, so the limit holds across the whole pool. Per-user buckets can
+stay process-local: the coordinator never runs two jobs for one user at
+the same time.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+# service: (global requests/second, per-user requests/second)
+RATE_LIMITS = {
+    "truelayer": (float(os.getenv("TRUELAYER_RATE_LIMIT", 20)), float(os.getenv("TRUELAYER_USER_RATE_LIMIT", 2))),
+    "llm": (float(os.getenv("LLM_RATE_LIMIT", 5)), float(os.getenv("LLM_USER_RATE_LIMIT", 1))),
+}
+
+current_user = ContextVar("current_user", default=None)
+
+
+class TokenBucket:
+    """
+    Allows rate calls per second on average, in bursts of up to capacity.
+
+    With shared=True the state lives in shared memory and can be handed to
+    worker processes (as a Pool initializer argument).
+    """
+
+    def __init__(self, rate, capacity=None, shared=False):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        if shared:
+            self._state = multiprocessing.Array("d", [self.capacity, time.monotonic()])
+            self._lock = self._state.get_lock()
+        else:
+            self._state = [self.capacity, time.monotonic()]
+            self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a call is allowed."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                tokens = min(self.capacity, self._state[0] + (now - self._state[1]) * self.rate)
+                self._state[1] = now
+                if tokens >= 1:
+                    self._state[0] = tokens - 1
+                    return
+                self._state[0] = tokens
+                wait = (1 - tokens) / self.rate
+            time.sleep(wait)
+
+
+_global_buckets = {service: TokenBucket(rates[0]) for service, rates in RATE_LIMITS.items()}
+_user_buckets = {}
+_user_buckets_lock = threading.Lock()
+
+
+def shared_buckets():
+    """Global buckets in shared memory, for install_buckets() in each worker process."""
+    return {service: TokenBucket(rates[0], shared=True) for service, rates in RATE_LIMITS.items()}
+
+
+def install_buckets(buckets):
+    """Use these global buckets in this process (Pool initializer)."""
+    _global_buckets.update(buckets)
+
+
+def acquire(service):
+    """Wait until the current user and the deployment may both make another call to service."""
+    user_id = current_user.get()
+    if user_id is not None:
+        with _user_buckets_lock:
+            bucket = _user_buckets.get((service, user_id))
+            if bucket is None:
+                bucket = _user_buckets[(service, user_id)] = TokenBucket(RATE_LIMITS[service][1])
+        bucket.acquire()
+    _global_buckets[service].acquire()
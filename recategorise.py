@@ -0,0 +1,276 @@
+"""
+Resumable background recategorisation.
+
+Every label carries the category_version (a hash of model + prompt +
+category list, see llm.CATEGORY_VERSION) and model that produced it. When
+either changes, a job relabels the stale rows:
+
+- rows are walked in transaction_id order in small keyset chunks, so each
+  read is a short index range scan and no long transaction holds locks
+- each chunk's new labels and the job checkpoint are written in one
+  transaction, so readers keep seeing the old labels until it commits and
+  a crash never leaves a half-written chunk
+- a pause between chunks leaves room for the nightly sync and the dashboard
+- the job row in category_jobs records progress; running again resumes
+  from the last checkpoint
+- a runner claims the job atomically before starting, so two runners never
+  process the same version at once; a running job whose checkpoint hasn't
+  moved for STALE_JOB_SECONDS is failed as abandoned and can be resumed
+
+Usage:
+    python recategorise.py run                 # start, or resume the current version's job
+    python recategorise.py run --chunksize 100 --pause 2
+    python recategorise.py status
+    python recategorise.py pause               # a running job stops after its current chunk
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from change_events import publish_change
+from db import get_connection
+from llm import batch_categorise_llm, CATEGORY_VERSION, MODEL
+
+CHUNK_SIZE = int(os.getenv("RECATEGORISE_CHUNK_SIZE", 50))
+PAUSE_SECONDS = float(os.getenv("RECATEGORISE_PAUSE", 1.0))
+# A running job whose checkpoint hasn't moved for this long is assumed to belong to a dead runner
+STALE_JOB_SECONDS = int(os.getenv("RECATEGORISE_STALE_JOB_SECONDS", 900))
+
+STALE = "(category_version IS NULL OR category_version <> %s)"
+JOB_COLUMNS = ["id", "category_version", "model", "status", "checkpoint", "rows_done",
+               "rows_total", "elapsed_seconds", "error", "created_at", "updated_at"]
+
+
+def _fetch_job(cursor, where, params):
+    cursor.execute(f"""
+        SELECT {', '.join(JOB_COLUMNS)} FROM finance_sandbox.category_jobs
+        WHERE {where}
+        ORDER BY id DESC
+        LIMIT 1
+    """, params)
+    row = cursor.fetchone()
+    return dict(zip(JOB_COLUMNS, row)) if row else None
+
+
+def get_or_create_job(conn, version=CATEGORY_VERSION, model=MODEL):
+    """
+    The unfinished job for this version, or a new one if there is none.
+
+    Returns:
+        dict: category_jobs row, or None if no rows are stale
+    """
+    cursor = conn.cursor()
+    job = _fetch_job(cursor, "category_version = %s AND status <> 'done'", (version,))
+    if job:
+        return job
+
+    cursor.execute(f"SELECT COUNT(*) FROM finance_sandbox.transactions WHERE {STALE}", (version,))
+    stale = cursor.fetchone()[0]
+    if not stale:
+        return None
+    # Another runner may have created the job since the lookup; the partial
+    # unique index keeps it to one and this insert becomes a no-op
+    cursor.execute("""
+        INSERT INTO finance_sandbox.category_jobs (category_version, model, status, rows_total)
+        VALUES (%s, %s, 'pending', %s)
+        ON CONFLICT (category_version) WHERE status <> 'done' DO NOTHING
+    """, (version, model, stale))
+    conn.commit()
+    return _fetch_job(cursor, "category_version = %s AND status <> 'done'", (version,))
+
+
+def expire_stale_jobs(conn):
+    """Fail running jobs whose runner died, so the next run can claim and resume them."""
+    cursor = conn.cursor()
+    # The database's clock, since that is what wrote updated_at
+    cursor.execute("SELECT CURRENT_TIMESTAMP")
+    now = datetime.fromisoformat(str(cursor.fetchone()[0])[:19])
+    cursor.execute("""
+        UPDATE finance_sandbox.category_jobs
+        SET status = 'failed', error = 'runner lost', updated_at = CURRENT_TIMESTAMP
+        WHERE status = 'running' AND updated_at < %s
+    """, ((now - timedelta(seconds=STALE_JOB_SECONDS)).isoformat(sep=" "),))
+    expired = cursor.rowcount
+    conn.commit()
+    return expired
+
+
+def claim_job(conn, job_id):
+    """
+    Mark a job running unless another runner already has it.
+
+    Returns:
+        bool: True if this runner now owns the job
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE finance_sandbox.category_jobs
+        SET status = 'running', error = NULL, updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s AND status NOT IN ('running', 'done')
+    """, (job_id,))
+    claimed = cursor.rowcount == 1
+    conn.commit()
+    return claimed
+
+
+def job_status(job):
+    """Progress summary for a job row: percent done and ETA from its own throughput."""
+    done, total = job["rows_done"], job["rows_total"] or 0
+    rate = done / job["elapsed_seconds"] if job["elapsed_seconds"] else None
+    remaining = max(total - done, 0)
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "category_version": job["category_version"],
+        "rows_done": done,
+        "rows_total": total,
+        "percent": min(round(100 * done / total, 1), 100.0) if total else 100.0,
+        "rows_per_second": round(rate, 1) if rate else None,
+        "eta_seconds": round(remaining / rate) if rate else None,
+        "error": job["error"],
+    }
+
+
+def _set_status(conn, job_id, status, error=None):
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE finance_sandbox.category_jobs
+        SET status = %s, error = %s, updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s
+    """, (status, error, job_id))
+    conn.commit()
+
+
+def run_job(chunk_size=CHUNK_SIZE, pause=PAUSE_SECONDS, max_chunks=None):
+    """
+    Recategorise every row not labelled by the current CATEGORY_VERSION.
+
+    Args:
+        chunk_size (int): Rows per chunk (one LLM batch, one commit)
+        pause (float): Seconds to sleep between chunks
+        max_chunks (int): Stop after this many chunks (None: run to the end)
+
+    Returns:
+        dict: job_status() of the job afterwards, or None if nothing was stale
+              or another runner is already processing it
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    expired = expire_stale_jobs(conn)
+    if expired:
+        print(f"Failed {expired} abandoned job(s) with no progress for {STALE_JOB_SECONDS}s")
+    job = get_or_create_job(conn)
+    if job is None:
+        conn.close()
+        print(f"All transactions already labelled with category version {CATEGORY_VERSION}")
+        return None
+    if not claim_job(conn, job["id"]):
+        conn.close()
+        print(f"Job {job['id']} is already running in another process")
+        return None
+
+    job_id, checkpoint = job["id"], job["checkpoint"]
+    rows_done, elapsed = job["rows_done"], job["elapsed_seconds"]
+    chunks = 0
+    finished = False
+
+    try:
+        while max_chunks is None or chunks < max_chunks:
+            started = time.perf_counter()
+            cursor.execute(f"""
+                SELECT transaction_id, description, account_id, transaction_date
+                FROM finance_sandbox.transactions
+                WHERE transaction_id > %s AND {STALE}
+                ORDER BY transaction_id
+                LIMIT %s
+            """, (checkpoint, CATEGORY_VERSION, chunk_size))
+            rows = cursor.fetchall()
+            conn.rollback()  # end the read so no snapshot is held during the LLM call
+            if not rows:
+                finished = True
+                break
+
+            category_map = batch_categorise_llm(list(dict.fromkeys(row[1] for row in rows)))
+            checkpoint = rows[-1][0]
+            rows_done += len(rows)
+            # Throughput includes the pause, so the ETA is wall-clock time
+            elapsed += time.perf_counter() - started + pause
+
+            # Labels and checkpoint commit together: either the chunk is done or it isn't
+            cursor.executemany("""
+                UPDATE finance_sandbox.transactions
+                SET category = %s, category_version = %s, category_model = %s
+                WHERE transaction_id = %s
+            """, [(category_map.get(row[1], 'Uncategorized'), CATEGORY_VERSION, MODEL, row[0]) for row in rows])
+            cursor.execute("""
+                UPDATE finance_sandbox.category_jobs
+                SET checkpoint = %s, rows_done = %s, elapsed_seconds = %s, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            """, (checkpoint, rows_done, elapsed, job_id))
+            dates = [str(row[3])[:10] for row in rows]
+            publish_change(conn, "transactions", "recategorise", {row[2] for row in rows},
+                           min(dates), max(dates), len(rows))
+            conn.commit()
+            chunks += 1
+
+            status = job_status({**job, "rows_done": rows_done, "elapsed_seconds": elapsed})
+            print(f"\rJob {job_id}: {rows_done:,}/{status['rows_total']:,} ({status['percent']}%), "
+                  f"ETA {status['eta_seconds']}s", end="", file=sys.stderr)
+
+            # Another process may have asked us to stop
+            cursor.execute("SELECT status FROM finance_sandbox.category_jobs WHERE id = %s", (job_id,))
+            stop = cursor.fetchone()[0] == "paused"
+            conn.rollback()
+            if stop:
+                break
+            time.sleep(pause)
+
+        _set_status(conn, job_id, "done" if finished else "paused")
+        print(file=sys.stderr)
+    except Exception as e:
+        conn.rollback()
+        _set_status(conn, job_id, "failed", str(e))
+        print(f"Job {job_id} failed at {checkpoint}: {e}. Run again to resume.")
+        raise
+    finally:
+        cursor.execute("SELECT " + ", ".join(JOB_COLUMNS) + " FROM finance_sandbox.category_jobs WHERE id = %s",
+                       (job_id,))
+        job = dict(zip(JOB_COLUMNS, cursor.fetchone()))
+        conn.close()
+
+    return job_status(job)
+
+
+def pause_job(version=CATEGORY_VERSION):
+    """Ask the running job for this version to stop after its current chunk."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE finance_sandbox.category_jobs SET status = 'paused', updated_at = CURRENT_TIMESTAMP
+        WHERE category_version = %s AND status = 'running'
+    """, (version,))
+    paused = cursor.rowcount
+    conn.commit()
+    conn.close()
+    return paused
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resumable recategorisation of stale transaction labels")
+    parser.add_argument("command", choices=["run", "status", "pause"])
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE, help="run: rows per chunk")
+    parser.add_argument("--pause", type=float, default=PAUSE_SECONDS, help="run: seconds between chunks")
+    parser.add_argument("--max-chunks", type=int, help="run: stop after this many chunks")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        print(run_job(args.chunksize, args.pause, args.max_chunks))
+    elif args.command == "pause":
+        print(f"Paused {pause_job()} running job(s)")
+    else:
+        connection = get_connection()
+        latest = _fetch_job(connection.cursor(), "category_version = %s", (CATEGORY_VERSION,))
+        connection.close()
+        print(job_status(latest) if latest else f"No job for category version {CATEGORY_VERSION}")
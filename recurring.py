@@ -0,0 +1,508 @@
+"""
+Recurring payment detection: subscriptions, bills and other regular payments.
+
+Outgoing transactions are grouped by (account, merchant_name) and each group
+is split into amount clusters (payments within AMOUNT_TOLERANCE of each
+other). A cluster is a series when the gaps between its sorted payment dates
+sit on one cadence: weekly, fortnightly, monthly or annual, each with its
+own tolerance in days. Clusters paid on several fixed days a month (two
+policies with the same insurer) are split by day of month and tried again.
+
+Direct debit mandates from the bank are merged in: a mandate marks the
+series it matches, and a mandate with no matching history yet becomes a
+monthly series of its own. Each series is stored in recurring_series with
+its next expected payment date.
+
+Runs are incremental: change_log says which date ranges received new or
+re-merchanted transactions since the last run, and only the (account,
+merchant) groups with rows in those ranges are re-detected.
+
+Usage:
+    python recurring.py detect           # groups changed since the last run
+    python recurring.py detect --full    # every group
+    python recurring.py show             # active recurring payments
+    python recurring.py upcoming --days 30
+"""
+import argparse
+import calendar
+import os
+import statistics
+from datetime import date, timedelta
+
+from account_data import fetching_all_direct_debits
+from change_events import publish_change, get_unconsumed_changes, mark_changes_consumed
+from db import get_connection
+from merchants import normalise_merchants
+
+CADENCES = {
+    # name: (period in days, tolerance in days, minimum payments)
+    "weekly": (7, 1, 4),
+    "fortnightly": (14, 2, 3),
+    "monthly": (30.44, 4, 3),
+    "annual": (365.25, 15, 2),
+}
+# Payments within this fraction of each other count as the same amount
+AMOUNT_TOLERANCE = float(os.getenv("RECURRING_AMOUNT_TOLERANCE", 0.15))
+# Share of gaps (and amounts) that must fit the cadence; allows the odd
+# skipped or doubled payment
+REGULARITY = 0.75
+# Days of the month within this many days of each other are one schedule
+PHASE_DAYS = 3
+# A series whose payment is this many days overdue is treated as lapsed
+LAPSED_AFTER_DAYS = 7
+
+CONSUMER = "recurring"
+# Transaction changes that can add payments to a group or move them between groups
+SERIES_EVENTS = {"ingest", "import", "merchants", "archive_load"}
+SERIES_COLUMNS = ["series_key", "cadence", "interval_days", "typical_amount", "occurrences", "first_date",
+                  "last_date", "next_expected", "anchor_day", "direct_debit_id", "direct_debit_status"]
+
+
+#---------- DETECTION ----------#
+
+def add_months(day, months, anchor_day=None):
+    """Same day of the month (anchor_day, or day's own) months later, clamped to the month's length."""
+    month_index = day.month - 1 + months
+    year, month = day.year + month_index // 12, month_index % 12 + 1
+    return date(year, month, min(anchor_day or day.day, calendar.monthrange(year, month)[1]))
+
+
+def next_payment_date(day, cadence, anchor_day=None):
+    """The payment after one made on day."""
+    if cadence == "monthly":
+        return add_months(day, 1, anchor_day)
+    if cadence == "annual":
+        return add_months(day, 12, anchor_day)
+    return day + timedelta(days=CADENCES[cadence][0])
+
+
+def _amount_clusters(payments):
+    """Split (date, amount) payments into runs of similar amounts."""
+    clusters = []
+    for payment in sorted(payments, key=lambda p: p[1]):
+        if clusters and payment[1] <= clusters[-1][-1][1] * (1 + AMOUNT_TOLERANCE) + 0.01:
+            clusters[-1].append(payment)
+        else:
+            clusters.append([payment])
+    return clusters
+
+
+def _day_of_month_phases(payments):
+    """Split payments into groups paid around the same day of the month."""
+    phases = []
+    for payment in sorted(payments, key=lambda p: p[0].day):
+        if phases and payment[0].day - phases[-1][-1][0].day <= PHASE_DAYS:
+            phases[-1].append(payment)
+        else:
+            phases.append([payment])
+    return phases
+
+
+def _fit_cadence(payments, cadences=CADENCES):
+    """
+    The cadence the payment dates follow, if any.
+
+    Returns:
+        tuple: (cadence, median gap in days), or None
+    """
+    dates = sorted({day for day, _ in payments})
+    gaps = [(later - earlier).days for earlier, later in zip(dates, dates[1:])]
+    if not gaps:
+        return None
+
+    amounts = [amount for _, amount in payments]
+    typical = statistics.median(amounts)
+    steady = sum(abs(amount - typical) <= max(typical * AMOUNT_TOLERANCE, 0.01) for amount in amounts)
+    if steady / len(amounts) < REGULARITY:
+        return None
+
+    median_gap = statistics.median(gaps)
+    for cadence, (period, tolerance, minimum) in cadences.items():
+        if len(dates) < minimum or abs(median_gap - period) > tolerance:
+            continue
+        regular = sum(abs(gap - period) <= tolerance for gap in gaps)
+        if regular / len(gaps) >= REGULARITY:
+            return cadence, median_gap
+    return None
+
+
+def _describe_series(payments, cadence, median_gap):
+    dates = sorted(day for day, _ in payments)
+    typical = round(statistics.median(amount for _, amount in payments), 2)
+    if cadence in ("monthly", "annual"):
+        # The usual day, so a payment pushed past a weekend doesn't move the forecast
+        anchor_day = statistics.median_low(day.day for day in dates)
+        anchor = dates[-1].strftime("%m-") + f"{anchor_day:02d}" if cadence == "annual" else str(anchor_day)
+    else:
+        anchor_day, anchor = None, dates[-1].strftime("%a")
+    return {
+        "series_key": f"{cadence}:{typical:.2f}:{anchor}",
+        "cadence": cadence,
+        "interval_days": float(median_gap),
+        "typical_amount": -typical,
+        "occurrences": len(dates),
+        "first_date": dates[0],
+        "last_date": dates[-1],
+        "next_expected": next_payment_date(dates[-1], cadence, anchor_day),
+        "anchor_day": anchor_day,
+        "direct_debit_id": None,
+        "direct_debit_status": None,
+    }
+
+
+def detect_series(payments):
+    """
+    Recurring series in one merchant's payments.
+
+    Args:
+        payments (list): (date, amount) tuples, amounts as positive values
+
+    Returns:
+        list: One dict per series (columns as in recurring_series, amounts signed)
+    """
+    series = []
+    for cluster in _amount_clusters(payments):
+        fit = _fit_cadence(cluster)
+        if fit:
+            series.append(_describe_series(cluster, *fit))
+            continue
+        # Several payments a month on fixed days: each day is its own schedule
+        phases = _day_of_month_phases(cluster)
+        if len(phases) > 1:
+            for phase in phases:
+                fit = _fit_cadence(phase, {"monthly": CADENCES["monthly"]})
+                if fit:
+                    series.append(_describe_series(phase, *fit))
+    return series
+
+
+def merge_direct_debits(series, direct_debits):
+    """
+    Attach a group's direct debit mandates to its detected series.
+
+    A mandate takes the unmatched series closest to its last payment amount
+    (within AMOUNT_TOLERANCE); one with no match becomes a monthly series
+    from its last payment. Updates series in place.
+    """
+    for direct_debit in direct_debits:
+        amount, paid_on = direct_debit["previous_payment_amount"], direct_debit["previous_payment_date"]
+        candidates = [
+            s for s in series if s["direct_debit_id"] is None
+            and (amount is None or abs(s["typical_amount"] - amount) <= max(abs(amount) * AMOUNT_TOLERANCE, 1.0))
+        ]
+        if candidates:
+            match = min(candidates, key=lambda s: abs(s["typical_amount"] - (amount or 0)))
+            if paid_on and paid_on > match["last_date"]:
+                # The bank has seen a payment our transactions haven't caught up with
+                match["last_date"] = paid_on
+                match["next_expected"] = next_payment_date(paid_on, match["cadence"], match["anchor_day"])
+        elif paid_on:
+            match = {
+                "series_key": f"direct_debit:{direct_debit['direct_debit_id']}",
+                "cadence": "monthly",
+                "interval_days": None,
+                "typical_amount": amount,
+                "occurrences": 0,
+                "first_date": None,
+                "last_date": paid_on,
+                "next_expected": add_months(paid_on, 1),
+                "anchor_day": paid_on.day,
+            }
+            series.append(match)
+        else:
+            continue
+        match["direct_debit_id"] = direct_debit["direct_debit_id"]
+        match["direct_debit_status"] = direct_debit["status"]
+
+
+#---------- STORAGE ----------#
+
+def _as_date(value):
+    return date.fromisoformat(str(value)[:10]) if value else None
+
+
+def _as_day(value):
+    # Via a DataFrame a missing day is NaN (which is truthy) and a stored one a float
+    return int(value) if value and value == value else None
+
+
+def sync_direct_debits(conn, access_token, account_ids=None):
+    """
+    Store the banks' current direct debit mandates.
+
+    Args:
+        account_ids (list): Accounts to fetch (default: those in accounts.json)
+
+    Returns:
+        set: (account_id, merchant_name) groups whose mandates were added, changed or removed
+    """
+    fetched = fetching_all_direct_debits(access_token, account_ids)
+    if fetched is None:
+        return set()
+
+    mandates = [(account_id, mandate) for account_id, results in fetched.items() for mandate in results]
+    merchants = normalise_merchants(mandate.get("name") for _, mandate in mandates)
+    rows = {}
+    for (account_id, mandate), merchant_name in zip(mandates, merchants):
+        if not merchant_name:
+            continue
+        amount = mandate.get("previous_payment_amount")
+        rows[mandate["direct_debit_id"]] = (
+            account_id,
+            mandate.get("name"),
+            merchant_name,
+            (mandate.get("status") or "").lower() or None,
+            str(mandate["previous_payment_timestamp"])[:10] if mandate.get("previous_payment_timestamp") else None,
+            -abs(float(amount)) if amount is not None else None,
+        )
+
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT direct_debit_id, account_id, name, merchant_name, status, previous_payment_date,
+               previous_payment_amount
+        FROM finance_sandbox.direct_debits
+        WHERE account_id IN ({})
+    """.format(", ".join(["%s"] * len(fetched)) or "NULL"), tuple(fetched))
+    stored = {
+        row[0]: (row[1], row[2], row[3], row[4], str(row[5])[:10] if row[5] else None,
+                 float(row[6]) if row[6] is not None else None)
+        for row in cursor.fetchall()
+    }
+
+    changed = {key: row for key, row in rows.items() if stored.get(key) != row}
+    removed = [key for key in stored if key not in rows]
+    if changed:
+        cursor.executemany("""
+            INSERT INTO finance_sandbox.direct_debits
+            (direct_debit_id, account_id, name, merchant_name, status, previous_payment_date, previous_payment_amount)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (direct_debit_id) DO UPDATE
+            SET account_id = excluded.account_id, name = excluded.name, merchant_name = excluded.merchant_name,
+                status = excluded.status, previous_payment_date = excluded.previous_payment_date,
+                previous_payment_amount = excluded.previous_payment_amount, updated_at = CURRENT_TIMESTAMP
+        """, [(key, *row) for key, row in changed.items()])
+    if removed:
+        cursor.executemany("DELETE FROM finance_sandbox.direct_debits WHERE direct_debit_id = %s",
+                           [(key,) for key in removed])
+    cursor.close()
+
+    touched = {(row[0], row[2]) for row in changed.values()}
+    touched.update((stored[key][0], stored[key][2]) for key in [*changed, *removed] if key in stored)
+    return touched
+
+
+def _load_direct_debits(cursor):
+    """Stored mandates grouped by (account_id, merchant_name)."""
+    cursor.execute("""
+        SELECT account_id, merchant_name, direct_debit_id, status, previous_payment_date, previous_payment_amount
+        FROM finance_sandbox.direct_debits
+    """)
+    grouped = {}
+    for account_id, merchant_name, direct_debit_id, status, paid_on, amount in cursor.fetchall():
+        grouped.setdefault((account_id, merchant_name), []).append({
+            "direct_debit_id": direct_debit_id,
+            "status": status,
+            "previous_payment_date": _as_date(paid_on),
+            "previous_payment_amount": float(amount) if amount is not None else None,
+        })
+    return grouped
+
+
+def _changed_groups(cursor, changes):
+    """(account_id, merchant_name) groups with outgoing payments in the changes' date ranges."""
+    windows = {}
+    for change in changes:
+        if change["event"] not in SERIES_EVENTS:
+            continue
+        window = (change["date_from"] or "0001-01-01", change["date_to"] or "9999-12-31")
+        accounts = windows.setdefault(window, set())
+        # An event without accounts can touch any of them
+        accounts.update(change["accounts"] or [None])
+
+    groups = set()
+    for (date_from, date_to), accounts in windows.items():
+        cursor.execute("""
+            SELECT DISTINCT account_id, merchant_name
+            FROM finance_sandbox.transactions
+            WHERE transaction_date BETWEEN %s AND %s AND amount < 0 AND merchant_name IS NOT NULL
+        """, (date_from, date_to))
+        groups.update(row for row in cursor.fetchall() if None in accounts or row[0] in accounts)
+    return groups
+
+
+def _load_payments(cursor, groups=None, batch_size=500):
+    """
+    Outgoing payments per (account_id, merchant_name).
+
+    Args:
+        groups (set): Only these groups (None: every group)
+
+    Returns:
+        dict: group -> list of (date, positive amount)
+    """
+    query = """
+        SELECT account_id, merchant_name, transaction_date, amount
+        FROM finance_sandbox.transactions
+        WHERE amount < 0 AND merchant_name IS NOT NULL {}
+    """
+    if groups is None:
+        batches = [("", ())]
+    else:
+        # The (merchant_name, transaction_date) index serves each batch
+        merchants = sorted({merchant for _, merchant in groups})
+        batches = [
+            ("AND merchant_name IN ({})".format(", ".join(["%s"] * len(batch))), tuple(batch))
+            for batch in (merchants[i:i + batch_size] for i in range(0, len(merchants), batch_size))
+        ]
+
+    payments = {}
+    for condition, params in batches:
+        cursor.execute(query.format(condition), params)
+        for account_id, merchant_name, transaction_date, amount in cursor.fetchall():
+            group = (account_id, merchant_name)
+            if groups is None or group in groups:
+                payments.setdefault(group, []).append((_as_date(transaction_date), -float(amount)))
+    return payments
+
+
+def _redetect(conn, groups=None):
+    """
+    Replace the stored series of groups (None: every group) with fresh detections.
+
+    Returns:
+        tuple: (groups re-detected, series written); the caller commits
+    """
+    cursor = conn.cursor()
+    payments = _load_payments(cursor, groups)
+    direct_debits = _load_direct_debits(cursor)
+    if groups is None:
+        groups = set(payments) | set(direct_debits)
+        cursor.execute("DELETE FROM finance_sandbox.recurring_series")
+    else:
+        cursor.executemany("DELETE FROM finance_sandbox.recurring_series WHERE account_id = %s AND merchant_name = %s",
+                           list(groups))
+
+    rows = []
+    for group in groups:
+        series = detect_series(payments.get(group, []))
+        merge_direct_debits(series, direct_debits.get(group, []))
+        rows.extend(
+            (*group, *[s[column].isoformat() if isinstance(s[column], date) else s[column]
+                       for column in SERIES_COLUMNS])
+            for s in series
+        )
+    cursor.executemany(f"""
+        INSERT INTO finance_sandbox.recurring_series
+        (account_id, merchant_name, {', '.join(SERIES_COLUMNS)})
+        VALUES ({', '.join(['%s'] * (len(SERIES_COLUMNS) + 2))})
+    """, rows)
+    publish_change(conn, "recurring_series", "detect", {group[0] for group in groups}, None, None, len(rows))
+    cursor.close()
+    return len(groups), len(rows)
+
+
+def refresh_direct_debits(access_token, account_ids=None):
+    """
+    Sync direct debit mandates and re-detect the groups whose mandates changed.
+
+    Only touches the given accounts' groups, so one user's sync can run
+    alongside another's.
+
+    Returns:
+        int: Groups re-detected
+    """
+    conn = get_connection()
+    try:
+        touched = sync_direct_debits(conn, access_token, account_ids)
+        redetected = _redetect(conn, touched)[0] if touched else 0
+        conn.commit()
+    finally:
+        conn.close()
+    return redetected
+
+
+def update_recurring_payments(access_token=None, full=False):
+    """
+    Re-detect recurring series for every group that received new rows.
+
+    The first run (or full=True) detects every group. Series rows, the
+    consumer watermark and the change event commit together, so an
+    interrupted run is simply repeated.
+
+    Args:
+        access_token (str): TrueLayer token; when given, direct debit mandates are refreshed first
+        full (bool): Re-detect every group, not just changed ones
+
+    Returns:
+        int: Groups re-detected
+    """
+    if access_token:
+        refresh_direct_debits(access_token)
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        changes, last_horizon, horizon = get_unconsumed_changes(conn, CONSUMER, "transactions")
+        groups = None
+        if not full and last_horizon:
+            groups = _changed_groups(cursor, changes)
+        if groups is None or groups:
+            redetected, written = _redetect(conn, groups)
+        else:
+            redetected = written = 0
+        if changes:
+            mark_changes_consumed(conn, CONSUMER, horizon)
+        conn.commit()
+    finally:
+        conn.close()
+
+    print(f"Recurring payments: {written} series across {redetected} re-detected merchants")
+    return redetected
+
+
+def forecast_payments(series_rows, start, end):
+    """
+    Expected payments between start and end from recurring_series rows.
+
+    Series are rolled forward by their cadence, so a weekly payment appears
+    once per week. A payment expected before start but not yet lapsed is
+    listed on its expected date.
+
+    Args:
+        series_rows (list): dicts with merchant_name, cadence, typical_amount, next_expected
+            and anchor_day (None on rows detected before it was stored)
+        start (date): First day of the forecast
+        end (date): Last day of the forecast
+
+    Returns:
+        list: (due_date, merchant_name, typical_amount, cadence) tuples, earliest first
+    """
+    lapsed_before = start - timedelta(days=LAPSED_AFTER_DAYS)
+    forecast = []
+    for row in series_rows:
+        due = _as_date(row["next_expected"])
+        if due is None or due < lapsed_before:
+            continue
+        # The observed payment day, not due's own, which may be clamped to a short month
+        anchor_day = (_as_day(row.get("anchor_day")) or due.day) if row["cadence"] in ("monthly", "annual") else None
+        while due <= end:
+            forecast.append((due, row["merchant_name"], row["typical_amount"], row["cadence"]))
+            due = next_payment_date(due, row["cadence"], anchor_day)
+    return sorted(forecast, key=lambda payment: payment[0])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detect recurring payments and forecast upcoming ones")
+    parser.add_argument("command", choices=["detect", "show", "upcoming"])
+    parser.add_argument("--full", action="store_true", help="detect: re-detect every merchant")
+    parser.add_argument("--days", type=int, default=30, help="upcoming: days ahead")
+    args = parser.parse_args()
+
+    if args.command == "detect":
+        update_recurring_payments(full=args.full)
+    else:
+        from db_queries import get_recurring_payments, get_upcoming_payments
+        if args.command == "show":
+            print(get_recurring_payments().to_string(index=False))
+        else:
+            print(get_upcoming_payments(args.days).to_string(index=False))
@@ -0,0 +1,954 @@
+import csv
+import io
+import os
+import queue
+import re
+import sqlite3
+import threading
+import uuid
+from datetime import date, timedelta
+from functools import lru_cache
+
+from lazy_imports import psycopg2, psycopg2_extras
+
+
+class ConnectionPool:
+    """
+    Blocking, thread-safe connection pool.
+
+    Opens up to maxconn connections lazily and makes callers wait (up to
+    timeout seconds) when all of them are checked out, rather than failing.
+    """
+
+    def __init__(self, connect, minconn=1, maxconn=10, timeout=30):
+        self._connect = connect
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self.maxconn = maxconn
+        self.timeout = timeout
+        for _ in range(minconn):
+            self._idle.put(self._open())
+
+    def _open(self):
+        with self._lock:
+            self._opened += 1
+        try:
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._opened -= 1
+            raise
+
+    def getconn(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._opened < self.maxconn
+            conn = self._open() if can_open else self._idle.get(timeout=self.timeout)
+        if conn.closed:
+            with self._lock:
+                self._opened -= 1
+            return self.getconn()
+        return conn
+
+    def putconn(self, conn):
+        if conn.closed:
+            with self._lock:
+                self._opened -= 1
+            return
+        self._idle.put(conn)
+
+
+class StorageBackend:
+    """
+    Interface every storage backend implements.
+
+    All SQL in db_queries/db_operations is written once in psycopg2 style
+    (%s placeholders, finance_sandbox.<table>); backends make that SQL run.
+    """
+
+    name = None
+    # change_log column that orders changes by commit, and the SQL for the
+    # horizon below which every change has committed (see change_events.change_horizon)
+    CHANGE_ORDER = None
+    CHANGE_HORIZON = None
+
+    @property
+    def errors(self):
+        """Exception types to catch instead of psycopg2.Error, so callers work on either backend."""
+        return (sqlite3.Error,)
+
+    def connect(self):
+        """Return a new DB-API connection."""
+        raise NotImplementedError
+
+    def schema_statements(self):
+        """DDL statements that create every table and index."""
+        raise NotImplementedError
+
+    def create_pool(self, minconn, maxconn):
+        return ConnectionPool(self.connect, minconn, maxconn)
+
+    def migrate(self, conn):
+        """
+        Add columns introduced after a table was created (no-op where the DDL does it).
+
+        Runs before schema_statements(), so indexes can use the new columns.
+        """
+
+    def rebuild_search_index(self, conn):
+        """Re-index existing rows for full-text search (no-op where the index maintains itself)."""
+
+    def stream_cursor(self, conn, itersize):
+        """
+        Cursor that fetches rows from the server in batches of itersize
+        instead of materialising the whole result set on execute().
+        """
+        return conn.cursor()
+
+    def insert_rows(self, cursor, table, columns, rows, conflict_columns=None):
+        """
+        Insert many rows in as few round trips as the backend allows.
+
+        Args:
+            cursor: Open cursor
+            table (str): Table name, e.g. "finance_sandbox.transactions"
+            columns (list): Column names, in row order
+            rows (list): Tuples of values
+            conflict_columns (list): If given, skip rows that clash on these (ON CONFLICT DO NOTHING)
+        """
+        cursor.executemany(self._insert_sql(table, columns, "(" + ", ".join(["%s"] * len(columns)) + ")",
+                                            conflict_columns), rows)
+
+    def bulk_load(self, cursor, table, columns, rows, conflict_columns=None):
+        """
+        Fastest available path for loading a large batch of rows.
+
+        Returns:
+            int: Rows actually inserted (duplicates skipped by ON CONFLICT excluded)
+        """
+        self.insert_rows(cursor, table, columns, rows, conflict_columns)
+        return cursor.rowcount
+
+    @staticmethod
+    def _insert_sql(table, columns, values, conflict_columns):
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES {values}"
+        if conflict_columns:
+            sql += f" ON CONFLICT ({', '.join(conflict_columns)}) DO NOTHING"
+        return sql
+
+
+class PostgresBackend(StorageBackend):
+    name = "postgres"
+    CHANGE_ORDER = "xact_id"
+    # Every transaction below the oldest one still running has finished
+    CHANGE_HORIZON = "pg_snapshot_xmin(pg_current_snapshot())::text::bigint"
+
+    def __init__(self, dsn=None):
+        # A libpq connection string or URL; without one, the DB_* variables
+        self.dsn = dsn or os.getenv("DB_DSN")
+
+    @property
+    def errors(self):
+        return (psycopg2.Error, sqlite3.Error)
+
+    def connect(self):
+        if self.dsn:
+            return psycopg2.connect(self.dsn)
+        return psycopg2.connect(
+            host=os.getenv("DB_HOST"),
+            port=os.getenv("DB_PORT"),
+            database=os.getenv("DB_NAME"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD")
+        )
+
+    def stream_cursor(self, conn, itersize):
+        # A named cursor is a server-side cursor; rows arrive itersize at a time
+        cursor = conn.cursor(name=f"stream_{uuid.uuid4().hex[:16]}")
+        cursor.itersize = itersize
+        return cursor
+
+    def insert_rows(self, cursor, table, columns, rows, conflict_columns=None):
+        # execute_values sends page_size rows per statement instead of one per row
+        psycopg2_extras.execute_values(cursor, self._insert_sql(table, columns, "%s", conflict_columns), rows, page_size=1000)
+
+    def bulk_load(self, cursor, table, columns, rows, conflict_columns=None):
+        # COPY into a session-local staging table, then one set-based INSERT ... SELECT
+        # that applies ON CONFLICT dedupe. Much faster than row-at-a-time INSERTs.
+        staging = f"staging_{table.split('.')[-1]}"
+        column_list = ", ".join(columns)
+        cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {table} INCLUDING DEFAULTS)")
+        cursor.execute(f"TRUNCATE {staging}")
+
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+        sql = f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {staging}"
+        if conflict_columns:
+            sql += f" ON CONFLICT ({', '.join(conflict_columns)}) DO NOTHING"
+        cursor.execute(sql)
+        return cursor.rowcount
+
+    def schema_statements(self):
+        return [
+            "CREATE SCHEMA IF NOT EXISTS finance_sandbox",
+            """
+            CREATE TABLE IF NOT EXISTS finance_sandbox.transactions (
+                transaction_id TEXT PRIMARY KEY,
+                account_id TEXT,
+                amount NUMERIC(12, 2),
+                currency TEXT,
+                description TEXT,
+                transaction_date DATE,
+                timestamp TIMESTAMPTZ,
+                transaction_type TEXT,
+                category TEXT,
+                merchant_name TEXT
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS finance_sandbox.balance_history (
+                account_id TEXT NOT NULL,
+                current_balance NUMERIC(12, 2),
+                available_balance NUMERIC(12, 2),
+                overdraft_limit NUMERIC(12, 2),
+                snapshot_date DATE NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (account_id, snapshot_date)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS finance_sandbox.api_costs (
+                id BIGSERIAL PRIMARY KEY,
+                provider TEXT,
+                project TEXT,
+                model TEXT NOT NULL,
+                input_tokens INTEGER,
+                output_tokens INTEGER,
+                total_tokens INTEGER,
+                cost NUMERIC(12, 6),
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS finance_sandbox.change_log (
+                id BIGSERIAL PRIMARY KEY,
+                table_name TEXT NOT NULL,
+                event TEXT NOT NULL,
+                account_ids TEXT,
+                date_from DATE,
+                date_to DATE,
+                row_count INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS change_log_table_id_idx
+            ON finance_sandbox.change_log (table_name, id)
+            """,
+            # The writing transaction's id. ids are handed out at INSERT, so a lower
+            # id can commit after a higher one; readers order changes by xact_id
+            # instead and stop below the oldest transaction still running (CHANGE_HORIZON)
+            """
+            ALTER TABLE finance_sandbox.change_log
+            ADD COLUMN IF NOT EXISTS xact_id BIGINT DEFAULT (pg_current_xact_id()::text::bigint)
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS change_log_table_xact_idx
+            ON finance_sandbox.change_log (table_name, xact_id)
+            """,
+            # Keyset pagination: one index per explorer sort key / filter prefix
+            """
+            CREATE INDEX IF NOT EXISTS transactions_date_id_idx
+            ON finance_sandbox.transactions (transaction_date, transaction_id)
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS transactions_amount_id_idx
+            ON finance_sandbox.transactions (amount, transaction_id)
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS transactions_account_date_id_idx
+            ON finance_sandbox.transactions (account_id, transaction_date, transaction_id)
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS transactions_category_date_id_idx
+            ON finance_sandbox.transactions (category, transaction_date, transaction_id)
+            """,
+            # Per-merchant aggregates and recurring-payment lookups
+            """
+            CREATE INDEX IF NOT EXISTS transactions_merchant_date_idx
+            ON finance_sandbox.transactions (merchant_name, transaction_date)
+            """,
+            # Which prompt/category list version and model produced each label
+            """
+            ALTER TABLE finance_sandbox.transactions
+            ADD COLUMN IF NOT EXISTS category_version TEXT,
+            ADD COLUMN IF NOT EXISTS category_model TEXT,
+            ADD COLUMN IF NOT EXISTS anomaly_score REAL
+            """,
+            # Uniform random key per row: sampling seeks into the (category, sample_key)
+            # index from a random start instead of sorting the table by random().
+            # The volatile default also fills existing rows when the column is added.
+            """
+            ALTER TABLE finance_sandbox.transactions
+            ADD COLUMN IF NOT EXISTS sample_key DOUBLE PRECISION DEFAULT random()
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS transactions_category_sample_idx
+            ON finance_sandbox.transactions (category, sample_key)
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS finance_sandbox.category_jobs (
+                id BIGSERIAL PRIMARY KEY,
+                category_version TEXT NOT NULL,
+                model TEXT,
+                status TEXT NOT NULL,
+                checkpoint TEXT NOT NULL DEFAULT '',
+                rows_done INTEGER NOT NULL DEFAULT 0,
+                rows_total INTEGER,
+                elapsed_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+                error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            # At most one unfinished job per version, so concurrent runners can't create two
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS category_jobs_open_version_idx
+            ON finance_sandbox.category_jobs (category_version) WHERE status <> 'done'
+            """,
+            # Running per-(account, category, merchant) statistics for anomaly scoring
+            """
+            CREATE TABLE IF NOT EXISTS finance_sandbox.anomaly_stats (
+                account_id TEXT NOT NULL,
+                category TEXT NOT NULL,
+                merchant_name TEXT NOT NULL,
+                n INTEGER NOT NULL,
+                mean DOUBLE PRECISION NOT NULL,
+                m2 DOUBLE PRECISION NOT NULL,
+                sketch TEXT NOT NULL,
+                PRIMARY KEY (account_id, category, merchant_name)
+            )
+            """,
+            # Recurring payments detected per (account, merchant), plus bank direct debits
+            """
+            CREATE TABLE IF NOT EXISTS finance_sandbox.recurring_series (
+                account_id TEXT NOT NULL,
+                merchant_name TEXT NOT NULL,
+                series_key TEXT NOT NULL,
+                cadence TEXT NOT NULL,
+                interval_days REAL,
+                typical_amount NUMERIC(12, 2),
+                occurrences INTEGER NOT NULL DEFAULT 0,
+                first_date DATE,
+                last_date DATE,
+                next_expected DATE,
+                direct_debit_id TEXT,
+                direct_debit_status TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (account_id, merchant_name, series_key)
+            )
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS recurring_series_next_expected_idx
+            ON finance_sandbox.recurring_series (next_expected)
+            """,
+            # Usual day of the month of monthly and annual series, which next_expected
+            # loses when it is clamped to a short month
+            """
+            ALTER TABLE finance_sandbox.recurring_series
+            ADD COLUMN IF NOT EXISTS anchor_day INTEGER
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS finance_sandbox.direct_debits (
+                direct_debit_id TEXT PRIMARY KEY,
+                account_id TEXT NOT NULL,
+                name TEXT,
+                merchant_name TEXT,
+                status TEXT,
+                previous_payment_date DATE,
+                previous_payment_amount NUMERIC(12, 2),
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            # Linked users: TrueLayer tokens, their accounts, and per-user sync jobs
+            """
+            CREATE TABLE IF NOT EXISTS finance_sandbox.users (
+                user_id TEXT PRIMARY KEY,
+                access_token TEXT,
+                refresh_token TEXT,
+                expires_at DOUBLE PRECISION,
+                active BOOLEAN NOT NULL DEFAULT TRUE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS finance_sandbox.user_accounts (
+                account_id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                display_name TEXT,
+                account_type TEXT,
+                currency TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS user_accounts_user_idx
+            ON finance_sandbox.user_accounts (user_id)
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS finance_sandbox.sync_jobs (
+                id BIGSERIAL PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stage TEXT,
+                error TEXT,
+                queued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS sync_jobs_user_id_idx
+            ON finance_sandbox.sync_jobs (user_id, id)
+            """,
+            # At most one unfinished job per user, so overlapping cycles can't queue two
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS sync_jobs_open_user_idx
+            ON finance_sandbox.sync_jobs (user_id) WHERE status IN ('queued', 'running')
+            """,
+            # Outgoing spend per day and category, maintained by trends.refresh_daily_spending
+            """
+            CREATE TABLE IF NOT EXISTS finance_sandbox.daily_spending (
+                spend_date DATE NOT NULL,
+                category TEXT NOT NULL,
+                spending NUMERIC(14, 2) NOT NULL,
+                transactions INTEGER NOT NULL,
+                PRIMARY KEY (spend_date, category)
+            )
+            """,
+            # How far each incremental consumer has read change_log: the change_horizon()
+            # it last consumed up to (exclusive)
+            """
+            CREATE TABLE IF NOT EXISTS finance_sandbox.change_consumers (
+                consumer TEXT PRIMARY KEY,
+                last_change_id BIGINT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS transactions_anomaly_score_idx
+            ON finance_sandbox.transactions (anomaly_score)
+            WHERE anomaly_score IS NOT NULL
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS transactions_unscored_idx
+            ON finance_sandbox.transactions (transaction_date, transaction_id)
+            WHERE anomaly_score IS NULL
+            """,
+            # Full-text search: tsvector for word/prefix matches, trigrams for fuzzy ones
+            "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+            """
+            ALTER TABLE finance_sandbox.transactions
+            ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS (
+                to_tsvector('simple', coalesce(description, '') || ' ' || coalesce(merchant_name, ''))
+            ) STORED
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS transactions_search_vector_idx
+            ON finance_sandbox.transactions USING GIN (search_vector)
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS transactions_search_trgm_idx
+            ON finance_sandbox.transactions
+            USING GIN ((coalesce(description, '') || ' ' || coalesce(merchant_name, '')) gin_trgm_ops)
+            """,
+        ]
+
+
+#---------- SQLITE ----------#
+
+_SCHEMA_PREFIX = re.compile(r"\bfinance_sandbox\.")
+
+
+@lru_cache(maxsize=512)
+def translate_sql(sql):
+    """
+    Rewrite psycopg2-style SQL for sqlite3.
+
+    Strips the finance_sandbox schema prefix and swaps %s placeholders for ?.
+    Cached so the same SQL string object is handed to sqlite3 every time,
+    which lets its statement cache reuse the prepared statement.
+    """
+    sql = _SCHEMA_PREFIX.sub("", sql)
+    return sql.replace("%s", "?").replace("%%", "%")
+
+
+def _to_char(value, fmt):
+    """Subset of Postgres TO_CHAR for dates: YYYY, MM and DD tokens."""
+    if value is None:
+        return None
+    text = str(value)
+    return fmt.replace("YYYY", text[0:4]).replace("MM", text[5:7]).replace("DD", text[8:10])
+
+
+def _date_trunc(unit, value):
+    """Postgres DATE_TRUNC for day/week/month/year, returning YYYY-MM-DD."""
+    if value is None:
+        return None
+    day = date.fromisoformat(str(value)[:10])
+    unit = unit.lower()
+    if unit == "year":
+        day = day.replace(month=1, day=1)
+    elif unit == "month":
+        day = day.replace(day=1)
+    elif unit == "week":
+        day = day - timedelta(days=day.weekday())
+    return day.isoformat()
+
+
+class SQLiteCursor:
+    """Cursor wrapper that accepts psycopg2-style SQL."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(translate_sql(sql), params)
+
+    def executemany(self, sql, seq_of_params):
+        self._cursor.executemany(translate_sql(sql), seq_of_params)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size=None):
+        return self._cursor.fetchmany(size or self._cursor.arraysize)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def close(self):
+        self._cursor.close()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+
+class SQLiteConnection:
+    """sqlite3 connection with the parts of the psycopg2 connection API we use."""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.closed = 0
+
+    def cursor(self):
+        return SQLiteCursor(self._conn.cursor())
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+        self.closed = 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Match psycopg2: commit or roll back, but leave the connection open
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Embedded backend for single-user deployments, tests and benchmarks.
+
+    Tuned for a read-heavy dashboard with a nightly writer: WAL so readers
+    never block on the writer, mmap'd reads, a large page cache and a
+    per-connection prepared statement cache. TO_CHAR, DATE_TRUNC and
+    pg_notify are registered so the Postgres SQL runs unchanged.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv("SQLITE_PATH", "spending.db")
+
+    def connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=30,
+            check_same_thread=False,  # pooled connections move between threads
+            cached_statements=256,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={int(os.getenv('SQLITE_MMAP_SIZE', 268435456))}")
+        conn.execute("PRAGMA cache_size=-65536")  # 64 MB
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.create_function("TO_CHAR", 2, _to_char, deterministic=True)
+        conn.create_function("DATE_TRUNC", 2, _date_trunc, deterministic=True)
+        # Dashboards poll change_log on SQLite, so notifications are a no-op
+        conn.create_function("pg_notify", 2, lambda channel, payload: None)
+        return SQLiteConnection(conn)
+
+    def _transactions_table(self, name="transactions"):
+        # row_id is an explicit INTEGER PRIMARY KEY, i.e. an alias for the rowid
+        # the FTS5 tables key on: without one, VACUUM may renumber rowids and
+        # silently misalign the search indexes
+        return f"""
+            CREATE TABLE IF NOT EXISTS {name} (
+                row_id INTEGER PRIMARY KEY,
+                transaction_id TEXT UNIQUE,
+                account_id TEXT,
+                amount REAL,
+                currency TEXT,
+                description TEXT,
+                transaction_date TEXT,
+                timestamp TEXT,
+                transaction_type TEXT,
+                category TEXT,
+                merchant_name TEXT,
+                category_version TEXT,
+                category_model TEXT,
+                anomaly_score REAL,
+                sample_key REAL DEFAULT ({self.SAMPLE_KEY})
+            )
+            """
+
+    def schema_statements(self):
+        return [
+            self._transactions_table(),
+            """
+            CREATE TABLE IF NOT EXISTS balance_history (
+                account_id TEXT NOT NULL,
+                current_balance REAL,
+                available_balance REAL,
+                overdraft_limit REAL,
+                snapshot_date TEXT NOT NULL,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (account_id, snapshot_date)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS api_costs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                provider TEXT,
+                project TEXT,
+                model TEXT NOT NULL,
+                input_tokens INTEGER,
+                output_tokens INTEGER,
+                total_tokens INTEGER,
+                cost REAL,
+                timestamp TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS change_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                table_name TEXT NOT NULL,
+                event TEXT NOT NULL,
+                account_ids TEXT,
+                date_from TEXT,
+                date_to TEXT,
+                row_count INTEGER,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS category_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                category_version TEXT NOT NULL,
+                model TEXT,
+                status TEXT NOT NULL,
+                checkpoint TEXT NOT NULL DEFAULT '',
+                rows_done INTEGER NOT NULL DEFAULT 0,
+                rows_total INTEGER,
+                elapsed_seconds REAL NOT NULL DEFAULT 0,
+                error TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS anomaly_stats (
+                account_id TEXT NOT NULL,
+                category TEXT NOT NULL,
+                merchant_name TEXT NOT NULL,
+                n INTEGER NOT NULL,
+                mean REAL NOT NULL,
+                m2 REAL NOT NULL,
+                sketch TEXT NOT NULL,
+                PRIMARY KEY (account_id, category, merchant_name)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS recurring_series (
+                account_id TEXT NOT NULL,
+                merchant_name TEXT NOT NULL,
+                series_key TEXT NOT NULL,
+                cadence TEXT NOT NULL,
+                interval_days REAL,
+                typical_amount REAL,
+                occurrences INTEGER NOT NULL DEFAULT 0,
+                first_date TEXT,
+                last_date TEXT,
+                next_expected TEXT,
+                anchor_day INTEGER,
+                direct_debit_id TEXT,
+                direct_debit_status TEXT,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (account_id, merchant_name, series_key)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS direct_debits (
+                direct_debit_id TEXT PRIMARY KEY,
+                account_id TEXT NOT NULL,
+                name TEXT,
+                merchant_name TEXT,
+                status TEXT,
+                previous_payment_date TEXT,
+                previous_payment_amount REAL,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                user_id TEXT PRIMARY KEY,
+                access_token TEXT,
+                refresh_token TEXT,
+                expires_at REAL,
+                active INTEGER NOT NULL DEFAULT 1,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS user_accounts (
+                account_id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                display_name TEXT,
+                account_type TEXT,
+                currency TEXT,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS sync_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stage TEXT,
+                error TEXT,
+                queued_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                started_at TEXT,
+                finished_at TEXT
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS daily_spending (
+                spend_date TEXT NOT NULL,
+                category TEXT NOT NULL,
+                spending REAL NOT NULL,
+                transactions INTEGER NOT NULL,
+                PRIMARY KEY (spend_date, category)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS change_consumers (
+                consumer TEXT PRIMARY KEY,
+                last_change_id INTEGER NOT NULL DEFAULT 0,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS change_log_table_id_idx ON change_log (table_name, id)",
+            "CREATE INDEX IF NOT EXISTS transactions_date_id_idx ON transactions (transaction_date, transaction_id)",
+            "CREATE INDEX IF NOT EXISTS transactions_amount_id_idx ON transactions (amount, transaction_id)",
+            "CREATE INDEX IF NOT EXISTS transactions_account_date_id_idx "
+            "ON transactions (account_id, transaction_date, transaction_id)",
+            "CREATE INDEX IF NOT EXISTS transactions_category_date_id_idx "
+            "ON transactions (category, transaction_date, transaction_id)",
+            "CREATE INDEX IF NOT EXISTS transactions_merchant_date_idx "
+            "ON transactions (merchant_name, transaction_date)",
+            "CREATE INDEX IF NOT EXISTS transactions_category_sample_idx ON transactions (category, sample_key)",
+            "CREATE INDEX IF NOT EXISTS transactions_anomaly_score_idx "
+            "ON transactions (anomaly_score) WHERE anomaly_score IS NOT NULL",
+            "CREATE INDEX IF NOT EXISTS transactions_unscored_idx "
+            "ON transactions (transaction_date, transaction_id) WHERE anomaly_score IS NULL",
+            "CREATE UNIQUE INDEX IF NOT EXISTS category_jobs_open_version_idx "
+            "ON category_jobs (category_version) WHERE status <> 'done'",
+            "CREATE INDEX IF NOT EXISTS recurring_series_next_expected_idx ON recurring_series (next_expected)",
+            "CREATE INDEX IF NOT EXISTS user_accounts_user_idx ON user_accounts (user_id)",
+            "CREATE INDEX IF NOT EXISTS sync_jobs_user_id_idx ON sync_jobs (user_id, id)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS sync_jobs_open_user_idx "
+            "ON sync_jobs (user_id) WHERE status IN ('queued', 'running')",
+            # Full-text search: an FTS5 word index with prefix indexes, plus a
+            # trigram index for fuzzy matching. Both are external-content tables
+            # over transactions kept in sync by triggers.
+            *[statement for fts_table, options in self.SEARCH_INDEXES.items()
+              for statement in self._search_index_statements(fts_table, options)],
+        ]
+
+    # SQLite has no ADD COLUMN IF NOT EXISTS; migrate() adds these to older databases
+    ADDED_COLUMNS = {
+        "transactions": [("category_version", "TEXT"), ("category_model", "TEXT"), ("anomaly_score", "REAL")],
+        "recurring_series": [("anchor_day", "INTEGER")],
+        "api_costs": [("provider", "TEXT"), ("project", "TEXT")],
+    }
+    # Writers are serialised by the database lock, so ids already commit in order
+    CHANGE_ORDER = "id"
+    CHANGE_HORIZON = "(SELECT COALESCE(MAX(id), 0) + 1 FROM change_log)"
+    # Uniform in [0, 1), as random() is on Postgres
+    SAMPLE_KEY = "abs(random()) / 9223372036854775808.0"
+
+    def migrate(self, conn):
+        cursor = conn.cursor()
+        for table, columns in self.ADDED_COLUMNS.items():
+            cursor.execute(f"PRAGMA table_info({table})")
+            existing = {row[1] for row in cursor.fetchall()}
+            if not existing:
+                continue  # created with every column by schema_statements()
+            for column, column_type in columns:
+                if column not in existing:
+                    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+        self._add_row_id(cursor)
+        conn.commit()
+
+    def _add_row_id(self, cursor):
+        """
+        Rebuild a transactions table created without row_id.
+
+        Rows keep their rowid as row_id, so the FTS5 indexes stay aligned;
+        sample_key is copied where it exists and drawn by its default where
+        not. The old table's indexes and triggers go with it and are
+        recreated by schema_statements().
+        """
+        cursor.execute("PRAGMA table_info(transactions)")
+        existing = [row[1] for row in cursor.fetchall()]
+        if not existing or "row_id" in existing:
+            return
+        cursor.execute("DROP TABLE IF EXISTS transactions_rebuild")
+        cursor.execute(self._transactions_table("transactions_rebuild"))
+        cursor.execute("PRAGMA table_info(transactions_rebuild)")
+        columns = [row[1] for row in cursor.fetchall() if row[1] in existing]
+        cursor.execute(f"""
+            INSERT INTO transactions_rebuild (row_id, {', '.join(columns)})
+            SELECT rowid, {', '.join(columns)} FROM transactions
+        """)
+        cursor.execute("DROP TABLE transactions")
+        cursor.execute("ALTER TABLE transactions_rebuild RENAME TO transactions")
+        print("Rebuilt transactions with an explicit row_id key")
+
+    SEARCH_INDEXES = {
+        "transactions_fts": "prefix='2 3', tokenize='unicode61 remove_diacritics 2'",
+        "transactions_trigram": "tokenize='trigram'",
+    }
+
+    @staticmethod
+    def _search_index_statements(fts_table, options):
+        return [
+            f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5(
+                description, merchant_name,
+                content='transactions', content_rowid='rowid', {options}
+            )
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_insert AFTER INSERT ON transactions BEGIN
+                INSERT INTO {fts_table}(rowid, description, merchant_name)
+                VALUES (new.rowid, new.description, new.merchant_name);
+            END
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_delete AFTER DELETE ON transactions BEGIN
+                INSERT INTO {fts_table}({fts_table}, rowid, description, merchant_name)
+                VALUES ('delete', old.rowid, old.description, old.merchant_name);
+            END
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_update
+            AFTER UPDATE OF description, merchant_name ON transactions BEGIN
+                INSERT INTO {fts_table}({fts_table}, rowid, description, merchant_name)
+                VALUES ('delete', old.rowid, old.description, old.merchant_name);
+                INSERT INTO {fts_table}(rowid, description, merchant_name)
+                VALUES (new.rowid, new.description, new.merchant_name);
+            END
+            """,
+        ]
+
+    def rebuild_search_index(self, conn):
+        """Re-index every existing row, e.g. after creating the index on an existing database."""
+        cursor = conn.cursor()
+        for fts_table in self.SEARCH_INDEXES:
+            cursor.execute(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')")
+        conn.commit()
+
+
+BACKENDS = {
+    "postgres": PostgresBackend,
+    "sqlite": SQLiteBackend,
+}
+
+_backend = None
+_read_backend = None
+
+
+def get_backend():
+    """Return the configured backend (STORAGE_BACKEND=postgres|sqlite)."""
+    global _backend
+    if _backend is None:
+        name = os.getenv("STORAGE_BACKEND", "postgres").lower()
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown STORAGE_BACKEND '{name}'. Options: {', '.join(BACKENDS)}")
+        _backend = BACKENDS[name]()
+    return _backend
+
+
+def get_read_backend():
+    """
+    Backend for dashboard reads: a replica of the primary if DB_READ_DSN is set.
+
+    DB_READ_DSN is a connection string for Postgres or a file path for
+    SQLite (e.g. a copy kept current by Litestream). Without it reads go to
+    the primary, get_backend().
+    """
+    global _read_backend
+    if _read_backend is None:
+        dsn = os.getenv("DB_READ_DSN")
+        _read_backend = type(get_backend())(dsn) if dsn else get_backend()
+    return _read_backend
+
+
+def set_backend(backend, read_backend=None):
+    """
+    Override the configured backend, e.g. SQLiteBackend("bench.db") in scripts.
+
+    Reads go to read_backend if given, otherwise to backend as well.
+    """
+    global _backend, _read_backend
+    _backend = backend
+    _read_backend = read_backend or backend
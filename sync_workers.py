@@ -0,0 +1,264 @@
+"""
+Multi-user sync: a coordinator that spreads users over a pool of worker processes.
+
+One cycle:
+
+1. Every active user without an unfinished job gets a queued sync_jobs row.
+2. Queued jobs are handed to SYNC_WORKERS processes in fair order: users
+   never synced or synced longest ago first, users whose last jobs failed
+   last. The pool takes one job at a time per worker, so a user with many
+   accounts can't hold up everyone else for more than one job, and no user
+   is ever synced by two workers at once.
+3. Each job is claimed atomically (queued -> running), so a job another
+   overlapping cycle already took is skipped. It runs the per-user,
+   API-bound stages (token refresh, accounts, transactions, direct debits,
+   balances, LLM categorisation of the user's accounts) with that user as
+   rate_limits.current_user, recording its stage in sync_jobs as it goes.
+4. Once the pool drains, the coordinator runs the shared stages once for
+   everyone's new rows (merchant names, anomaly scores, daily spending
+   aggregates, recurring payments).
+
+TrueLayer and LLM calls are limited per user and across the whole pool
+(see rate_limits). Each worker process uses its own database connections.
+
+Usage:
+    python sync_workers.py run                  # one cycle over every active user
+    python sync_workers.py run --workers 8
+    python sync_workers.py run --user alice     # just these users
+    python sync_workers.py status               # latest job per user
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+
+from anomalies import score_new_transactions
+from db import get_connection
+from db_operations import save_all_transactions_to_db, update_all_categories_batch, save_daily_balance_snapshot
+from merchants import backfill_merchant_names
+from rate_limits import current_user, install_buckets, shared_buckets
+from recurring import refresh_direct_debits, update_recurring_payments
+from tenants import get_user_access_token, list_users, refresh_user_accounts
+from trends import refresh_daily_spending
+
+SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", 4))
+# A running job not finished after this long is assumed to belong to a dead worker
+STALE_JOB_SECONDS = int(os.getenv("SYNC_STALE_JOB_SECONDS", 3600))
+
+JOB_COLUMNS = ["id", "user_id", "status", "stage", "error", "queued_at", "started_at", "finished_at"]
+
+
+#---------- JOBS ----------#
+
+def _set_job(conn, job_id, status, stage=None, error=None):
+    timestamps = {
+        "running": ", started_at = COALESCE(started_at, CURRENT_TIMESTAMP)",
+        "done": ", finished_at = CURRENT_TIMESTAMP",
+        "failed": ", finished_at = CURRENT_TIMESTAMP",
+    }
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        UPDATE finance_sandbox.sync_jobs
+        SET status = %s, stage = %s, error = %s {timestamps.get(status, "")}
+        WHERE id = %s
+    """, (status, stage, error, job_id))
+    conn.commit()
+
+
+def expire_stale_jobs(conn):
+    """Fail running jobs whose worker died, so their users can be queued again."""
+    cursor = conn.cursor()
+    # The database's clock, since that is what wrote started_at
+    cursor.execute("SELECT CURRENT_TIMESTAMP")
+    now = datetime.fromisoformat(str(cursor.fetchone()[0])[:19])
+    cursor.execute("""
+        UPDATE finance_sandbox.sync_jobs
+        SET status = 'failed', error = 'worker lost', finished_at = CURRENT_TIMESTAMP
+        WHERE status = 'running' AND started_at < %s
+    """, ((now - timedelta(seconds=STALE_JOB_SECONDS)).isoformat(sep=" "),))
+    expired = cursor.rowcount
+    conn.commit()
+    return expired
+
+
+def enqueue_jobs(conn, user_ids):
+    """
+    Queue a job for each user that has none queued or running.
+
+    Jobs queued by another coordinator that is still dispatching are listed
+    too; claim_job() makes sure only one worker runs each.
+
+    Returns:
+        list: (job_id, user_id) for every queued job, in fair dispatch order
+    """
+    cursor = conn.cursor()
+    # The partial unique index skips users with an unfinished job, even one
+    # queued by another coordinator a moment ago
+    cursor.executemany("""
+        INSERT INTO finance_sandbox.sync_jobs (user_id, status) VALUES (%s, 'queued')
+        ON CONFLICT (user_id) WHERE status IN ('queued', 'running') DO NOTHING
+    """, [(user_id,) for user_id in user_ids])
+
+    # Users who failed since their last success go to the back, then the
+    # least recently synced go first
+    cursor.execute("""
+        SELECT q.id, q.user_id
+        FROM finance_sandbox.sync_jobs q
+        LEFT JOIN (
+            SELECT user_id,
+                   MAX(CASE WHEN status = 'done' THEN finished_at END) AS last_success,
+                   MAX(CASE WHEN status = 'failed' THEN finished_at END) AS last_failure
+            FROM finance_sandbox.sync_jobs
+            GROUP BY user_id
+        ) h ON h.user_id = q.user_id
+        WHERE q.status = 'queued'
+        ORDER BY CASE WHEN h.last_failure > COALESCE(h.last_success, '1970-01-01') THEN 1 ELSE 0 END,
+                 COALESCE(h.last_success, '1970-01-01'), q.id
+    """)
+    wanted = set(user_ids)
+    jobs = [job for job in cursor.fetchall() if job[1] in wanted]
+    conn.commit()
+    return jobs
+
+
+def claim_job(conn, job_id):
+    """
+    Mark a queued job running unless another worker already took it.
+
+    Returns:
+        bool: True if this worker now owns the job
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE finance_sandbox.sync_jobs
+        SET status = 'running', stage = 'token', started_at = CURRENT_TIMESTAMP
+        WHERE id = %s AND status = 'queued'
+    """, (job_id,))
+    claimed = cursor.rowcount == 1
+    conn.commit()
+    return claimed
+
+
+def run_user_sync(job):
+    """
+    Worker: run one user's API-bound sync stages.
+
+    Args:
+        job (tuple): (job_id, user_id)
+
+    Returns:
+        tuple: (user_id, final status); "skipped" if another worker had already claimed the job
+    """
+    job_id, user_id = job
+    user_token = current_user.set(user_id)
+    conn = get_connection()
+    stage = "token"
+    try:
+        if not claim_job(conn, job_id):
+            return user_id, "skipped"
+        access_token = get_user_access_token(user_id)
+        if not access_token:
+            raise RuntimeError("no valid access token; the user needs to re-link")
+
+        stage = "accounts"
+        _set_job(conn, job_id, "running", stage)
+        account_ids = refresh_user_accounts(user_id, access_token)
+
+        if account_ids:
+            stage = "transactions"
+            _set_job(conn, job_id, "running", stage)
+            save_all_transactions_to_db(access_token, account_ids)
+
+            stage = "direct_debits"
+            _set_job(conn, job_id, "running", stage)
+            refresh_direct_debits(access_token, account_ids)
+
+            stage = "balances"
+            _set_job(conn, job_id, "running", stage)
+            save_daily_balance_snapshot(access_token, account_ids)
+
+            # Inside the job, so the user's LLM calls count against LLM_USER_RATE_LIMIT
+            stage = "categorise"
+            _set_job(conn, job_id, "running", stage)
+            update_all_categories_batch(account_ids)
+
+        _set_job(conn, job_id, "done", stage)
+        return user_id, "done"
+    except Exception as e:
+        conn.rollback()
+        _set_job(conn, job_id, "failed", stage, str(e))
+        print(f"Sync for {user_id} failed at {stage}: {e}", file=sys.stderr)
+        return user_id, "failed"
+    finally:
+        current_user.reset(user_token)
+        conn.close()
+
+
+#---------- COORDINATOR ----------#
+
+def run_shared_stages():
+    """Stages that work on every user's unprocessed rows at once."""
+    backfill_merchant_names()
+    score_new_transactions()
+    refresh_daily_spending()
+    update_recurring_payments()
+
+
+def run_sync_cycle(workers=SYNC_WORKERS, user_ids=None):
+    """
+    Sync every active user (or user_ids) once, then run the shared stages.
+
+    Returns:
+        dict: Number of jobs per final status
+    """
+    conn = get_connection()
+    try:
+        expired = expire_stale_jobs(conn)
+        if expired:
+            print(f"Marked {expired} stale job(s) as failed")
+        jobs = enqueue_jobs(conn, user_ids or list_users())
+    finally:
+        conn.close()
+
+    results = {"done": 0, "failed": 0, "skipped": 0}
+    if jobs:
+        print(f"Syncing {len(jobs)} user(s) on {min(workers, len(jobs))} worker(s)")
+        # Global rate limits live in shared memory so they hold across the pool;
+        # recycling workers periodically releases anything a job leaked
+        with Pool(min(workers, len(jobs)), initializer=install_buckets, initargs=(shared_buckets(),),
+                  maxtasksperchild=50) as pool:
+            for user_id, status in pool.imap_unordered(run_user_sync, jobs, chunksize=1):
+                results[status] += 1
+                print(f"{user_id}: {status} ({sum(results.values())}/{len(jobs)})")
+
+    run_shared_stages()
+    return results
+
+
+def job_statuses(user_ids=None):
+    """Latest sync job per user."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT {', '.join(JOB_COLUMNS)} FROM finance_sandbox.sync_jobs
+        WHERE id IN (SELECT MAX(id) FROM finance_sandbox.sync_jobs GROUP BY user_id)
+        ORDER BY user_id
+    """)
+    statuses = [dict(zip(JOB_COLUMNS, row)) for row in cursor.fetchall()]
+    conn.close()
+    return [status for status in statuses if not user_ids or status["user_id"] in user_ids]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync all linked users on a pool of worker processes")
+    parser.add_argument("command", choices=["run", "status"])
+    parser.add_argument("--workers", type=int, default=SYNC_WORKERS, help="run: worker processes")
+    parser.add_argument("--user", action="append", help="Only these users (repeatable)")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        print(run_sync_cycle(args.workers, args.user))
+    else:
+        for job_status in job_statuses(args.user):
+            print(job_status)
@@ -0,0 +1,218 @@
+"""
+Linked users: TrueLayer tokens and accounts stored in the database per user.
+
+The single-user setup keeps one tokens.json and one accounts.json next to
+the code. For a multi-user deployment the same data lives in the users and
+user_accounts tables, keyed by user_id, and the sync workers (see
+sync_workers) read it from there. Transactions, balances and everything
+derived from them are keyed by account_id, so user_accounts is also what
+maps data back to its owner.
+
+Usage:
+    python tenants.py add alice <auth code>       # link a user from a TrueLayer auth code
+    python tenants.py import-files default        # move tokens.json/accounts.json into the database
+    python tenants.py list
+    python tenants.py disable alice
+"""
+import argparse
+import json
+import time
+
+from api import get_accounts
+from auth import exchange_auth_code, load_tokens, refresh_tokens
+from db import get_connection
+
+
+def save_user_tokens(conn, user_id, tokens):
+    """Insert or update a user's tokens. The caller commits."""
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO finance_sandbox.users (user_id, access_token, refresh_token, expires_at)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (user_id) DO UPDATE
+        SET access_token = excluded.access_token, refresh_token = excluded.refresh_token,
+            expires_at = excluded.expires_at, updated_at = CURRENT_TIMESTAMP
+    """, (user_id, tokens["access_token"], tokens["refresh_token"], tokens["expires_at"]))
+    cursor.close()
+
+
+def get_user_access_token(user_id):
+    """
+    Valid access token for a user, refreshing (and saving) it if expired.
+
+    TrueLayer rotates the refresh token on every refresh, so the new pair is
+    committed before the access token is used.
+
+    Returns:
+        str: Access token, or None if the user is unknown or the refresh failed
+    """
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT access_token, refresh_token, expires_at FROM finance_sandbox.users WHERE user_id = %s
+        """, (user_id,))
+        row = cursor.fetchone()
+        if not row:
+            print(f"No tokens for user {user_id}")
+            return None
+        access_token, refresh_token, expires_at = row
+        if time.time() <= (expires_at or 0):
+            return access_token
+
+        new_tokens = refresh_tokens(refresh_token)
+        if not new_tokens:
+            return None
+        save_user_tokens(conn, user_id, new_tokens)
+        conn.commit()
+        return new_tokens["access_token"]
+    finally:
+        conn.close()
+
+
+def save_user_accounts(conn, user_id, accounts):
+    """
+    Replace a user's account list with a TrueLayer accounts response. The caller commits.
+
+    Returns:
+        list: The user's account IDs
+    """
+    results = accounts.get("results", [])
+    cursor = conn.cursor()
+    cursor.executemany("""
+        INSERT INTO finance_sandbox.user_accounts (account_id, user_id, display_name, account_type, currency)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (account_id) DO UPDATE
+        SET user_id = excluded.user_id, display_name = excluded.display_name,
+            account_type = excluded.account_type, currency = excluded.currency, updated_at = CURRENT_TIMESTAMP
+    """, [(acc["account_id"], user_id, acc.get("display_name"), acc.get("account_type"), acc.get("currency"))
+          for acc in results])
+    account_ids = [acc["account_id"] for acc in results]
+    # Accounts the user has unlinked stop being synced; their history stays
+    keep = f"AND account_id NOT IN ({', '.join(['%s'] * len(account_ids))})" if account_ids else ""
+    cursor.execute(f"DELETE FROM finance_sandbox.user_accounts WHERE user_id = %s {keep}",
+                   (user_id, *account_ids))
+    cursor.close()
+    return account_ids
+
+
+def refresh_user_accounts(user_id, access_token):
+    """
+    Fetch a user's accounts from TrueLayer and store them.
+
+    Returns:
+        list: Account IDs, or the stored ones if the API call failed
+    """
+    accounts = get_accounts(access_token)
+    if not accounts:
+        print(f"Failed to get accounts for user {user_id}; using stored accounts")
+        return get_user_account_ids(user_id)
+
+    conn = get_connection()
+    try:
+        account_ids = save_user_accounts(conn, user_id, accounts)
+        conn.commit()
+    finally:
+        conn.close()
+    return account_ids
+
+
+def get_user_account_ids(user_id):
+    """Account IDs stored for a user."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT account_id FROM finance_sandbox.user_accounts WHERE user_id = %s ORDER BY account_id",
+                   (user_id,))
+    account_ids = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return account_ids
+
+
+def list_users(active_only=True):
+    """User IDs, optionally only those with syncing enabled."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT user_id FROM finance_sandbox.users {"WHERE active = TRUE" if active_only else ""} ORDER BY user_id
+    """)
+    users = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return users
+
+
+def set_user_active(user_id, active):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE finance_sandbox.users SET active = %s, updated_at = CURRENT_TIMESTAMP WHERE user_id = %s",
+                   (active, user_id))
+    updated = cursor.rowcount
+    conn.commit()
+    conn.close()
+    return updated
+
+
+def add_user(user_id, auth_code):
+    """
+    Link a user: exchange their TrueLayer auth code and store tokens and accounts.
+
+    Returns:
+        list: The user's account IDs, or None if the exchange failed
+    """
+    tokens = exchange_auth_code(auth_code)
+    if not tokens:
+        return None
+    accounts = get_accounts(tokens["access_token"]) or {}
+
+    conn = get_connection()
+    try:
+        save_user_tokens(conn, user_id, tokens)
+        account_ids = save_user_accounts(conn, user_id, accounts)
+        conn.commit()
+    finally:
+        conn.close()
+    return account_ids
+
+
+def import_local_files(user_id="default"):
+    """
+    Store the single-user tokens.json and accounts.json under user_id.
+
+    Returns:
+        list: The imported account IDs, or None if there were no tokens
+    """
+    tokens = load_tokens()
+    if not tokens:
+        return None
+    try:
+        with open("accounts.json", "r") as f:
+            accounts = json.load(f)
+    except FileNotFoundError:
+        print("No accounts file found")
+        accounts = {}
+
+    conn = get_connection()
+    try:
+        save_user_tokens(conn, user_id, tokens)
+        account_ids = save_user_accounts(conn, user_id, accounts)
+        conn.commit()
+    finally:
+        conn.close()
+    return account_ids
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage linked users")
+    parser.add_argument("command", choices=["add", "import-files", "list", "enable", "disable"])
+    parser.add_argument("user_id", nargs="?", default="default")
+    parser.add_argument("auth_code", nargs="?", help="add: TrueLayer authorization code")
+    args = parser.parse_args()
+
+    if args.command == "add":
+        print(f"Linked {args.user_id}: {add_user(args.user_id, args.auth_code)}")
+    elif args.command == "import-files":
+        print(f"Imported {args.user_id}: {import_local_files(args.user_id)}")
+    elif args.command in ("enable", "disable"):
+        print(f"Updated {set_user_active(args.user_id, args.command == 'enable')} user(s)")
+    else:
+        for user in list_users(active_only=False):
+            print(user, get_user_account_ids(user))
@@ -0,0 +1,16 @@
+"""Keeps the entry points within their import-time budgets (see import_budget)."""
+import pytest
+
+from import_budget import HEAVY_MODULES, IMPORT_BUDGETS, check_budgets, measure_imports
+
+
+def test_entry_points_within_budget():
+    assert check_budgets(runs=1)
+
+
+@pytest.mark.parametrize("entry_point", list(IMPORT_BUDGETS))
+def test_entry_point_imports_no_heavy_module(entry_point):
+    modules, _ = IMPORT_BUDGETS[entry_point]
+    _, imports = measure_imports(modules)
+    imported = {name for _, name in imports}
+    assert not [name for name in HEAVY_MODULES if name in imported]
@@ -0,0 +1,22 @@
+"""Regression examples for merchant normalisation (see merchants.NOISE_PATTERNS)."""
+import pytest
+
+from merchants import normalise_merchants
+
+
+@pytest.mark.parametrize("description, merchant", [
+    # Reference tokens are stripped only when they hold a digit
+    ("ID CARD SERVICES", "Id Card Services"),
+    ("AMAZON REF 4X91B2", "Amazon"),
+    ("NETFLIX AUTH: 558201", "Netflix"),
+    # Leading hex references go, names ending in digits stay
+    ("18DB38 BETROPOLIS", "Betropolis"),
+    ("ABC123 STORES", "Abc123 Stores"),
+    ("CARD PAYMENT TO TESCO STORES 3012 ON 12 MAR", "Tesco"),
+])
+def test_normalise_merchants(description, merchant):
+    assert normalise_merchants([description]).tolist() == [merchant]
+
+
+def test_normalise_merchants_keeps_order_and_nulls():
+    assert normalise_merchants(["LIDL GB", None, "LIDL GB"]).tolist() == ["Lidl", None, "Lidl"]
@@ -0,0 +1,178 @@
+"""
+Gap-filling and downsampling for balance history charts.
+
+Balance snapshots are daily, but days go missing (a sync that didn't run, an
+account linked later), and a multi-year, multi-account chart would otherwise
+ship every snapshot to the browser. Series are forward-filled onto a regular
+daily grid, then reduced to at most CHART_POINTS points per line: roughly
+one per pixel of a chart, which is all plotly can draw anyway.
+
+Two downsampling methods:
+
+- "lttb" (Largest-Triangle-Three-Buckets) keeps the points that best preserve
+  the line's visual shape. The default.
+- "minmax" keeps each bucket's lowest and highest balance, so no dip below
+  zero or peak is ever hidden; cheaper, a little more jagged.
+
+Everything is vectorised with numpy except LTTB's walk over buckets, which is
+inherently sequential but runs once per output point, not per snapshot.
+Results are cached by the callers per (accounts, range, resolution): see
+AnalyticsEngine.total_balance_history and the dashboard's load_panel.
+"""
+import os
+from datetime import date
+from lazy_imports import np, pd
+
+# Target points per chart line (about one per horizontal pixel)
+CHART_POINTS = int(os.getenv("CHART_POINTS", 800))
+DOWNSAMPLE_METHOD = os.getenv("BALANCE_DOWNSAMPLE", "lttb")
+
+
+#---------- GAP FILLING ----------#
+
+def forward_fill(codes, days, values, start, end, account_count):
+    """
+    Forward-fill every account's snapshots onto one daily grid.
+
+    Args:
+        codes (np.ndarray): Account code (0..account_count-1) per snapshot
+        days (np.ndarray): Snapshot date per snapshot (datetime64[D]), any order
+        values (np.ndarray): Balance per snapshot
+        start (np.datetime64): First grid day
+        end (np.datetime64): Last grid day
+        account_count (int): Number of accounts
+
+    Returns:
+        tuple: (grid of datetime64[D] days, accounts x days array of balances;
+               NaN before an account's first snapshot)
+    """
+    grid = np.arange(start, end + np.timedelta64(1, "D"), dtype="datetime64[D]")
+    origin = min(days.min(), start)
+    span = int((end - origin).astype(np.int64)) + 1
+
+    # One sort over (account, day) keys; each grid cell then finds the latest
+    # snapshot at or before it with a single searchsorted
+    keys = codes.astype(np.int64) * span + (days - origin).astype(np.int64)
+    order = np.argsort(keys, kind="stable")
+    keys, values = keys[order], values[order]
+
+    accounts = np.arange(account_count, dtype=np.int64)[:, None]
+    grid_keys = accounts * span + (grid - origin).astype(np.int64)[None, :]
+    latest = np.searchsorted(keys, grid_keys, side="right") - 1
+    found = (latest >= 0) & (keys[np.maximum(latest, 0)] // span == accounts)
+    return grid, np.where(found, values[np.maximum(latest, 0)], np.nan)
+
+
+#---------- DOWNSAMPLING ----------#
+
+def lttb(x, y, points):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    Args:
+        x (np.ndarray): Increasing x values (numeric)
+        y (np.ndarray): y values
+        points (int): Points to keep
+
+    Returns:
+        np.ndarray: Indices of the points to keep, in order
+    """
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+
+    # First and last points are always kept; the rest are split into points - 2 buckets
+    edges = np.append(np.linspace(1, n - 1, points - 1).astype(np.int64), n)
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(points - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        next_x = x[stop:edges[bucket + 2]].mean()
+        next_y = y[stop:edges[bucket + 2]].mean()
+        # Twice the area of the triangle (previous pick, candidate, next bucket's mean)
+        areas = np.abs((x[previous] - next_x) * (y[start:stop] - y[previous])
+                       - (x[previous] - x[start:stop]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def minmax_downsample(y, points):
+    """
+    Keep the lowest and highest point of each bucket, plus the endpoints.
+
+    Returns:
+        np.ndarray: Indices of the points to keep, in order
+    """
+    n = len(y)
+    if points >= n or points < 4:
+        return np.arange(n)
+
+    buckets = (np.arange(n) * ((points - 2) // 2)) // n
+    # Sorted by bucket, then value: each bucket's first entry is its min, last its max
+    order = np.lexsort((y, buckets))
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], n] - 1
+    return np.unique(np.r_[0, order[starts], order[ends], n - 1])
+
+
+def downsample(x, y, points, method=DOWNSAMPLE_METHOD):
+    """Indices of the points to keep from one series ("lttb" or "minmax")."""
+    if method == "minmax":
+        return minmax_downsample(y, points)
+    if method == "lttb":
+        return lttb(x.astype(np.float64), y, points)
+    raise ValueError(f"Unknown downsampling method {method!r}; use 'lttb' or 'minmax'")
+
+
+#---------- BALANCE SERIES ----------#
+
+def balance_series(snapshots, start=None, points=CHART_POINTS, method=DOWNSAMPLE_METHOD, per_account=False,
+                   end=None):
+    """
+    Chart-ready balance history from raw snapshots.
+
+    Args:
+        snapshots (pd.DataFrame): account_id, snapshot_date, current_balance rows. To
+            fill the start of a window, include each account's last snapshot before start.
+        start (date): First day to show (None: from the first snapshot)
+        points (int): Maximum points per line
+        method (str): "lttb" or "minmax"
+        per_account (bool): One line per account instead of the total
+        end (date): Last day to show (None: today, or the last snapshot if that is later),
+            so the latest known balance is carried to the end of the window
+
+    Returns:
+        pd.DataFrame: Total: current_balance, snapshot_date.
+                      Per account: account_id, snapshot_date, current_balance.
+    """
+    columns = ["account_id", "snapshot_date", "current_balance"] if per_account \
+        else ["current_balance", "snapshot_date"]
+    if snapshots.empty:
+        return pd.DataFrame(columns=columns)
+
+    days = pd.to_datetime(snapshots["snapshot_date"]).to_numpy().astype("datetime64[D]")
+    values = snapshots["current_balance"].to_numpy(dtype=np.float64)
+    codes, accounts = pd.factorize(snapshots["account_id"], sort=True)
+    first = days.min() if start is None else max(days.min(), np.datetime64(start, "D"))
+    last = max(days.max(), first, np.datetime64(end or date.today(), "D"))
+    grid, filled = forward_fill(codes, days, values, first, last, len(accounts))
+
+    if not per_account:
+        present = ~np.isnan(filled).all(axis=0)
+        grid, totals = grid[present], np.nansum(filled, axis=0)[present]
+        keep = downsample(grid.astype(np.int64), totals, points, method)
+        return pd.DataFrame({"current_balance": totals[keep], "snapshot_date": grid[keep].astype("datetime64[ns]")})
+
+    frames = []
+    for code, account_id in enumerate(accounts):
+        present = ~np.isnan(filled[code])
+        account_grid, balances = grid[present], filled[code][present]
+        keep = downsample(account_grid.astype(np.int64), balances, points, method)
+        frames.append(pd.DataFrame({
+            "account_id": account_id,
+            "snapshot_date": account_grid[keep].astype("datetime64[ns]"),
+            "current_balance": balances[keep],
+        }))
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,331 @@
+"""
+Trend analytics computed in the database with window functions.
+
+- Rolling 7- and 30-day spend per day
+- Month-over-month and year-over-year change per category
+- Running balance per account, anchored on the latest balance snapshot
+
+Each is one query: the database aggregates and windows in a single pass
+instead of shipping raw rows to pandas, and the insights prompt gets the
+deltas ready-made instead of asking the model to do arithmetic.
+
+Spend is read from daily_spending, a per-day, per-category aggregate kept
+current from change_log (see refresh_daily_spending), whenever it has
+caught up with the latest transaction changes; otherwise the same
+aggregate is computed inline from transactions. Postgres and SQLite
+differ in how a RANGE frame is offset over dates, so those frames are
+built per backend.
+
+Usage:
+    python trends.py refresh [--full]     # bring daily_spending up to date
+    python trends.py rolling --period "Last 3 months"
+    python trends.py categories --period "Last 6 months"
+"""
+import argparse
+from datetime import datetime, timedelta
+
+from change_events import get_unconsumed_changes, mark_changes_consumed, publish_change
+from db import get_connection, read_connection
+from storage import get_backend
+from timeseries import balance_series, CHART_POINTS
+from lazy_imports import pd
+
+TIME_FRAME_DAYS = {
+    "Last 7 days": 7,
+    "Last 30 days": 30,
+    "Last 3 months": 90,
+    "Last 6 months": 180,
+    "All time": None
+}
+ROLLING_WINDOWS = (7, 30)
+
+CONSUMER = "daily_spending"
+# Transaction changes that move amounts or categories; anomaly scores and
+# merchant names don't affect spend per category
+SPENDING_EVENTS = {"ingest", "import", "archive_load", "archive", "categorise", "recategorise"}
+
+_DAILY_FROM_TRANSACTIONS = """
+    SELECT transaction_date AS spend_date, COALESCE(category, 'Uncategorized') AS category,
+           -SUM(amount) AS spending, COUNT(*) AS transactions
+    FROM finance_sandbox.transactions
+    WHERE amount < 0 AND transaction_date >= %s AND transaction_date <= %s
+    GROUP BY transaction_date, COALESCE(category, 'Uncategorized')
+"""
+
+
+def _cutoff(time_frame):
+    days = TIME_FRAME_DAYS[time_frame]
+    return (datetime.now() - timedelta(days=days)).date() if days else None
+
+
+#---------- AGGREGATE ----------#
+
+def refresh_daily_spending(full=False):
+    """
+    Bring daily_spending up to date with transactions.
+
+    Only the date range touched by new spending changes is re-aggregated;
+    the first run (or full=True, or a change without a date range) rebuilds
+    everything. Rows, watermark and change event commit together.
+
+    Returns:
+        int: Aggregate rows written
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        changes, last_horizon, horizon = get_unconsumed_changes(conn, CONSUMER, "transactions")
+        spending_changes = [change for change in changes if change["event"] in SPENDING_EVENTS]
+
+        date_from, date_to = "0001-01-01", "9999-12-31"
+        if not full and last_horizon:
+            if not spending_changes:
+                date_from = None
+            elif all(change["date_from"] and change["date_to"] for change in spending_changes):
+                date_from = min(change["date_from"] for change in spending_changes)
+                date_to = max(change["date_to"] for change in spending_changes)
+
+        written = 0
+        if date_from:
+            cursor.execute("DELETE FROM finance_sandbox.daily_spending WHERE spend_date BETWEEN %s AND %s",
+                           (date_from, date_to))
+            cursor.execute(f"""
+                INSERT INTO finance_sandbox.daily_spending (spend_date, category, spending, transactions)
+                {_DAILY_FROM_TRANSACTIONS}
+            """, (date_from, date_to))
+            written = cursor.rowcount
+            publish_change(conn, "daily_spending", "refresh", None,
+                           None if date_from == "0001-01-01" else date_from,
+                           None if date_to == "9999-12-31" else date_to, written)
+        if changes:
+            mark_changes_consumed(conn, CONSUMER, horizon)
+        conn.commit()
+    finally:
+        conn.close()
+
+    print(f"Daily spending: {written} rows re-aggregated")
+    return written
+
+
+def _daily_spending_sql(cursor, since):
+    """
+    FROM-clause source of (spend_date, category, spending, transactions) from since on.
+
+    Returns:
+        tuple: (SQL, params)
+    """
+    cursor.execute("SELECT last_change_id FROM finance_sandbox.change_consumers WHERE consumer = %s", (CONSUMER,))
+    row = cursor.fetchone()
+    # Spending changes the aggregate hasn't consumed yet
+    cursor.execute(f"""
+        SELECT 1 FROM finance_sandbox.change_log
+        WHERE table_name = 'transactions' AND event IN ({', '.join(['%s'] * len(SPENDING_EVENTS))})
+        AND {get_backend().CHANGE_ORDER} >= %s
+        LIMIT 1
+    """, (*sorted(SPENDING_EVENTS), row[0] if row else 0))
+    pending = cursor.fetchone()
+
+    since = since.isoformat() if since else "0001-01-01"
+    if row and not pending:
+        return ("SELECT spend_date, category, spending, transactions FROM finance_sandbox.daily_spending "
+                "WHERE spend_date >= %s", (since,))
+    return _DAILY_FROM_TRANSACTIONS, (since, "9999-12-31")
+
+
+#---------- QUERIES ----------#
+
+def get_rolling_spending(time_frame="Last 3 months"):
+    """
+    Spend per day with trailing 7- and 30-day totals.
+
+    Windows are RANGE frames over dates, so days without spending count as
+    zero rather than stretching the window back over more days.
+
+    Returns:
+        pd.DataFrame: spend_date, spending, rolling_7d, rolling_30d
+    """
+    cutoff = _cutoff(time_frame)
+    # Windows at the start of the period need the days before it
+    since = cutoff - timedelta(days=max(ROLLING_WINDOWS) - 1) if cutoff else None
+
+    if get_backend().name == "sqlite":
+        order, offset = "julianday(spend_date)", "{}"
+    else:
+        order, offset = "spend_date", "INTERVAL '{} days'"
+    windows = ",\n".join(
+        f"SUM(spending) OVER (ORDER BY {order} RANGE BETWEEN {offset.format(days - 1)} PRECEDING AND CURRENT ROW)"
+        f" AS rolling_{days}d"
+        for days in ROLLING_WINDOWS
+    )
+
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        source, params = _daily_spending_sql(cursor, since)
+        cursor.execute(f"""
+            WITH daily AS (
+                SELECT spend_date, SUM(spending) AS spending
+                FROM ({source}) d
+                GROUP BY spend_date
+            ), rolling AS (
+                SELECT spend_date, spending,
+                {windows}
+                FROM daily
+            )
+            SELECT * FROM rolling
+            WHERE spend_date >= %s
+            ORDER BY spend_date
+        """, (*params, cutoff.isoformat() if cutoff else "0001-01-01"))
+        columns = [desc[0] for desc in cursor.description]
+        data = cursor.fetchall()
+        cursor.close()
+
+    df = pd.DataFrame(data, columns=columns)
+    df["spend_date"] = pd.to_datetime(df["spend_date"])
+    for column in columns[1:]:
+        df[column] = df[column].astype(float)
+    return df
+
+
+def get_category_changes(time_frame="Last 6 months"):
+    """
+    Spend per month and category against the previous month and the same month last year.
+
+    The comparisons are RANGE frames over a month number, so a category with
+    no spend last month compares against nothing rather than against
+    whichever earlier month it last appeared in.
+
+    Returns:
+        pd.DataFrame: month, category, spending, previous_month, mom_change, mom_pct,
+                      previous_year, yoy_change, yoy_pct (pct: None where there is no base)
+    """
+    cutoff = _cutoff(time_frame)
+    first_month = cutoff.replace(day=1) if cutoff else None
+    # Year-over-year needs the twelve months before the first one shown
+    since = first_month.replace(year=first_month.year - 1) if first_month else None
+
+    if get_backend().name == "sqlite":
+        month_number = "CAST(strftime('%%Y', spend_date) AS INTEGER) * 12 + CAST(strftime('%%m', spend_date) AS INTEGER)"
+    else:
+        month_number = "CAST(EXTRACT(YEAR FROM spend_date) * 12 + EXTRACT(MONTH FROM spend_date) AS INTEGER)"
+
+    def compare(months):
+        return (f"SUM(spending) OVER (PARTITION BY category ORDER BY month_number "
+                f"RANGE BETWEEN {months} PRECEDING AND {months} PRECEDING)")
+
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        source, params = _daily_spending_sql(cursor, since)
+        cursor.execute(f"""
+            WITH monthly AS (
+                SELECT {month_number} AS month_number, MIN(TO_CHAR(spend_date, 'YYYY-MM')) AS month,
+                       category, SUM(spending) AS spending
+                FROM ({source}) d
+                GROUP BY {month_number}, category
+            ), compared AS (
+                SELECT month_number, month, category, spending,
+                       {compare(1)} AS previous_month,
+                       {compare(12)} AS previous_year
+                FROM monthly
+            )
+            SELECT month, category, spending,
+                   previous_month, spending - previous_month AS mom_change,
+                   ROUND(100.0 * (spending - previous_month) / NULLIF(previous_month, 0), 1) AS mom_pct,
+                   previous_year, spending - previous_year AS yoy_change,
+                   ROUND(100.0 * (spending - previous_year) / NULLIF(previous_year, 0), 1) AS yoy_pct
+            FROM compared
+            WHERE month >= %s
+            ORDER BY month, spending DESC
+        """, (*params, first_month.strftime("%Y-%m") if first_month else "0000-00"))
+        columns = [desc[0] for desc in cursor.description]
+        data = cursor.fetchall()
+        cursor.close()
+
+    df = pd.DataFrame(data, columns=columns)
+    for column in columns[2:]:
+        df[column] = df[column].astype(float)
+    return df
+
+
+def get_latest_category_changes(time_frame="Last 6 months", limit=10):
+    """The latest month's categories with the biggest month-over-month moves."""
+    changes = get_category_changes(time_frame)
+    if changes.empty:
+        return changes
+    latest = changes[changes["month"] == changes["month"].max()]
+    order = latest["mom_change"].abs().fillna(latest["spending"]).sort_values(ascending=False).index
+    return latest.loc[order].head(limit).reset_index(drop=True)
+
+
+def get_running_balances(time_frame="All time", points=CHART_POINTS, account_ids=None):
+    """
+    End-of-day balance per account, reconstructed from transactions.
+
+    A running SUM(amount) per account, shifted so it matches the account's
+    latest balance snapshot on that snapshot's date. That gives a balance
+    for every day with transactions, including the years before snapshots
+    started. Accounts with no snapshot start from zero. Gap-filled and
+    downsampled like the snapshot charts (see timeseries).
+
+    Returns:
+        pd.DataFrame: account_id, balance_date, running_balance
+    """
+    cutoff = _cutoff(time_frame)
+    conditions, params = [], []
+    if account_ids:
+        conditions.append(f"t.account_id IN ({', '.join(['%s'] * len(account_ids))})")
+        params.extend(account_ids)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            WITH anchors AS (
+                SELECT b.account_id, b.snapshot_date, b.current_balance
+                FROM finance_sandbox.balance_history b
+                WHERE b.snapshot_date = (
+                    SELECT MAX(p.snapshot_date) FROM finance_sandbox.balance_history p
+                    WHERE p.account_id = b.account_id
+                )
+            ), running AS (
+                SELECT t.account_id, t.transaction_date,
+                       COALESCE(a.current_balance, 0)
+                       + SUM(t.amount) OVER (PARTITION BY t.account_id ORDER BY t.timestamp, t.transaction_id
+                                             ROWS UNBOUNDED PRECEDING)
+                       - SUM(CASE WHEN t.transaction_date <= a.snapshot_date THEN t.amount ELSE 0 END)
+                             OVER (PARTITION BY t.account_id) AS running_balance,
+                       ROW_NUMBER() OVER (PARTITION BY t.account_id, t.transaction_date
+                                          ORDER BY t.timestamp DESC, t.transaction_id DESC) AS day_rank
+                FROM finance_sandbox.transactions t
+                LEFT JOIN anchors a ON a.account_id = t.account_id
+                {where}
+            )
+            SELECT account_id, transaction_date, running_balance
+            FROM running
+            WHERE day_rank = 1
+        """, tuple(params))
+        data = cursor.fetchall()
+        cursor.close()
+
+    # Each account's last day before the cutoff is kept so its line starts filled
+    snapshots = pd.DataFrame(data, columns=["account_id", "snapshot_date", "current_balance"])
+    if cutoff and not snapshots.empty:
+        dates = pd.to_datetime(snapshots["snapshot_date"])
+        before = snapshots[dates < pd.Timestamp(cutoff)].sort_values("snapshot_date").groupby("account_id").tail(1)
+        snapshots = pd.concat([before, snapshots[dates >= pd.Timestamp(cutoff)]], ignore_index=True)
+    series = balance_series(snapshots, cutoff, points, per_account=True)
+    return series.rename(columns={"snapshot_date": "balance_date", "current_balance": "running_balance"})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rolling and period-over-period spending trends")
+    parser.add_argument("command", choices=["refresh", "rolling", "categories"])
+    parser.add_argument("--full", action="store_true", help="refresh: rebuild every day")
+    parser.add_argument("--period", default="Last 6 months", choices=list(TIME_FRAME_DAYS))
+    args = parser.parse_args()
+
+    if args.command == "refresh":
+        refresh_daily_spending(full=args.full)
+    elif args.command == "rolling":
+        print(get_rolling_spending(args.period).to_string(index=False))
+    else:
+        print(get_category_changes(args.period).to_string(index=False))